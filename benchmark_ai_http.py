@@ -0,0 +1,107 @@
+"""Benchmark: per-call aiohttp sessions vs pooled session in AIImageGenerator.
+
+Starts a local stub server that mimics the Gemini and DALL-E APIs
+(including the image download) and measures p50/p95 latency of one
+generation round-trip (Gemini -> DALL-E -> image download).
+
+Usage:
+    python benchmark_ai_http.py [requests]
+"""
+import asyncio
+import os
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+from statistics import quantiles
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from aiohttp import web
+from PIL import Image
+
+from services.ai_generator import AIImageGenerator
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+
+def make_stub_app() -> web.Application:
+    """Build stub app with Gemini, DALL-E and image CDN endpoints."""
+    buffer = BytesIO()
+    Image.new("RGB", (256, 448), (18, 74, 90)).save(buffer, "PNG")
+    image_bytes = buffer.getvalue()
+
+    async def gemini(request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({
+            "candidates": [{"content": {"parts": [{"text": "Short dark hair, glasses."}]}}]
+        })
+
+    async def dalle(request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({"data": [{"url": f"http://{HOST}:{PORT}/image.png"}]})
+
+    async def image(request: web.Request) -> web.Response:
+        return web.Response(body=image_bytes, content_type="image/png")
+
+    app = web.Application(client_max_size=20 * 1024 * 1024)
+    app.router.add_post("/gemini", gemini)
+    app.router.add_post("/dalle", dalle)
+    app.router.add_get("/image.png", image)
+    return app
+
+
+async def run_round_trips(generator: AIImageGenerator, requests: int, pooled: bool) -> list:
+    """Run sequential Gemini + DALL-E round-trips, return latencies in ms."""
+    b64_image = "A" * 200_000  # ~150KB photo after base64
+    latencies = []
+
+    for _ in range(requests):
+        start = time.perf_counter()
+        description = await generator._ask_gemini("Describe", b64_image)
+        if not pooled:
+            # Old behaviour: every call opened and closed its own session
+            await generator.close()
+        image_file = await generator._generate_with_dalle(description)
+        image_file.close()
+        if not pooled:
+            await generator.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    await generator.close()
+    return latencies
+
+
+def report(name: str, latencies: list) -> None:
+    """Print p50/p95 for a run."""
+    cuts = quantiles(latencies, n=100)
+    print(f"{name:<22} p50 {cuts[49]:7.2f} ms   p95 {cuts[94]:7.2f} ms")
+
+
+async def main(requests: int = 200):
+    """Start stub server and compare both modes."""
+    runner = web.AppRunner(make_stub_app())
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+
+    try:
+        generator = AIImageGenerator()
+        generator.gemini_url = f"http://{HOST}:{PORT}/gemini"
+        generator.dalle_url = f"http://{HOST}:{PORT}/dalle"
+
+        # Warm up stub server and interpreter
+        await run_round_trips(generator, 5, pooled=True)
+
+        per_call = await run_round_trips(generator, requests, pooled=False)
+        pooled = await run_round_trips(generator, requests, pooled=True)
+
+        report("Session per call:", per_call)
+        report("Pooled session:", pooled)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,124 @@
+"""Benchmark: serial broadcast loop vs rate-limited Broadcaster.
+
+Starts a local fake Bot API that answers copyMessage after a simulated
+network delay, enforces Telegram's ~30 msg/s per-bot limit with 429
+RetryAfter responses and returns 403 for a share of "blocked" users, then
+checks that every blocked user was reported as blocked.
+
+Usage:
+    python benchmark_broadcast.py [recipients]
+"""
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "42:benchmark")
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from services.broadcast import Broadcaster, TokenBucket, copy_message_sender
+
+HOST = "127.0.0.1"
+PORT = 8767
+LATENCY = 0.08          # Simulated round-trip to api.telegram.org
+LIMIT_PER_SECOND = 30   # Telegram per-bot broadcast limit
+BLOCKED_EVERY = 10      # Every 10th user blocked the bot
+
+
+class FakeBotApi:
+    """copyMessage endpoint with a sliding-window rate limit."""
+
+    def __init__(self):
+        self.accepted = deque()
+        self.too_many_requests = 0
+
+    async def copy_message(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        await asyncio.sleep(LATENCY)
+
+        now = time.monotonic()
+        while self.accepted and now - self.accepted[0] > 1.0:
+            self.accepted.popleft()
+        if len(self.accepted) >= LIMIT_PER_SECOND:
+            self.too_many_requests += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            }, status=429)
+        self.accepted.append(now)
+
+        if int(data["chat_id"]) % BLOCKED_EVERY == 0:
+            return web.json_response({
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user"
+            }, status=403)
+        return web.json_response({"ok": True, "result": {"message_id": 1}})
+
+
+async def old_loop(bot: Bot, user_ids: list) -> tuple:
+    """Previous execute_broadcast loop: serial copy + fixed sleep."""
+    sent = failed = 0
+    for user_id in user_ids:
+        try:
+            await bot.copy_message(chat_id=user_id, from_chat_id=1, message_id=1)
+            sent += 1
+            await asyncio.sleep(0.05)
+        except Exception:
+            failed += 1
+    return sent, failed
+
+
+async def main(recipients: int = 600):
+    """Run both strategies against the fake API."""
+    api = FakeBotApi()
+    app = web.Application()
+    app.router.add_post("/bot{token}/copyMessage", api.copy_message)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://{HOST}:{PORT}"))
+    bot = Bot(os.environ["BOT_TOKEN"], session=session)
+    user_ids = list(range(1, recipients + 1))
+
+    try:
+        start = time.perf_counter()
+        sent, failed = await old_loop(bot, user_ids)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Serial loop:  {elapsed:6.1f}s  {recipients / elapsed:5.1f} msg/s  "
+            f"sent {sent}, failed {failed} (blocked users counted as failures)"
+        )
+
+        await asyncio.sleep(1.1)  # Let the fake limit window drain
+        api.too_many_requests = 0
+        broadcaster = Broadcaster(limiter=TokenBucket(rate=28.0, capacity=1.0), workers=16)
+        result = await broadcaster.run(user_ids, copy_message_sender(bot, 1, 1))
+        print(
+            f"Broadcaster:  {result.elapsed:6.1f}s  {result.rate:5.1f} msg/s  "
+            f"sent {result.sent}, blocked {result.blocked}, failed {result.failed}, "
+            f"429s {api.too_many_requests}"
+        )
+        print(f"Telegram limit: {LIMIT_PER_SECOND} msg/s")
+
+        # aiogram picks the error class from the HTTP status: 403 must come out as blocked
+        blocked_ids = [user_id for user_id in user_ids if user_id % BLOCKED_EVERY == 0]
+        assert result.blocked == len(blocked_ids), f"blocked {result.blocked}, expected {len(blocked_ids)}"
+        assert sorted(result.unreachable_ids) == blocked_ids, "blocked users missing from unreachable_ids"
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 600))
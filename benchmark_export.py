@@ -0,0 +1,148 @@
+"""Benchmark: per-user answer queries vs one streamed query for the CSV export.
+
+Fills a throwaway database with participants and quiz answers, then builds
+the export with the previous implementation (copied below) and with
+export_participants(), reporting time, peak Python memory and output size.
+Also checks that a part limit derived from the export size splits it and
+that every part (plain and gzipped) carries the header and all rows
+exactly once.
+
+Usage:
+    python benchmark_export.py [participants]
+"""
+import asyncio
+import csv
+import gzip
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_tmp.name) / 'export.db'}"
+
+from sqlalchemy import insert
+
+from database.crud import BULK_BATCH_SIZE, QuizAnswerCRUD, UserCRUD
+from database.engine import async_session_maker, engine, init_db
+from database.models import QuizAnswer, User
+from services.data_export import GZIP_PENDING_MARGIN, export_participants
+
+
+async def old_export() -> bytes:
+    """Previous export_data body: all users in memory, one answers query per user."""
+    async with async_session_maker() as session:
+        users = await UserCRUD.get_all_participants(session)
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow([
+            'ID', 'Username', 'Full Name', 'Gender', 'Quiz Completed',
+            'Photo Uploaded', 'Is Winner', 'Created At'
+        ])
+        for user in users:
+            # One answers query per user, as before (they never reached the CSV)
+            await QuizAnswerCRUD.get_user_answers(session, user.id)
+            writer.writerow([
+                user.id,
+                user.username or '',
+                user.full_name or '',
+                user.gender or '',
+                'Да' if user.quiz_completed else 'Нет',
+                'Да' if user.photo_uploaded else 'Нет',
+                'Да' if user.is_winner else 'Нет',
+                user.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            ])
+    return output.getvalue().encode('utf-8-sig')
+
+
+async def fill(participants: int):
+    """Create participants (and a few users without quiz) with 5 answers each."""
+    users = [
+        {"id": 1000 + i, "pride_gift_id": 10000 + i, "username": f"user{i}", "full_name": f"Участник {i}",
+         "gender": "male" if i % 2 else "female", "quiz_completed": i % 10 != 0, "photo_uploaded": True}
+        for i in range(participants)
+    ]
+    answers = [
+        {"user_id": user["id"], "question_number": q, "answer": f"Ответ {q}, вариант \"{user['id'] % 4}\""}
+        for user in users if user["quiz_completed"] for q in range(1, 6)
+    ]
+    async with async_session_maker() as session:
+        for rows, model in ((users, User), (answers, QuizAnswer)):
+            for i in range(0, len(rows), BULK_BATCH_SIZE):
+                await session.execute(insert(model), rows[i:i + BULK_BATCH_SIZE])
+        await session.commit()
+    return sum(user["quiz_completed"] for user in users)
+
+
+async def measure(name: str, call):
+    """Run call once, print time and peak traced memory."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = await call()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:8} {elapsed * 1000:8.1f} ms  peak memory {peak / 1024 / 1024:6.1f} MiB")
+    return result
+
+
+def read_parts(export) -> list:
+    """Decode all parts back into CSV rows, checking each starts with the header."""
+    rows = []
+    for part in export.parts:
+        data = part.file.read()
+        if part.filename.endswith(".gz"):
+            data = gzip.decompress(data)
+        part_rows = list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+        assert part_rows[0][0] == "ID", f"{part.filename} has no header"
+        assert len(part_rows) - 1 == part.rows
+        rows.extend(part_rows[1:])
+    return rows
+
+
+async def main(participants: int = 20000):
+    """Fill database, compare implementations, check splitting."""
+    await init_db()
+    expected = await fill(participants)
+    print(f"{expected} participants, 5 answers each\n")
+
+    old = await measure("old", old_export)
+    export = await measure("streamed", export_participants)
+    print(f"\nold: {len(old)} bytes without answers; streamed: {export.size} bytes with answers")
+    assert len(read_parts(export)) == expected
+    export.close()
+
+    for compress in (False, True):
+        # Parts of about a quarter of the export; gzip part sizes are estimated with the margin on top
+        full = await export_participants(compress=compress)
+        size = full.size
+        full.close()
+        if compress:
+            limit = GZIP_PENDING_MARGIN + max(size // 4, 16 * 1024)
+        else:
+            limit = max(size // 4, 1024)
+        export = await export_participants(compress=compress, part_max_bytes=limit)
+        rows = read_parts(export)
+        assert all(part.size <= limit for part in export.parts)
+        if size > 2 * (limit - (GZIP_PENDING_MARGIN if compress else 0)):
+            assert len(export.parts) > 1, f"{size} bytes were not split at {limit}"
+        ids = [int(row[0]) for row in rows]
+        assert ids == sorted(set(ids)) and len(ids) == expected
+        assert all(row[8].startswith("Ответ 1") for row in rows)
+        print(
+            f"{'gzip' if compress else 'plain':5} split: {len(export.parts)} parts, "
+            f"largest {max(p.size for p in export.parts)} bytes, {export.rows} rows in {export.elapsed * 1000:.0f} ms"
+        )
+        export.close()
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    asyncio.run(main(*args))
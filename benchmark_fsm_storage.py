@@ -0,0 +1,197 @@
+"""Benchmark: FSM storage memory and persistence, MemoryStorage vs DatabaseStorage.
+
+Starts quiz conversations that are then abandoned (state plus answers,
+some admin dialogs with a user listing) through the aiogram storage API,
+and measures memory held by each storage (tracemalloc), time per update
+(including the commit) and commits per update. aiogram's RedisStorage is
+measured the same way when the redis package is installed and a server
+answers at FSM_REDIS_URL (e.g. a local redis-server), and skipped
+otherwise. Then checks that a new DatabaseStorage (a restart) sees the
+same states, bulk-inserts a large number of idle abandoned rows, reads
+random keys through a fresh storage to show memory stays bounded by the
+cache, and purges the idle rows.
+
+Usage:
+    python benchmark_fsm_storage.py [conversations] [abandoned rows]
+"""
+import asyncio
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_tmp.name) / 'fsm.db'}"
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import event, func, insert, select
+
+from bot.states import QuizStates
+from config import settings
+from database.crud import BULK_BATCH_SIZE
+from database.engine import async_session_maker, engine, init_db
+from database.models import FsmRecord
+from services.fsm_storage import DatabaseStorage, decode_data, encode_data
+
+BOT_ID = 42
+CACHE_SIZE = 10000
+commits = 0
+
+
+@event.listens_for(engine.sync_engine, "commit")
+def _count_commit(conn):
+    """Count transactions committed."""
+    global commits
+    commits += 1
+
+
+def key(user_id: int) -> StorageKey:
+    """Storage key of a private chat."""
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+def conversation_data(user_id: int) -> dict:
+    """Data of an abandoned quiz, or every 50th user an admin list dialog."""
+    if user_id % 50 == 0:
+        return {
+            "broadcast_group": "completed",
+            "broadcast_listing": {"audience": "completed", "total": 120000,
+                                  "cursors": list(range(0, 3000, 10))},
+            "broadcast_current_page": 300,
+        }
+    return {"answers": [random.randrange(4) for _ in range(random.randint(1, 5))], "gender": "female"}
+
+
+async def abandon(storage, users: range) -> float:
+    """Start and abandon a conversation per user; ms per update (set_state + update_data), writes included."""
+    start = time.perf_counter()
+    for user_id in users:
+        await storage.set_state(key(user_id), QuizStates.question_3)
+        await storage.update_data(key(user_id), conversation_data(user_id))
+    if isinstance(storage, DatabaseStorage):
+        await storage.flush()
+    return (time.perf_counter() - start) * 1000 / len(users)
+
+
+async def held_memory(make_storage, users: range):
+    """Storage, MB held after abandoning conversations, ms per update."""
+    gc.collect()
+    tracemalloc.start()
+    storage = make_storage()
+    ms = await abandon(storage, users)
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    return storage, held, ms
+
+
+async def redis_storage():
+    """aiogram RedisStorage at FSM_REDIS_URL, or None with the reason it can't be measured."""
+    try:
+        from aiogram.fsm.storage.redis import RedisStorage
+    except ImportError:
+        return None, "redis package not installed"
+    storage = RedisStorage.from_url(settings.FSM_REDIS_URL)
+    try:
+        await storage.redis.ping()
+    except Exception as e:
+        await storage.close()
+        return None, f"no server at {settings.FSM_REDIS_URL} ({e})"
+    return storage, None
+
+
+async def fill_idle(rows: int, start_id: int):
+    """Insert abandoned conversations last written 30 days ago."""
+    stale = datetime.utcnow() - timedelta(days=30)
+    blob = encode_data({"answers": [1, 2, 0], "gender": "male"})
+    async with async_session_maker() as session:
+        for offset in range(0, rows, BULK_BATCH_SIZE):
+            await session.execute(insert(FsmRecord), [
+                {"key": f"fsm:{BOT_ID}:{user_id}:{user_id}:default", "state": "QuizStates:question_3",
+                 "data": blob, "updated_at": stale}
+                for user_id in range(start_id + offset, start_id + min(offset + BULK_BATCH_SIZE, rows))
+            ])
+        await session.commit()
+
+
+async def main(conversations: int = 5000, abandoned: int = 200000):
+    """Compare storages and check persistence and expiry."""
+    global commits
+    await init_db()
+    users = range(1, conversations + 1)
+
+    sample = conversation_data(50)
+    raw = len(str(sample).encode())
+    print(f"admin list dialog data: {raw} bytes as text, {len(encode_data(sample))} bytes encoded")
+
+    _, memory_mb, memory_ms = await held_memory(MemoryStorage, users)
+    print(f"{conversations} abandoned conversations")
+    print(f"  MemoryStorage:   {memory_mb:6.1f} MB held, {memory_ms:.3f} ms/update")
+    commits = 0
+    storage, database_mb, database_ms = await held_memory(
+        lambda: DatabaseStorage(max_cached=CACHE_SIZE), users
+    )
+    print(f"  DatabaseStorage: {database_mb:6.1f} MB held (cache of {CACHE_SIZE}), {database_ms:.3f} ms/update, "
+          f"{commits / conversations:.3f} commits/update")
+    await storage.close()
+
+    redis, reason = await redis_storage()
+    if redis is None:
+        print(f"  RedisStorage:    skipped, {reason}")
+    else:
+        # Memory of the client only; the states live in the server
+        redis_ms = await abandon(redis, users)
+        print(f"  RedisStorage:    {redis_ms:.3f} ms/update")
+        for user_id in users:
+            await redis.set_state(key(user_id), None)
+            await redis.set_data(key(user_id), {})
+        await redis.close()
+
+    # Restart: a new instance has nothing in memory and reads states lazily
+    restarted = DatabaseStorage(max_cached=CACHE_SIZE)
+    for user_id in random.sample(users, min(1000, conversations)):
+        assert await restarted.get_state(key(user_id)) == QuizStates.question_3.state
+        assert "answers" in await restarted.get_data(key(user_id)) or user_id % 50 == 0
+    await restarted.set_state(key(1), None)
+    await restarted.set_data(key(1), {})
+    await restarted.close()
+    print("after restart: states and data read back, cleared state leaves no row")
+
+    await fill_idle(abandoned, 10_000_000)
+    async with async_session_maker() as session:
+        total = (await session.execute(select(func.count()).select_from(FsmRecord))).scalar_one()
+
+    gc.collect()
+    tracemalloc.start()
+    storage = DatabaseStorage(max_cached=CACHE_SIZE)
+    reads = min(abandoned, 5000)
+    start = time.perf_counter()
+    for user_id in random.sample(range(10_000_000, 10_000_000 + abandoned), reads):
+        assert await storage.get_state(key(user_id)) is None  # Idle for 30 days: expired
+    read_ms = (time.perf_counter() - start) * 1000 / reads
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    print(f"\n{total} rows, {reads} random cold reads: {read_ms:.3f} ms/read, {held:.1f} MB held")
+
+    start = time.perf_counter()
+    purged = await storage.purge()
+    print(f"purge of idle states: {purged} rows in {time.perf_counter() - start:.1f} s")
+    async with async_session_maker() as session:
+        left = (await session.execute(select(func.count()).select_from(FsmRecord))).scalar_one()
+    assert purged == abandoned and left == conversations - 1
+    assert decode_data(encode_data(sample)) == sample
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*args))
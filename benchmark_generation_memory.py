@@ -0,0 +1,116 @@
+"""Benchmark: peak RSS of one DALL-E result download + overlay + JPEG encode.
+
+Compares the old path (read() whole PNG into memory, BytesIO, RGBA convert,
+alpha_composite, RGB convert) with the streaming path used by
+AIImageGenerator. Each mode runs in its own subprocess because peak RSS
+never goes down within a process.
+
+Usage:
+    python benchmark_generation_memory.py
+"""
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+HOST = "127.0.0.1"
+PORT = 8766
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (Linux reports KB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_dalle_png() -> bytes:
+    """Noisy 1024x1792 PNG, about the size of a real DALL-E HD result."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 255, (1792, 1024, 3), dtype=np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+async def run_mode(mode: str) -> None:
+    """Serve image locally, run one generation step, print peak RSS delta."""
+    import aiohttp
+    from aiohttp import web
+    from PIL import Image
+
+    from services.ai_generator import AIImageGenerator
+    from services.image_assets import OVERLAY_PATH
+    from services.overlay_compositor import DALLE_IMAGE_SIZE as DALLE_SIZE
+
+    png_bytes = make_dalle_png()
+
+    async def image(request: web.Request) -> web.Response:
+        return web.Response(body=png_bytes, content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/image.png", image)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+
+    generator = AIImageGenerator()
+    # Overlay is resident in both modes
+    old_overlay = Image.open(OVERLAY_PATH).convert('RGBA')
+    generator.overlay_compositor.prepare(DALLE_SIZE)
+    url = f"http://{HOST}:{PORT}/image.png"
+    output_path = Path(tempfile.gettempdir()) / f"benchmark_{mode}.jpg"
+
+    # Let the server task hold its copy of the PNG before measuring
+    session = generator._get_session()
+    async with session.get(url) as response:
+        await response.read()
+    del response
+    baseline = peak_rss_mb()
+
+    if mode == "before":
+        async with aiohttp.ClientSession() as old_session:
+            async with old_session.get(url) as img_response:
+                img_data = await img_response.read()
+        generated_image = Image.open(BytesIO(img_data))
+        overlay = old_overlay
+        if generated_image.mode != 'RGBA':
+            generated_image = generated_image.convert('RGBA')
+        if overlay.size != generated_image.size:
+            overlay = overlay.resize(generated_image.size, Image.Resampling.LANCZOS)
+        generated_image = Image.alpha_composite(generated_image, overlay)
+        generated_image = generated_image.convert('RGB')
+        generated_image.save(output_path, "JPEG", quality=95)
+    else:
+        image_file = await generator._download_to_file(session, url)
+        try:
+            generator._compose_and_save(image_file, output_path)
+        finally:
+            image_file.close()
+
+    print(f"{mode}: peak RSS +{peak_rss_mb() - baseline:.1f} MB")
+
+    await generator.close()
+    await runner.cleanup()
+    output_path.unlink(missing_ok=True)
+
+
+def main():
+    """Run both modes in fresh interpreters."""
+    for mode in ("before", "after"):
+        subprocess.run([sys.executable, __file__, mode], check=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        asyncio.run(run_mode(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,68 @@
+"""Benchmark: per-request ImageProcessor vs process-wide warm singleton.
+
+Usage:
+    python benchmark_image_processor.py [iterations]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+from statistics import mean, median
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from services.image_assets import ImageAssets
+from services.image_processor import ImageProcessor
+from services.overlay_compositor import DALLE_IMAGE_SIZE
+
+SAMPLE_PHOTO = Path("testphoto_female.jpg")
+
+
+def simulate_request(processor: ImageProcessor, gender: str) -> None:
+    """Resource loading one photo request does (face detection itself excluded)."""
+    processor.face_cascade
+    processor.ai_generator.overlay_compositor.prepare(DALLE_IMAGE_SIZE)
+    processor.assets.get_bgr(processor.template_generator._get_random_template(gender))
+    processor._load_template(gender)
+
+
+def timed(func) -> float:
+    """Run func and return elapsed milliseconds."""
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def main(iterations: int = 20):
+    """Run the benchmark and print results."""
+    if not SAMPLE_PHOTO.exists():
+        print(f"Sample photo not found: {SAMPLE_PHOTO}")
+        return
+
+    # Startup latency: construct + warm everything once
+    startup_ms = timed(lambda: ImageProcessor(ImageAssets()).warm_up())
+
+    # Before: new ImageProcessor (and cold resources) for every photo
+    cold = []
+    for i in range(iterations):
+        gender = "male" if i % 2 else "female"
+        cold.append(timed(lambda: simulate_request(ImageProcessor(ImageAssets()), gender)))
+
+    # After: one warm processor shared by all requests
+    processor = ImageProcessor(ImageAssets())
+    processor.warm_up()
+    warm = []
+    for i in range(iterations):
+        gender = "male" if i % 2 else "female"
+        warm.append(timed(lambda: simulate_request(processor, gender)))
+
+    print(f"Startup (construct + warm_up): {startup_ms:.1f} ms")
+    print(f"Per request, new instance:  mean {mean(cold):.1f} ms, median {median(cold):.1f} ms")
+    print(f"Per request, shared warm:   mean {mean(warm):.3f} ms, median {median(warm):.3f} ms")
+    print(f"Saved per request: {mean(cold) - mean(warm):.1f} ms")
+    print(f"Face detection on sample photo (same in both): {timed(lambda: processor.count_faces(SAMPLE_PHOTO)):.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,114 @@
+"""Benchmark: relayed messages per second, one commit per message vs MessageLogBuffer.
+
+Relays a stream of messages from many concurrent chats the way the relay
+handlers do (cached user lookup, copy_message to a fake bot, log row),
+once logging each message with UserMessageCRUD.log_message (previous
+handlers; one INSERT and commit per message) and once through
+MessageLogBuffer. Also checks that every row is in user_messages after
+stop() and that the buffer never grew past its ceiling.
+
+Usage:
+    python benchmark_message_log.py [messages] [concurrent chats]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_tmp.name) / 'message_log.db'}"
+
+from sqlalchemy import delete, func, insert, select
+
+from database.crud import UserMessageCRUD
+from database.engine import async_session_maker, engine, init_db
+from database.models import User, UserMessage
+from services.message_log import MessageLogBuffer
+from services.user_cache import get_user_cache
+
+SEND_LATENCY = 0.005
+MAX_PENDING = 500
+
+
+async def copy_message(user_id: int) -> int:
+    """Fake Bot.copy_message: returns the new message ID."""
+    await asyncio.sleep(SEND_LATENCY)
+    return user_id
+
+
+async def relay_direct(user_id: int, message_id: int):
+    """Previous handler: log row committed before the handler returns."""
+    user = await get_user_cache().get(user_id)
+    sent_id = await copy_message(user.forum_topic_id)
+    async with async_session_maker() as session:
+        await UserMessageCRUD.log_message(session, user_id, sent_id, message_id, "from_user")
+
+
+async def relay_buffered(message_log: MessageLogBuffer, user_id: int, message_id: int):
+    """Current handler: log row buffered."""
+    user = await get_user_cache().get(user_id)
+    sent_id = await copy_message(user.forum_topic_id)
+    await message_log.log(user_id, sent_id, message_id, "from_user")
+
+
+async def run_chats(relay, messages: int, chats: int) -> float:
+    """Relay messages spread over concurrent chats; messages per second."""
+    per_chat = messages // chats
+
+    async def chat(user_id: int):
+        for message_id in range(per_chat):
+            await relay(user_id, message_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(1000 + i) for i in range(chats)))
+    return per_chat * chats / (time.perf_counter() - start)
+
+
+async def count_rows() -> int:
+    """Rows in user_messages."""
+    async with async_session_maker() as session:
+        return (await session.execute(select(func.count()).select_from(UserMessage))).scalar_one()
+
+
+async def main(messages: int = 5000, chats: int = 50):
+    """Compare throughput and check nothing is lost."""
+    await init_db()
+    async with async_session_maker() as session:
+        await session.execute(insert(User), [
+            {"id": 1000 + i, "pride_gift_id": 10000 + i, "forum_topic_id": 500 + i} for i in range(chats)
+        ])
+        await session.commit()
+
+    direct = await run_chats(relay_direct, messages, chats)
+    print(f"commit per message: {direct:7.0f} messages/s")
+    assert await count_rows() == messages // chats * chats
+    async with async_session_maker() as session:
+        await session.execute(delete(UserMessage))
+        await session.commit()
+
+    message_log = MessageLogBuffer(max_pending=MAX_PENDING)
+    message_log.start()
+    peak = 0
+
+    async def relay(user_id: int, message_id: int):
+        nonlocal peak
+        await relay_buffered(message_log, user_id, message_id)
+        peak = max(peak, message_log.pending)
+
+    buffered = await run_chats(relay, messages, chats)
+    await message_log.stop()
+    print(f"write-behind:       {buffered:7.0f} messages/s ({buffered / direct:.1f}x), "
+          f"peak buffer {peak} rows (ceiling {MAX_PENDING})")
+    assert await count_rows() == messages // chats * chats == message_log.written
+    assert peak <= MAX_PENDING
+    print(f"all {message_log.written} rows written after stop()")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*args))
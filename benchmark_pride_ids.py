@@ -0,0 +1,101 @@
+"""Benchmark: random-probe Pride GIFT IDs vs keyed-permutation allocator.
+
+Fills the 5-digit ID space to several levels and measures the cost of one
+allocation with the previous approach (random ID + SELECT per probe, up to
+100 probes) and with UserCRUD.allocate_pride_gift_id (one counter UPDATE
+... RETURNING and an in-memory permutation per ID).
+
+Usage:
+    python benchmark_pride_ids.py [allocations_per_level]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from sqlalchemy import insert, select, update
+
+from database.crud import IdAllocatorCRUD, UserCRUD
+from database.engine import build_engine, build_session_maker
+from database.models import Base, IdAllocator, User
+from utils.id_permutation import id_for_counter
+
+SPACE = 90000
+FILL_LEVELS = (0.0, 0.5, 0.9, 0.99)
+
+
+async def old_generate_unique_pride_id(session) -> int:
+    """Previous UserCRUD._generate_unique_pride_id (returns probes used, raises when out of attempts)."""
+    for attempt in range(1, 101):
+        pride_id = random.randint(10000, 99999)
+        result = await session.execute(select(User).where(User.pride_gift_id == pride_id))
+        if not result.scalar_one_or_none():
+            return attempt
+    raise ValueError("Could not generate unique Pride GIFT ID")
+
+
+async def fill(session_maker, filled: int) -> None:
+    """Make the first `filled` allocator IDs taken by users."""
+    async with session_maker() as session:
+        _, key = await IdAllocatorCRUD.next_value(session, "pride_gift_id")
+        key = bytes.fromhex(key)
+        users = await session.execute(select(User.id))
+        start = len(users.all())
+        rows = [
+            {"id": user_id, "pride_gift_id": id_for_counter(user_id, key)}
+            for user_id in range(start, filled)
+        ]
+        for i in range(0, len(rows), 5000):
+            await session.execute(insert(User), rows[i:i + 5000])
+        await session.execute(
+            update(IdAllocator).where(IdAllocator.name == "pride_gift_id").values(counter=filled)
+        )
+        await session.commit()
+
+
+async def main(allocations: int = 200):
+    """Measure both approaches at each fill level."""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(f"sqlite+aiosqlite:///{Path(tmp) / 'ids.db'}")
+        session_maker = build_session_maker(engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        print(f"{'fill':>5}  {'random probe':>24}  {'allocator':>12}")
+        for level in FILL_LEVELS:
+            filled = int(SPACE * level)
+            await fill(session_maker, filled)
+
+            probes = failures = 0
+            start = time.perf_counter()
+            async with session_maker() as session:
+                for _ in range(allocations):
+                    try:
+                        probes += await old_generate_unique_pride_id(session)
+                    except ValueError:
+                        probes += 100
+                        failures += 1
+            old_ms = (time.perf_counter() - start) * 1000 / allocations
+
+            start = time.perf_counter()
+            async with session_maker() as session:
+                for _ in range(allocations):
+                    await UserCRUD.allocate_pride_gift_id(session)
+            new_ms = (time.perf_counter() - start) * 1000 / allocations
+
+            print(
+                f"{level:>5.0%}  {old_ms:6.2f} ms {probes / allocations:5.1f} probes {failures:3} fail"
+                f"  {new_ms:9.2f} ms"
+            )
+
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*[int(arg) for arg in sys.argv[1:2]]))
@@ -0,0 +1,132 @@
+"""Benchmark: raffle draw and winner notifications, previous loop vs raffle engine.
+
+Fills a throwaway database with participants, then times the previous
+conduct_raffle (copied below: load all participants, random.sample, one
+UPDATE + commit per winner) against conduct_draw (covering-index ID scan,
+hash ranking, one UPDATE in one transaction). Also checks that the stored
+seed and participant hash reproduce the winners, that two concurrent
+draws mark winners once, and times notifications to a fake bot with
+80 ms per request: serial loop vs rate-limited Broadcaster.
+
+Usage:
+    python benchmark_raffle.py [participants]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_tmp.name) / 'raffle.db'}"
+
+from sqlalchemy import delete, insert, update
+
+from database.crud import BULK_BATCH_SIZE, RaffleCRUD, UserCRUD
+from database.engine import async_session_maker, engine, init_db
+from database.models import RaffleDraw, User
+from services.broadcast import Broadcaster, TokenBucket
+from services.raffle import (
+    RaffleAlreadyConductedError, conduct_draw, draw_winners, notify_winners, participants_hash
+)
+
+WINNERS = 30
+SEND_LATENCY = 0.08
+
+
+async def old_raffle() -> list:
+    """Previous conduct_raffle database part."""
+    async with async_session_maker() as session:
+        participants = await UserCRUD.get_all_participants(session)
+        existing_winners = await UserCRUD.get_winners(session)
+        assert not existing_winners
+        winners = random.sample(participants, min(WINNERS, len(participants)))
+        for winner in winners:
+            await UserCRUD.set_winner(session, winner.id, True)
+    return winners
+
+
+async def reset():
+    """Forget winners and draws."""
+    async with async_session_maker() as session:
+        await session.execute(update(User).values(is_winner=False))
+        await session.execute(delete(RaffleDraw))
+        await session.commit()
+
+
+async def fill(participants: int):
+    """Insert participants and some users who did not finish the quiz."""
+    rows = [
+        {"id": 1000 + i, "pride_gift_id": 10000 + i, "quiz_completed": i % 8 != 0, "photo_uploaded": True}
+        for i in range(participants + participants // 7)
+    ]
+    async with async_session_maker() as session:
+        for i in range(0, len(rows), BULK_BATCH_SIZE):
+            await session.execute(insert(User), rows[i:i + BULK_BATCH_SIZE])
+        await session.commit()
+
+
+class FakeBot:
+    """send_message that takes SEND_LATENCY seconds."""
+
+    async def send_message(self, chat_id: int, text: str):
+        await asyncio.sleep(SEND_LATENCY)
+
+
+async def main(participants: int = 100000):
+    """Time draws and notifications, check verifiability."""
+    await init_db()
+    await fill(participants)
+
+    start = time.perf_counter()
+    await old_raffle()
+    print(f"old draw:  {(time.perf_counter() - start) * 1000:8.1f} ms")
+    await reset()
+
+    start = time.perf_counter()
+    draw = await conduct_draw(admin_id=1, winners_count=WINNERS)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"new draw:  {elapsed:8.1f} ms ({draw.participants_count} participants)")
+
+    # Verifiable: stored seed + participant IDs reproduce the winners
+    async with async_session_maker() as session:
+        ids = await RaffleCRUD.get_participant_ids(session)
+        winners = {user.id for user in await UserCRUD.get_winners(session)}
+    shuffled = ids[:]
+    random.shuffle(shuffled)
+    assert participants_hash(shuffled) == draw.participants_hash
+    assert draw_winners(shuffled, draw.seed, WINNERS) == draw.winner_ids
+    assert winners == set(draw.winner_ids) and len(winners) == WINNERS
+    print("recomputed winners from seed and participant list: match")
+
+    # Two admins pressing the button at once: one draw
+    await reset()
+    outcomes = await asyncio.gather(
+        conduct_draw(admin_id=1, winners_count=WINNERS),
+        conduct_draw(admin_id=2, winners_count=WINNERS),
+        return_exceptions=True
+    )
+    assert sum(isinstance(o, RaffleAlreadyConductedError) for o in outcomes) == 1
+    async with async_session_maker() as session:
+        assert len(await UserCRUD.get_winners(session)) == WINNERS
+    print("concurrent draws: one conducted, one rejected")
+
+    bot = FakeBot()
+    start = time.perf_counter()
+    for user_id in draw.winner_ids:
+        await bot.send_message(user_id, "")
+    print(f"\nnotify {WINNERS} winners, serial loop:  {time.perf_counter() - start:5.2f} s")
+    start = time.perf_counter()
+    result = await notify_winners(bot, draw.winner_ids, Broadcaster(limiter=TokenBucket(28.0, 1.0)))
+    print(f"notify {WINNERS} winners, broadcaster: {time.perf_counter() - start:5.2f} s ({result.sent} sent)")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    asyncio.run(main(*args))
@@ -0,0 +1,104 @@
+"""Benchmark: default SQLite settings, tuned profile and serialized writes.
+
+Simulates launch load on a fresh database file: concurrent tasks save quiz
+answers, update photo status and log forum messages (each its own commit)
+while others read users. Reports commits/sec, read latency and "database
+is locked" errors for default settings, the tuned profile (pragmas and a
+connection pool) alone, the process-wide write lock alone, and both.
+
+Usage:
+    python benchmark_sqlite.py [tasks] [operations_per_task]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import median
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from sqlalchemy.exc import OperationalError
+
+from database.crud import QuizAnswerCRUD, UserCRUD, UserMessageCRUD
+from database.engine import build_engine, build_session_maker
+from database.models import Base
+
+USERS = 500
+
+
+async def run_profile(db_path: Path, tuned: bool, serial: bool, tasks: int, operations: int) -> dict:
+    """Run the mixed workload against a fresh database."""
+    engine = build_engine(f"sqlite+aiosqlite:///{db_path}", tuned=tuned)
+    session_maker = build_session_maker(engine, serialize_writes=serial)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_maker() as session:
+        for user_id in range(1, USERS + 1):
+            await UserCRUD.get_or_create(session, user_id, f"user{user_id}", f"User {user_id}")
+
+    stats = {"commits": 0, "reads": 0, "locked": 0, "other_errors": 0}
+    read_ms = []
+
+    async def worker(index: int):
+        rnd = random.Random(index)
+        # Own users per task: like real traffic, one user's updates never race each other
+        own_users = range(index + 1, USERS + 1, tasks)
+        for _ in range(operations):
+            user_id = rnd.choice(own_users)
+            action = rnd.random()
+            try:
+                async with session_maker() as session:
+                    if action < 0.3:
+                        start = time.perf_counter()
+                        await UserCRUD.get(session, user_id)
+                        read_ms.append((time.perf_counter() - start) * 1000)
+                        stats["reads"] += 1
+                        continue
+                    if action < 0.6:
+                        await QuizAnswerCRUD.add_answer(session, user_id, rnd.randint(1, 5), "Ответ")
+                    elif action < 0.8:
+                        await UserCRUD.update_photo_status(session, user_id, uploaded=True)
+                    else:
+                        await UserMessageCRUD.log_message(session, user_id, rnd.randint(1, 10**6), None, "from_user")
+                    stats["commits"] += 1
+            except OperationalError as e:
+                if "locked" in str(e):
+                    stats["locked"] += 1
+                else:
+                    stats["other_errors"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(tasks)))
+    stats["elapsed"] = time.perf_counter() - start
+    stats["read_ms"] = median(read_ms)
+    await engine.dispose()
+    return stats
+
+
+async def main(tasks: int = 32, operations: int = 100):
+    """Run all profiles and print results."""
+    profiles = (
+        ("Default", False, False),
+        ("Tuned", True, False),
+        ("Serial", False, True),
+        ("Tuned+serial", True, True),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, tuned, serial in profiles:
+            stats = await run_profile(Path(tmp) / f"{name}.db", tuned, serial, tasks, operations)
+            print(
+                f"{name:13} {stats['elapsed']:6.2f}s  "
+                f"{stats['commits'] / stats['elapsed']:7.1f} commits/s  "
+                f"{stats['reads'] / stats['elapsed']:7.1f} reads/s  "
+                f"read p50 {stats['read_ms']:5.2f} ms  "
+                f"locked errors {stats['locked']}, other errors {stats['other_errors']}"
+            )
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*args))
@@ -0,0 +1,140 @@
+"""Benchmark: admin statistics from full-table loads vs maintained counters.
+
+Registers users through UserCRUD (so counters are maintained as in the
+bot), including repeated and concurrent calls for the same user, checks
+the counters equal a from-scratch rebuild, then times the previous
+show_statistics queries (copied below) against reading the counters as
+the users table grows.
+
+Usage:
+    python benchmark_stats.py [largest users]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_tmp.name) / 'stats.db'}"
+
+from sqlalchemy import insert
+
+from database.crud import (
+    BULK_BATCH_SIZE, STAT_PHOTOS, STAT_QUIZ_COMPLETED, STAT_REGISTRATIONS, StatsCRUD, UserCRUD
+)
+from database.engine import async_session_maker, engine, init_db
+from database.models import User
+
+
+async def old_statistics() -> tuple:
+    """Previous show_statistics queries: all participants and winners loaded."""
+    async with async_session_maker() as session:
+        all_users = await UserCRUD.get_all_participants(session)
+        winners = await UserCRUD.get_winners(session)
+    return len(all_users), sum(1 for u in all_users if u.photo_uploaded), len(winners)
+
+
+async def new_statistics() -> tuple:
+    """Current show_statistics queries."""
+    async with async_session_maker() as session:
+        return await StatsCRUD.get_totals(session), await StatsCRUD.get_daily(session, 7)
+
+
+async def user_journey(user_id: int, referrer_id: int = None):
+    """Writes one user goes through in the bot, with some repeats."""
+    async with async_session_maker() as session:
+        await UserCRUD.get_or_create(session, user_id, f"user{user_id}", f"User {user_id}")
+        if referrer_id:
+            await UserCRUD.set_referrer(session, user_id, referrer_id)
+        await UserCRUD.set_gender(session, user_id, random.choice(["male", "female"]))
+        if random.random() < 0.3:
+            await UserCRUD.set_gender(session, user_id, random.choice(["male", "female"]))
+        await UserCRUD.update_photo_status(session, user_id, True)
+        await UserCRUD.update_photo_status(session, user_id, True)
+        if random.random() < 0.8:
+            await UserCRUD.update_quiz_status(session, user_id, True)
+            await UserCRUD.mark_quiz_completed(session, user_id)
+        if random.random() < 0.1:
+            await UserCRUD.set_winner(session, user_id, True)
+            if random.random() < 0.5:
+                await UserCRUD.set_winner(session, user_id, False)
+
+
+async def check_counters(users: int = 300):
+    """Counters maintained by writes must equal a rebuild."""
+    await asyncio.gather(*(
+        user_journey(1000 + i, 1000 + i - 1 if i % 3 == 0 and i else None) for i in range(users)
+    ))
+    # Same new user from many tasks at once: one registration
+    await asyncio.gather(*(user_journey(999999) for _ in range(20)))
+
+    async with async_session_maker() as session:
+        maintained = await StatsCRUD.get_totals(session)
+        rebuilt = await StatsCRUD.rebuild(session)
+    assert maintained == rebuilt, f"maintained {maintained} != rebuilt {rebuilt}"
+    assert rebuilt[STAT_REGISTRATIONS] == users + 1
+    print(f"counters after {users + 1} concurrent user journeys match rebuild: {rebuilt}")
+
+
+async def fill(start: int, count: int):
+    """Insert users directly (bulk) and adjust counters the same way."""
+    rows = [
+        {"id": start + i, "pride_gift_id": start + i, "gender": "male" if i % 2 else "female",
+         "quiz_completed": i % 5 != 0, "photo_uploaded": True}
+        for i in range(count)
+    ]
+    async with async_session_maker() as session:
+        for i in range(0, len(rows), BULK_BATCH_SIZE):
+            await session.execute(insert(User), rows[i:i + BULK_BATCH_SIZE])
+        await StatsCRUD.bump(session, {
+            STAT_REGISTRATIONS: count,
+            STAT_QUIZ_COMPLETED: sum(row["quiz_completed"] for row in rows),
+            STAT_PHOTOS: count,
+            "gender_male": count // 2,
+            "gender_female": count - count // 2,
+        })
+        await session.commit()
+
+
+async def timed(call, repeats: int = 5) -> float:
+    """Best of repeats, ms."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await call()
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+async def main(largest: int = 100000):
+    """Check correctness, then time both approaches as users grow."""
+    await init_db()
+    await check_counters()
+
+    size, filled = 1000, 0
+    while size <= largest:
+        await fill(2_000_000 + filled, size - filled)
+        filled = size
+        old_ms = await timed(old_statistics)
+        new_ms = await timed(new_statistics)
+        print(f"{size:7} users: old {old_ms:8.1f} ms, counters {new_ms:5.2f} ms")
+        size *= 10
+
+    async with async_session_maker() as session:
+        maintained = await StatsCRUD.get_totals(session)
+        start = time.perf_counter()
+        rebuilt = await StatsCRUD.rebuild(session)
+        rebuild_ms = (time.perf_counter() - start) * 1000
+    assert maintained == rebuilt
+    print(f"rebuild of {rebuilt[STAT_REGISTRATIONS]} users: {rebuild_ms:.0f} ms, no drift")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    asyncio.run(main(*args))
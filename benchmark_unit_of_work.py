@@ -0,0 +1,197 @@
+"""Benchmark: database work of /start and photo upload, commit per helper vs unit of work.
+
+Runs the database part of cmd_start (register, check and set referrer)
+and handle_photo_upload (save photo, set flag) for many users at once,
+once as before (each helper commits; copied below) and once through
+UnitOfWorkMiddleware the way the handlers now do. Reports statements,
+commits and updates per second, and checks that an update whose handler
+raises leaves nothing behind and does not invalidate cached users, and
+that a handler which calls another one (the certificate confirmation
+fallback) passes the session on when fed through a real Dispatcher.
+
+Usage:
+    python benchmark_unit_of_work.py [users]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_tmp.name) / 'unit_of_work.db'}"
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.methods import EditMessageText
+from aiogram.types import CallbackQuery, Chat, Message, Update
+from aiogram.types import User as TelegramUser
+from sqlalchemy import delete, event, func, select
+
+from bot.middlewares import UnitOfWorkMiddleware
+from database.crud import UserCRUD, UserPhotoCRUD
+from database.engine import after_commit, async_session_maker, counting_queries, engine, init_db
+from database.models import User, UserPhoto
+from handlers import admin
+from services.fsm_storage import DatabaseStorage
+from services.user_cache import get_user_cache
+
+REFERRER_ID = 1
+commits = 0
+
+
+@event.listens_for(engine.sync_engine, "commit")
+def _count_commit(conn):
+    """Count transactions committed."""
+    global commits
+    commits += 1
+
+
+async def cmd_start(event: int, data: dict):
+    """Current cmd_start database part (event is the user ID)."""
+    session = data["session"]
+    user = await UserCRUD.get_or_create(session, event, f"user{event}", f"User {event}")
+    if not user.referrer_id and await UserCRUD.get(session, REFERRER_ID):
+        await UserCRUD.set_referrer(session, event, REFERRER_ID)
+
+
+async def handle_photo_upload(event: int, data: dict):
+    """Current handle_photo_upload database part (event is the user ID)."""
+    session = data["session"]
+    await UserPhotoCRUD.add_photo(session, user_id=event, file_id="file", file_path=f"{event}.jpg")
+    await UserCRUD.update_photo_status(session, event, uploaded=True)
+
+
+async def old_updates(user_id: int):
+    """Previous handlers: a session per block, each helper commits."""
+    async with async_session_maker() as session:
+        user = await UserCRUD.get_or_create(session, user_id, f"user{user_id}", f"User {user_id}")
+        if not user.referrer_id and await UserCRUD.get(session, REFERRER_ID):
+            await UserCRUD.set_referrer(session, user_id, REFERRER_ID)
+    async with async_session_maker() as session:
+        await UserPhotoCRUD.add_photo(session, user_id=user_id, file_id="file", file_path=f"{user_id}.jpg")
+        await UserCRUD.update_photo_status(session, user_id, uploaded=True)
+
+
+async def run(name: str, updates, users: int):
+    """Run updates for users concurrently and report."""
+    global commits
+    commits = 0
+    start = time.perf_counter()
+    with counting_queries() as queries:
+        await asyncio.gather(*(updates(1_000_000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - start
+    print(f"{name:18} {queries.count / users:5.1f} statements, {commits / users:4.1f} commits per user, "
+          f"{users / elapsed:6.0f} users/s")
+
+
+async def check_rollback(middleware: UnitOfWorkMiddleware):
+    """A handler that raises after writing leaves nothing behind and wakes no one."""
+    cache = get_user_cache()
+    user_id = 1_000_000
+    before = await cache.get(user_id)
+    invalidations = cache.invalidations
+    woken = []
+
+    async def failing(event, data):
+        await UserCRUD.set_gender(data["session"], user_id, "female" if before.gender != "female" else "male")
+        await UserPhotoCRUD.add_photo(data["session"], user_id=user_id, file_id="new", file_path="new.jpg")
+        after_commit(data["session"], lambda: woken.append("commit"), on_rollback=lambda: woken.append("rollback"))
+        raise RuntimeError("handler failed")
+
+    try:
+        await middleware(failing, None, {})
+    except RuntimeError:
+        pass
+    async with async_session_maker() as session:
+        user = await UserCRUD.get(session, user_id)
+        photo = await UserPhotoCRUD.get_photo(session, user_id)
+    assert user.gender == before.gender and photo.file_id == "file"
+    assert cache.invalidations == invalidations and await cache.get(user_id) == before
+    assert woken == ["rollback"], woken
+    print("handler error: writes rolled back, cached user kept, nothing woken")
+
+
+class RecordingSession(BaseSession):
+    """Bot API session that records requests instead of sending them."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+async def check_certificate_fallback(middleware: UnitOfWorkMiddleware):
+    """The cert_confirm_yes fallback runs the main handler with the update's session."""
+    admin_id = 2_000_000
+    bot = Bot("0:benchmark", session=RecordingSession())
+    storage = DatabaseStorage()
+    dispatcher = Dispatcher(storage=storage)
+    dispatcher.callback_query.middleware(middleware)
+    dispatcher.include_router(admin.router)
+
+    # No confirming_send state, so only the fallback matches; the selected
+    # user does not exist, so the handler stops after looking it up.
+    await storage.set_data(StorageKey(bot_id=bot.id, chat_id=admin_id, user_id=admin_id),
+                           {"certificate_selected_user_id": 3_000_000})
+    admin_user = TelegramUser(id=admin_id, is_bot=False, first_name="Admin")
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=admin_id, type="private"),
+                      from_user=admin_user, text="confirm")
+    callback = CallbackQuery(id="1", from_user=admin_user, chat_instance="benchmark",
+                             data="cert_confirm_yes", message=message)
+    await dispatcher.feed_update(bot, Update(update_id=1, callback_query=callback))
+
+    edits = [request.text for request in bot.session.requests if isinstance(request, EditMessageText)]
+    assert edits == ["❌ Пользователь не найден"], edits
+    assert middleware.stats.handlers.get("handle_certificate_confirm_yes_fallback")
+    print("certificate confirmation fallback: handled with the update's session")
+
+
+async def main(users: int = 1000):
+    """Compare and check."""
+    await init_db()
+    async with async_session_maker() as session:
+        await UserCRUD.get_or_create(session, REFERRER_ID, "referrer", "Referrer")
+
+    await run("commit per helper", old_updates, users)
+
+    async with async_session_maker() as session:
+        await session.execute(delete(UserPhoto))
+        await session.execute(delete(User).where(User.id != REFERRER_ID))
+        await session.commit()
+
+    middleware = UnitOfWorkMiddleware()
+
+    async def new_updates(user_id: int):
+        for handler in (cmd_start, handle_photo_upload):
+            await middleware(handler, user_id, {"handler": HandlerObject(callback=handler)})
+
+    await run("unit of work", new_updates, users)
+    async with async_session_maker() as session:
+        photos = (await session.execute(select(func.count()).select_from(UserPhoto))).scalar_one()
+    assert photos == users
+    print(f"per-handler statements: {middleware.stats.handlers}\n")
+
+    await check_rollback(middleware)
+    await check_certificate_fallback(middleware)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    asyncio.run(main(*args))
@@ -0,0 +1,173 @@
+"""Benchmark: select-then-write CRUD vs single-statement upserts.
+
+Measures per-operation latency of get_or_create, add_answer and add_photo
+(previous implementations are copied below) and runs each operation from
+many tasks at once for the same key, counting IntegrityErrors and rows.
+This is also the concurrency test for the upserts: exits with status 1 if
+a race on the current implementation raises IntegrityError or creates
+anything but exactly one row.
+
+Usage:
+    python benchmark_upserts.py [operations] [parallel]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import quantiles
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database.crud import QuizAnswerCRUD, UserCRUD, UserPhotoCRUD
+from database.engine import build_engine, build_session_maker
+from database.migrations import run_migrations
+from database.models import Base, QuizAnswer, User, UserPhoto
+
+
+async def old_get_or_create(session, user_id: int, username: str = None, full_name: str = None) -> User:
+    """Previous UserCRUD.get_or_create: select, pick free Pride ID, insert."""
+    result = await session.execute(select(User).where(User.id == user_id))
+    user = result.scalar_one_or_none()
+    if not user:
+        while True:
+            pride_id = random.randint(10000, 99999)
+            taken = await session.execute(select(User).where(User.pride_gift_id == pride_id))
+            if not taken.scalar_one_or_none():
+                break
+        user = User(id=user_id, pride_gift_id=pride_id, username=username, full_name=full_name)
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+    return user
+
+
+async def old_add_answer(session, user_id: int, question_number: int, answer: str):
+    """Previous QuizAnswerCRUD.add_answer: select, then update or insert."""
+    result = await session.execute(
+        select(QuizAnswer).where(QuizAnswer.user_id == user_id, QuizAnswer.question_number == question_number)
+    )
+    existing_answer = result.scalar_one_or_none()
+    if existing_answer:
+        existing_answer.answer = answer
+    else:
+        session.add(QuizAnswer(user_id=user_id, question_number=question_number, answer=answer))
+    await session.commit()
+
+
+async def old_add_photo(session, user_id: int, file_id: str, file_path: str):
+    """Previous UserPhotoCRUD.add_photo: select, update or insert, refresh."""
+    result = await session.execute(select(UserPhoto).where(UserPhoto.user_id == user_id))
+    existing_photo = result.scalar_one_or_none()
+    if existing_photo:
+        await session.execute(
+            update(UserPhoto).where(UserPhoto.user_id == user_id).values(
+                file_id=file_id, file_path=file_path, generated_path=None
+            )
+        )
+        await session.commit()
+        await session.refresh(existing_photo)
+        return existing_photo
+    photo = UserPhoto(user_id=user_id, file_id=file_id, file_path=file_path)
+    session.add(photo)
+    await session.commit()
+    await session.refresh(photo)
+    return photo
+
+
+IMPLEMENTATIONS = {
+    "old": (old_get_or_create, old_add_answer, old_add_photo),
+    "upsert": (UserCRUD.get_or_create, QuizAnswerCRUD.add_answer, UserPhotoCRUD.add_photo),
+}
+
+
+async def latency(session_maker, call, operations: int) -> tuple:
+    """Run call sequentially (half inserts, half updates), return p50/p95 in ms."""
+    samples = []
+    for i in range(operations):
+        key = i % (operations // 2)
+        start = time.perf_counter()
+        async with session_maker() as session:
+            await call(session, key)
+        samples.append((time.perf_counter() - start) * 1000)
+    cuts = quantiles(samples, n=20)
+    return cuts[9], cuts[18]
+
+
+async def concurrency(session_maker, call, model, parallel: int) -> tuple:
+    """Run call for one new key from many tasks, return (IntegrityErrors, rows)."""
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with session_maker() as session:
+            try:
+                await call(session)
+            except IntegrityError:
+                errors += 1
+
+    await asyncio.gather(*(one() for _ in range(parallel)))
+    async with session_maker() as session:
+        rows = (await session.execute(select(func.count()).select_from(model))).scalar_one()
+    return errors, rows
+
+
+async def run(db_path: Path, name: str, operations: int, parallel: int) -> int:
+    """Benchmark one implementation on a fresh database, return number of failed races."""
+    get_or_create, add_answer, add_photo = IMPLEMENTATIONS[name]
+    engine = build_engine(f"sqlite+aiosqlite:///{db_path}")
+    session_maker = build_session_maker(engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
+
+    calls = {
+        "get_or_create": lambda s, k: get_or_create(s, 1000 + k, "user", "User"),
+        "add_answer": lambda s, k: add_answer(s, 1000 + k, 1, f"answer {random.random()}"),
+        "add_photo": lambda s, k: add_photo(s, 1000 + k, "file", f"photos/{random.random()}.jpg"),
+    }
+    for op, call in calls.items():
+        p50, p95 = await latency(session_maker, call, operations)
+        print(f"{name:7} {op:14} p50 {p50:6.2f} ms  p95 {p95:6.2f} ms")
+
+    races = {
+        "get_or_create": (lambda s: get_or_create(s, 1, "racer", "Racer"), User),
+        "add_answer": (lambda s: add_answer(s, 1, 1, "race"), QuizAnswer),
+        "add_photo": (lambda s: add_photo(s, 1, "file", "photos/race.jpg"), UserPhoto),
+    }
+    failures = 0
+    for op, (call, model) in races.items():
+        async with session_maker() as session:
+            before = (await session.execute(select(func.count()).select_from(model))).scalar_one()
+        errors, rows = await concurrency(session_maker, call, model, parallel)
+        print(f"{name:7} {op:14} {parallel} parallel calls: {errors} IntegrityErrors, {rows - before} rows created")
+        failures += errors > 0 or rows - before != 1
+
+    await engine.dispose()
+    return failures
+
+
+async def main(operations: int = 400, parallel: int = 50) -> int:
+    """Run both implementations; fail if the upserts race (the old ones are expected to)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            name: await run(Path(tmp) / f"{name}.db", name, operations, parallel)
+            for name in IMPLEMENTATIONS
+        }
+    failures = results["upsert"]
+    if failures:
+        print(f"\nFAIL: {failures} upsert race(s) raised IntegrityError or created duplicate rows")
+        return 1
+    print("\nUpserts: no IntegrityErrors, one row per key")
+    return 0
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    sys.exit(asyncio.run(main(*args)))
@@ -0,0 +1,131 @@
+"""Benchmark: per-message user lookups for chat relaying, database vs UserCache.
+
+Fills a throwaway database with users who have forum topics, then times
+the lookups the relay handlers did for every message (UserCRUD.get for
+user -> forum, SELECT by forum_topic_id for forum -> user; copied below)
+against UserCache.get / get_by_topic for a stream of messages from a
+small set of active chats. Also checks that writes through UserCRUD are
+visible through the cache right away, including a load that overlaps a
+write.
+
+Usage:
+    python benchmark_user_cache.py [users] [messages]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_tmp.name) / 'user_cache.db'}"
+
+from sqlalchemy import insert, select
+
+from database.crud import BULK_BATCH_SIZE, UserCRUD
+from database.engine import async_session_maker, engine, init_db
+from database.models import User
+from services.user_cache import UserCache, get_user_cache
+
+ACTIVE_CHATS = 200
+TOPIC_OFFSET = 500000
+
+
+async def old_user_lookup(user_id: int):
+    """Previous handle_user_reply lookup."""
+    async with async_session_maker() as session:
+        return await UserCRUD.get(session, user_id)
+
+
+async def old_topic_lookup(topic_id: int):
+    """Previous handle_admin_message_in_topic lookup."""
+    async with async_session_maker() as session:
+        result = await session.execute(select(User).where(User.forum_topic_id == topic_id))
+        return result.scalar_one_or_none()
+
+
+async def fill(users: int):
+    """Insert users, every other one with a forum topic."""
+    rows = [
+        {"id": 1000 + i, "pride_gift_id": 10000 + i, "quiz_completed": i % 2 == 0,
+         "forum_topic_id": TOPIC_OFFSET + i if i % 2 == 0 else None}
+        for i in range(users)
+    ]
+    async with async_session_maker() as session:
+        for i in range(0, len(rows), BULK_BATCH_SIZE):
+            await session.execute(insert(User), rows[i:i + BULK_BATCH_SIZE])
+        await session.commit()
+
+
+async def timed(lookup, keys) -> float:
+    """Total time of lookups for keys, ms."""
+    start = time.perf_counter()
+    for key in keys:
+        await lookup(key)
+    return (time.perf_counter() - start) * 1000
+
+
+async def check_invalidation():
+    """Writes through UserCRUD are seen through the cache immediately."""
+    cache = get_user_cache()
+    user_id = 1001  # No topic yet
+    assert (await cache.get(user_id)).forum_topic_id is None
+    assert await cache.get_by_topic(42) is None
+
+    async with async_session_maker() as session:
+        await UserCRUD.update_forum_topic(session, user_id, 42)
+        await UserCRUD.set_gender(session, user_id, "female")
+    user = await cache.get(user_id)
+    assert user.forum_topic_id == 42 and user.gender == "female"
+    assert (await cache.get_by_topic(42)).id == user_id
+
+    async with async_session_maker() as session:
+        await UserCRUD.update_forum_topic(session, user_id, 43)
+    assert await cache.get_by_topic(42) is None
+    assert (await cache.get_by_topic(43)).id == user_id
+
+    # A load racing a write must not leave the old value cached
+    cache.invalidate([user_id])
+    async with async_session_maker() as session:
+        loading = asyncio.create_task(cache.get(user_id))
+        await asyncio.sleep(0)
+        await UserCRUD.mark_quiz_completed(session, user_id)
+    await loading
+    assert (await cache.get(user_id)).quiz_completed
+    print("writes through UserCRUD visible through the cache: OK")
+
+
+async def main(users: int = 100000, messages: int = 5000):
+    """Time lookups for a stream of messages from active chats."""
+    await init_db()
+    await fill(users)
+
+    chats = random.sample(range(0, users, 2), ACTIVE_CHATS)
+    stream = [random.choice(chats) for _ in range(messages)]
+    user_ids = [1000 + i for i in stream]
+    topic_ids = [TOPIC_OFFSET + i for i in stream]
+
+    old_user_ms = await timed(old_user_lookup, user_ids)
+    old_topic_ms = await timed(old_topic_lookup, topic_ids)
+    cache = UserCache()
+    new_user_ms = await timed(cache.get, user_ids)
+    new_topic_ms = await timed(cache.get_by_topic, topic_ids)
+    stats = cache.stats()
+
+    print(f"{messages} messages from {ACTIVE_CHATS} chats, {users} users")
+    print(f"user -> forum:  database {old_user_ms:7.1f} ms, cache {new_user_ms:6.1f} ms "
+          f"(hit rate {stats['user_hit_rate']:.1%})")
+    print(f"forum -> user:  database {old_topic_ms:7.1f} ms, cache {new_topic_ms:6.1f} ms "
+          f"(hit rate {stats['topic_hit_rate']:.1%})\n")
+
+    await check_invalidation()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*args))
@@ -0,0 +1,140 @@
+"""Benchmark: admin user list page flips, ID list in FSM vs keyset pages.
+
+For growing audiences, measures opening a list and flipping to the first,
+a middle and the last page with the previous approach (load every user,
+keep the IDs in state, one UserCRUD.get per ID on the page; copied below)
+and with UserListing (count once, one keyset query per page). Also walks
+one audience forwards and backwards to check every user is listed once.
+
+Usage:
+    python benchmark_user_listing.py [largest audience]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{Path(_tmp.name) / 'listing.db'}"
+
+from sqlalchemy import insert
+
+from database.crud import BULK_BATCH_SIZE, UserCRUD
+from database.engine import async_session_maker, engine, init_db
+from database.models import User
+from services.user_listing import UserListing
+
+PAGE_SIZE = 10
+
+
+async def old_open(audience: str) -> dict:
+    """Previous flow start: every user of the audience, IDs stored in state."""
+    async with async_session_maker() as session:
+        users = await UserCRUD.get_users_by_filter(session, audience)
+    return {"broadcast_users": [u.id for u in users]}
+
+
+async def old_page(state: dict, page: int) -> list:
+    """Previous page flip: slice the ID list, one query per ID."""
+    page_user_ids = state["broadcast_users"][page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+    async with async_session_maker() as session:
+        users = []
+        for uid in page_user_ids:
+            user = await UserCRUD.get(session, uid)
+            if user:
+                users.append(user)
+    return users
+
+
+async def fill(start: int, count: int):
+    """Add count completed users with IDs after start."""
+    rows = [
+        {"id": start + i, "pride_gift_id": start + i, "gender": "male" if i % 2 else "female",
+         "quiz_completed": True, "is_reachable": True}
+        for i in range(count)
+    ]
+    async with async_session_maker() as session:
+        for i in range(0, len(rows), BULK_BATCH_SIZE):
+            await session.execute(insert(User), rows[i:i + BULK_BATCH_SIZE])
+        await session.commit()
+
+
+def ms(start: float) -> float:
+    """Milliseconds since start."""
+    return (time.perf_counter() - start) * 1000
+
+
+async def measure(size: int):
+    """Time old and new approaches on an audience of size users."""
+    start = time.perf_counter()
+    state = await old_open("completed")
+    old_open_ms = ms(start)
+    pages = len(state["broadcast_users"]) // PAGE_SIZE
+    old_flips = []
+    for page in (0, pages // 2, pages - 1):
+        start = time.perf_counter()
+        await old_page(state, page)
+        old_flips.append(ms(start))
+    old_state = len(json.dumps(state))
+
+    listing_service = UserListing(ttl=0)  # No cache: measure the query itself
+    start = time.perf_counter()
+    listing = await listing_service.open("completed")
+    new_open_ms = ms(start)
+    opened_state = len(json.dumps(listing))
+    new_flips = []
+    for page in range(pages):
+        start = time.perf_counter()
+        await listing_service.get_page(listing, page, PAGE_SIZE)
+        if page in (0, pages // 2, pages - 1):
+            new_flips.append(ms(start))
+    new_state = len(json.dumps(listing))
+
+    print(
+        f"{size:7}  old: open {old_open_ms:7.1f} ms, flip first/mid/last "
+        f"{'/'.join(f'{t:.1f}' for t in old_flips)} ms, state {old_state} bytes\n"
+        f"{'':7}  new: open {new_open_ms:7.1f} ms, flip first/mid/last "
+        f"{'/'.join(f'{t:.1f}' for t in new_flips)} ms, state {opened_state} bytes "
+        f"({new_state} after visiting all {pages} pages)"
+    )
+
+
+async def check_walk():
+    """Walk 'male' forwards then back: pages are disjoint, ordered and complete."""
+    listing_service = UserListing()
+    listing = await listing_service.open("male")
+    pages = listing_service.total_pages(listing, PAGE_SIZE)
+    forward = []
+    for page in range(pages):
+        shown, users = await listing_service.get_page(listing, page, PAGE_SIZE)
+        assert shown == page
+        forward.append([u.id for u in users])
+    for page in reversed(range(pages)):
+        _, users = await listing_service.get_page(listing, page, PAGE_SIZE)
+        assert [u.id for u in users] == forward[page]
+    ids = [uid for page in forward for uid in page]
+    assert ids == sorted(set(ids)) and len(ids) == listing["total"]
+    print(f"\nwalked {pages} pages of {listing['total']} users forwards and back: OK")
+
+
+async def main(largest: int = 100000):
+    """Grow the audience tenfold per step and measure."""
+    await init_db()
+    size, filled = 1000, 0
+    while size <= largest:
+        await fill(10000 + filled, size - filled)
+        filled = size
+        await measure(size)
+        size *= 10
+    await check_walk()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:2]]
+    asyncio.run(main(*args))
@@ -155,8 +155,9 @@ def get_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
     """Get confirmation keyboard for broadcast."""
     builder = InlineKeyboardBuilder()
     builder.button(text="✅ Отправить", callback_data="admin_broadcast_send")
+    builder.button(text="⏰ Запланировать", callback_data="admin_broadcast_schedule")
     builder.button(text="❌ Отмена", callback_data="admin_broadcast_cancel")
-    builder.adjust(2)
+    builder.adjust(2, 1)
     return builder.as_markup()
 
 
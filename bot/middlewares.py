@@ -0,0 +1,72 @@
+"""Dispatcher middlewares."""
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import settings
+from database.engine import counting_queries, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """SQL statements per update, by handler."""
+
+    def __init__(self):
+        """Initialize stats."""
+        # handler -> [updates, statements, most statements in one update]
+        self.handlers: Dict[str, List[int]] = {}
+
+    def record(self, handler: str, queries: int) -> None:
+        """Add an update handled by handler."""
+        stats = self.handlers.setdefault(handler, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += queries
+        stats[2] = max(stats[2], queries)
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    One database session per update, committed once after the handler.
+
+    The handler gets it as the session argument, and services it calls
+    (FSM storage, file_id cache) write through it as well. CRUD helpers
+    only flush in it (see database.engine.unit_of_work); it is committed
+    once when the handler returns and rolled back if it raises, so a
+    handler that makes several writes costs one commit instead of one per
+    helper, and a failed update leaves nothing behind. Sessions connect
+    lazily: updates whose handler does not use it cost nothing.
+
+    SQL statements executed while handling each update (in any session,
+    including services') are counted per handler; an update over
+    UPDATE_QUERY_WARN statements is logged as a warning.
+    """
+
+    def __init__(self, warn_queries: int = None):
+        """Initialize middleware."""
+        self.warn_queries = warn_queries or settings.UPDATE_QUERY_WARN
+        self.stats = QueryStats()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Run handler in a unit of work and count its queries."""
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+
+        with counting_queries() as queries:
+            async with unit_of_work() as session:
+                data["session"] = session
+                result = await handler(event, data)
+
+        self.stats.record(name, queries.count)
+        if queries.count > self.warn_queries:
+            logger.warning(f"{name}: {queries.count} SQL statements for one update")
+        else:
+            logger.debug(f"{name}: {queries.count} SQL statements")
+        return result
@@ -24,6 +24,7 @@ class AdminStates(StatesGroup):
     broadcast_personal_id_input = State()  # Input user ID for personal message
     broadcast_waiting_message = State()    # Waiting for message content
     broadcast_confirmation = State()       # Confirm before sending
+    broadcast_schedule_input = State()     # Input time of scheduled broadcast
 
     # Old broadcast states (deprecated, kept for compatibility)
     broadcast_viewing_users = State()      # Paginated user list
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Check that hot lookups use indexes (EXPLAIN QUERY PLAN) on fresh and migrated databases.
+
+Builds two throwaway databases: one created from the current models and one
+with the schema before the migration set (no hot-path indexes, duplicate
+quiz answers), upgraded by run_migrations(). Every hot query must be
+answered through the expected index on both. Exits with status 1 on failure;
+deploy_to_server.sh/.bat run it first and stop the deploy if it fails.
+
+Usage:
+    python check_query_plans.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("BOT_TOKEN", "0:check")
+
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.crud import QuizAnswerCRUD, RaffleCRUD, UserCRUD
+from database.engine import build_engine, build_session_maker
+from database.migrations import run_migrations
+from database.models import Base, FsmRecord, QuizAnswer, User, UserMessage
+
+# Schema of a production database before the migration set (baseline models + old scripts)
+LEGACY_SCHEMA = [
+    """CREATE TABLE users (
+        id BIGINT PRIMARY KEY, pride_gift_id INTEGER, forum_topic_id INTEGER,
+        username VARCHAR(255), full_name VARCHAR(255), created_at DATETIME,
+        quiz_completed BOOLEAN, photo_uploaded BOOLEAN, gender VARCHAR(10),
+        is_winner BOOLEAN, referrer_id BIGINT
+    )""",
+    "CREATE UNIQUE INDEX idx_pride_gift_id ON users(pride_gift_id)",
+    "CREATE INDEX ix_users_referrer_id ON users(referrer_id)",
+    """CREATE TABLE quiz_answers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id BIGINT NOT NULL,
+        question_number INTEGER NOT NULL, answer TEXT NOT NULL, created_at DATETIME
+    )""",
+    "CREATE INDEX ix_quiz_answers_user_id ON quiz_answers(user_id)",
+    """CREATE TABLE user_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id BIGINT NOT NULL,
+        forum_message_id INTEGER NOT NULL, user_message_id INTEGER,
+        direction VARCHAR(20) NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""",
+    "CREATE INDEX idx_user_messages_user_id ON user_messages(user_id)",
+    "INSERT INTO users (id, pride_gift_id, quiz_completed, gender) VALUES (1, 10001, 1, 'male')",
+    "INSERT INTO quiz_answers (user_id, question_number, answer) VALUES (1, 1, 'old')",
+    "INSERT INTO quiz_answers (user_id, question_number, answer) VALUES (1, 1, 'new')",
+]
+
+# (description, query or CRUD call, index the plan must use)
+HOT_QUERIES = [
+    ("forum message -> user by topic",
+     select(User).where(User.forum_topic_id == 42), "ix_users_forum_topic_id"),
+    ("quiz answer by user and question",
+     select(QuizAnswer).where(QuizAnswer.user_id == 1, QuizAnswer.question_number == 3),
+     "uq_quiz_answers_user_question"),
+    ("user message by forum message",
+     select(UserMessage).where(UserMessage.forum_message_id == 7), "ix_user_messages_forum_message_id"),
+    ("audience 'male'",
+     lambda session: UserCRUD.get_users_by_filter(session, "male"), "ix_users_reachable_gender"),
+    ("audience 'female'",
+     lambda session: UserCRUD.get_users_by_filter(session, "female"), "ix_users_reachable_gender"),
+    ("audience 'completed'",
+     lambda session: UserCRUD.get_users_by_filter(session, "completed"), "ix_users_reachable_quiz"),
+    ("audience 'incomplete'",
+     lambda session: UserCRUD.get_users_by_filter(session, "incomplete"), "ix_users_reachable_quiz"),
+    ("audience 'all'",
+     lambda session: UserCRUD.get_users_by_filter(session, "all"), "ix_users_reachable_"),
+    ("user list page 'male'",
+     lambda session: UserCRUD.get_users_page(session, "male", 5000, 10), "ix_users_reachable_gender"),
+    ("user list page 'completed'",
+     lambda session: UserCRUD.get_users_page(session, "completed", 5000, 10), "ix_users_reachable_quiz"),
+    ("user list page 'all'",
+     lambda session: UserCRUD.get_users_page(session, "all", 5000, 10), "ix_users_reachable_id"),
+    ("certificate list page (unreachable included)",
+     lambda session: UserCRUD.get_users_page(session, "completed", 5000, 10, include_unreachable=True),
+     "ix_users_quiz_completed_id"),
+    ("raffle participant IDs",
+     RaffleCRUD.get_participant_ids, "ix_users_quiz_completed_id"),
+    ("idle FSM states to purge",
+     select(FsmRecord.key).where(FsmRecord.updated_at < datetime(2025, 1, 1)), "ix_fsm_records_updated_at"),
+]
+
+
+async def query_plan(engine: AsyncEngine, query) -> str:
+    """Get EXPLAIN QUERY PLAN of a statement or of the SELECT a CRUD call runs."""
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        async with build_session_maker(engine)() as session:
+            if callable(query):
+                await query(session)
+            else:
+                await session.execute(query)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+    statement, parameters = captured[-1]
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        cursor = await raw.driver_connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        rows = await cursor.fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+async def check_database(name: str, engine: AsyncEngine) -> int:
+    """Check all hot queries, return number of failures."""
+    failures = 0
+    print(f"\n{name}:")
+    for description, query, index in HOT_QUERIES:
+        plan = await query_plan(engine, query)
+        ok = f"INDEX {index}" in plan and "SCAN" not in plan and "TEMP B-TREE" not in plan
+        failures += not ok
+        print(f"  {'OK  ' if ok else 'FAIL'} {description}: {plan.replace(chr(10), '; ')}")
+
+    # Upsert relies on the unique index: a second answer replaces the first
+    async with build_session_maker(engine)() as session:
+        await QuizAnswerCRUD.add_answer(session, 1, 1, "first")
+        await QuizAnswerCRUD.add_answer(session, 1, 1, "second")
+        answers = [a for a in await QuizAnswerCRUD.get_user_answers(session, 1) if a.question_number == 1]
+    ok = [a.answer for a in answers] == ["second"]
+    failures += not ok
+    print(f"  {'OK  ' if ok else 'FAIL'} add_answer upsert keeps one row per question")
+    return failures
+
+
+async def main() -> int:
+    """Build both databases and check them."""
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        fresh = build_engine(f"sqlite+aiosqlite:///{Path(tmp) / 'fresh.db'}")
+        async with fresh.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(fresh)
+        failures += await check_database("Fresh database (create_all)", fresh)
+        await fresh.dispose()
+
+        legacy = build_engine(f"sqlite+aiosqlite:///{Path(tmp) / 'legacy.db'}")
+        async with legacy.begin() as conn:
+            for statement in LEGACY_SCHEMA:
+                await conn.execute(text(statement))
+            await conn.run_sync(Base.metadata.create_all)
+        applied = await run_migrations(legacy)
+        print(f"\nMigrations applied to legacy database: {applied}")
+        failures += await check_database("Legacy database (migrated)", legacy)
+        await legacy.dispose()
+
+    print(f"\n{'All query plans use indexes' if not failures else f'{failures} check(s) failed'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -8,7 +8,7 @@ from database.crud import UserCRUD
 async def main():
     """Check completed users."""
     async with async_session_maker() as session:
-        users = await UserCRUD.get_users_by_filter(session, 'completed')
+        users = await UserCRUD.get_users_by_filter(session, 'completed', include_unreachable=True)
         print(f"Completed users: {len(users)}")
 
         for user in users[:10]:  # Show first 10
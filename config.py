@@ -14,6 +14,19 @@ class Settings(BaseSettings):
     # Database
     DATABASE_URL: str = "sqlite+aiosqlite:///bot.db"
 
+    # SQLite performance profile (applied to every connection)
+    SQLITE_TUNED: bool = True                 # False - настройки SQLite по умолчанию
+    SQLITE_JOURNAL_MODE: str = "WAL"          # Читатели не ждут писателя
+    SQLITE_SYNCHRONOUS: str = "NORMAL"        # fsync только на checkpoint (безопасно в WAL)
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000        # Ждать блокировку вместо "database is locked"
+    SQLITE_CACHE_SIZE_KB: int = 16384         # Кэш страниц на соединение
+    SQLITE_MMAP_SIZE: int = 67108864          # Байт файла БД в memory-mapped I/O
+    SQLITE_TEMP_STORE: str = "MEMORY"         # Временные таблицы и индексы в памяти
+    SQLITE_POOL_SIZE: int = 8                 # Открытых соединений в пуле (настройки выше - один раз на соединение)
+    SQLITE_SERIALIZE_WRITES: bool = True      # Одна пишущая транзакция за раз (чтения параллельны)
+    SQLITE_WRITE_LOCK_TIMEOUT: float = 30.0   # Макс. ожидание очереди писателей, сек (затем ошибка, не зависание)
+    UPDATE_QUERY_WARN: int = 30               # Больше SQL-запросов на один апдейт - предупреждение в логе
+
     # Quiz Settings
     QUIZ_END_DATE: str = "2025-12-30"
     WINNERS_COUNT: int = 30
@@ -34,6 +47,58 @@ class Settings(BaseSettings):
     NANO_BANANA_API_KEY: str = ""
     NANO_BANANA_URL: str = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
 
+    # AI HTTP client pool (shared keep-alive connections to Gemini / OpenAI)
+    AI_HTTP_POOL_SIZE: int = 50          # Всего соединений в пуле
+    AI_HTTP_LIMIT_PER_HOST: int = 10     # Соединений на один хост
+    AI_HTTP_KEEPALIVE_TIMEOUT: float = 60.0  # Секунд держать простаивающее соединение
+
+    # Gemini description cache
+    DESCRIPTION_CACHE_TTL_HOURS: int = 168     # Хранить описание 7 дней
+    DESCRIPTION_CACHE_MAX_ENTRIES: int = 20000 # LRU-лимит записей
+
+    # Generation queue (photo -> figurine pipeline)
+    GENERATION_WORKERS: int = 4           # Воркеров в пуле
+    GENERATION_MAX_IN_FLIGHT: int = 4     # Одновременных генераций (запросов к AI API)
+    GENERATION_QUEUE_MAX_DEPTH: int = 200 # Максимум заданий в очереди
+    GENERATION_MAX_ATTEMPTS: int = 3      # Попыток на задание (ошибки и перезапуски бота)
+    GENERATION_RETRY_DELAY: float = 10.0  # Секунд до повтора после ошибки (умножается на номер попытки)
+
+    # Speculative Gemini analysis started right after photo upload
+    GENERATION_PREWARM_ENABLED: bool = True
+    GENERATION_PREWARM_MAX_IN_FLIGHT: int = 8  # Одновременных спекулятивных запросов к Gemini
+    GENERATION_PREWARM_TTL: float = 1800.0     # Секунд хранить невостребованный результат
+
+    # Broadcasts (Telegram allows ~30 messages/s per bot)
+    BROADCAST_RATE: float = 28.0              # Сообщений в секунду (общий лимит на все рассылки)
+    BROADCAST_BURST: float = 1.0              # Запас токенов (1 - равномерная отправка)
+    BROADCAST_WORKERS: int = 16               # Параллельных отправителей
+    BROADCAST_MAX_RETRIES: int = 3            # Повторов после flood wait на получателя
+    BROADCAST_PROGRESS_INTERVAL: float = 3.0  # Секунд между обновлениями статуса
+    BROADCAST_LEDGER_BATCH: int = 200         # Статусов доставки в одной записи в БД
+    BROADCAST_SCHEDULE_UTC_OFFSET: int = 3    # Часовой пояс отложенных рассылок (UTC+3 - Москва, Волгоград); в БД - UTC
+
+    # Data export (Telegram accepts documents up to 50 MB from bots)
+    EXPORT_GZIP: bool = False                 # Сжимать CSV (.csv.gz)
+    EXPORT_PART_MAX_BYTES: int = 49000000     # Больше - делим экспорт на части
+    EXPORT_FETCH_SIZE: int = 1000             # Строк за одну выборку из курсора
+    EXPORT_SPOOL_MAX_SIZE: int = 8388608      # Больше - часть сбрасывается во временный файл на диске
+
+    # In-memory user cache (topic, gender, flags) for message relaying
+    USER_CACHE_MAX_ENTRIES: int = 10000       # LRU-лимит пользователей
+    USER_CACHE_TTL: float = 300.0             # Секунд до перечитывания из БД
+
+    # Relayed message log (write-behind: rows are buffered and inserted in batches)
+    MESSAGE_LOG_BATCH: int = 100              # Строк в одной записи в БД
+    MESSAGE_LOG_FLUSH_INTERVAL: float = 0.5   # Секунд максимум держать строку в буфере
+    MESSAGE_LOG_MAX_PENDING: int = 10000      # Больше - отправка ждёт записи (при ошибках БД старые строки теряются)
+
+    # FSM storage (quiz progress and admin dialogs)
+    FSM_STORAGE: str = "database"             # database - таблица fsm_records в БД бота, redis, memory
+    FSM_REDIS_URL: str = "redis://localhost:6379/0"  # Для FSM_STORAGE=redis
+    FSM_STATE_TTL_HOURS: int = 168            # Состояние без изменений дольше - удаляется (7 дней)
+    FSM_CACHE_MAX_ENTRIES: int = 10000        # LRU-лимит состояний в памяти
+    FSM_PURGE_INTERVAL: float = 3600.0        # Секунд между удалениями устаревших состояний
+
     # Forum Group
     FORUM_GROUP_ID: int = 0
 
@@ -1,47 +1,184 @@
 """CRUD operations for database."""
-from typing import List, Optional
-import random
-from sqlalchemy import select, update
-from sqlalchemy.ext.asyncio import AsyncSession
-from database.models import User, QuizAnswer, UserPhoto, QuizQuestion, UserMessage
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import secrets
+from sqlalchemy import event, select, update, delete, insert, func, or_, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncResult, AsyncSession
+from sqlalchemy.orm import Session
+from database.engine import UNIT_OF_WORK
+from database.models import (
+    User, QuizAnswer, UserPhoto, QuizQuestion, UserMessage, GenerationJob, FaceDescription, TelegramFile,
+    BroadcastCampaign, BroadcastDelivery, ScheduledBroadcast, IdAllocator, StatCounter,
+    RaffleDraw, FsmRecord
+)
+from utils.id_permutation import id_for_counter
+
+# Rows per bulk INSERT/UPDATE statement (SQLite limits bound parameters per statement)
+BULK_BATCH_SIZE = 500
+
+# Statistics counters (stat_counters.name); per-gender ones are f"gender_{gender}"
+STAT_REGISTRATIONS = "registrations"
+STAT_QUIZ_COMPLETED = "quiz_completed"
+STAT_PHOTOS = "photo_uploaded"
+STAT_REFERRALS = "referrals"
+STAT_WINNERS = "winners"
+
+# Called with the IDs of users whose row was written (None: any user may
+# have changed) after the write commits; in-memory caches drop those users
+_user_write_listeners: List[Callable[[Optional[List[int]]], None]] = []
+
+# session.info key: users written in the current transaction
+_USERS_WRITTEN = "users_written"
+
+
+def on_user_write(listener: Callable[[Optional[List[int]]], None]):
+    """Register listener for committed writes to users."""
+    _user_write_listeners.append(listener)
+
+
+def _users_written(session: AsyncSession, user_ids: Optional[Iterable[int]] = None):
+    """Remember users written in this transaction; listeners hear about them once it commits."""
+    session.info.setdefault(_USERS_WRITTEN, []).append(list(user_ids) if user_ids is not None else None)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_users_written(session: Session):
+    """Pass users written by the committed transaction to listeners."""
+    for user_ids in session.info.pop(_USERS_WRITTEN, []):
+        for listener in _user_write_listeners:
+            listener(user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_users_written(session: Session):
+    """Rolled back writes change nothing."""
+    session.info.pop(_USERS_WRITTEN, None)
+
+
+async def _commit(session: AsyncSession):
+    """
+    Commit, or only flush inside a unit of work (see database.engine.unit_of_work).
+
+    There the owner of the session commits all writes at once.
+    """
+    if session.info.get(UNIT_OF_WORK):
+        await session.flush()
+    else:
+        await session.commit()
+
+
+def upsert(session: AsyncSession, model):
+    """
+    Build INSERT for the session's dialect that supports ON CONFLICT.
+
+    Both SQLite and PostgreSQL insert constructs provide
+    on_conflict_do_update / on_conflict_do_nothing and .excluded.
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upsert is not supported for {dialect}")
+
+
+def audience_conditions(filter_type: str, include_unreachable: bool = False) -> list:
+    """
+    WHERE conditions selecting users of a broadcast audience.
+
+    Filter types:
+    - 'all': All users
+    - 'male': Male users
+    - 'female': Female users
+    - 'completed': Users who received card
+    - 'incomplete': Users who didn't complete quiz
+    - 'admins': Admin users only (for testing)
+    """
+    conditions = []
+    if not include_unreachable:
+        conditions.append(User.is_reachable == True)
+
+    if filter_type == 'male':
+        conditions.append(User.gender == 'male')
+    elif filter_type == 'female':
+        conditions.append(User.gender == 'female')
+    elif filter_type == 'completed':
+        conditions.append(User.quiz_completed == True)
+    elif filter_type == 'incomplete':
+        conditions.append(User.quiz_completed == False)
+    elif filter_type == 'admins':
+        from config import settings
+        conditions.append(User.id.in_(settings.admin_ids_list))
+    # 'all' - no filter
+    return conditions
 
 
 class UserCRUD:
     """CRUD operations for User model."""
 
     @staticmethod
-    async def _generate_unique_pride_id(session: AsyncSession) -> int:
-        """Generate unique 5-digit Pride GIFT ID."""
-        max_attempts = 100
-        for _ in range(max_attempts):
-            pride_id = random.randint(10000, 99999)
-            # Check if this ID already exists
-            result = await session.execute(
-                select(User).where(User.pride_gift_id == pride_id)
-            )
-            if not result.scalar_one_or_none():
-                return pride_id
-        raise ValueError("Could not generate unique Pride GIFT ID")
+    async def allocate_pride_gift_id(session: AsyncSession) -> int:
+        """
+        Take the next Pride GIFT ID in O(1): one counter UPDATE ... RETURNING.
+
+        The persisted counter value is mapped through a keyed permutation
+        of the ID range (see utils.id_permutation), so IDs never repeat and
+        do not look sequential. An ID assigned before the allocator existed
+        may come out again; get_or_create's insert skips it and takes the
+        next one.
+        """
+        counter, key = await IdAllocatorCRUD.next_value(session, "pride_gift_id")
+        return id_for_counter(counter, bytes.fromhex(key))
 
     @staticmethod
     async def get_or_create(session: AsyncSession, user_id: int, username: str = None, full_name: str = None) -> User:
-        """Get existing user or create new one."""
-        result = await session.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one_or_none()
+        """
+        Get existing user or create new one.
+
+        An existing user is one SELECT by primary key; they are only written
+        if they were unreachable (they may have unblocked the bot and
+        pressed /start). A Pride GIFT ID is allocated only when the user is
+        not there, and the row is inserted with ON CONFLICT DO NOTHING
+        RETURNING: if a concurrent call inserted the user first, or the ID
+        was assigned before the allocator existed, nothing is inserted and
+        the lookup runs again. Registrations are counted in the same
+        transaction.
+        """
+        while True:
+            user = await UserCRUD.get(session, user_id)
+            if user is not None:
+                if not user.is_reachable:
+                    result = await session.execute(
+                        update(User)
+                        .where(User.id == user_id, User.is_reachable == False)
+                        .values(is_reachable=True)
+                        .returning(User)
+                        .execution_options(populate_existing=True)
+                    )
+                    if result.scalar_one_or_none() is not None:
+                        _users_written(session, [user_id])
+                        await _commit(session)
+                return user
 
-        if not user:
-            pride_gift_id = await UserCRUD._generate_unique_pride_id(session)
-            user = User(
+            pride_gift_id = await UserCRUD.allocate_pride_gift_id(session)
+            statement = upsert(session, User).values(
                 id=user_id,
                 pride_gift_id=pride_gift_id,
                 username=username,
-                full_name=full_name
-            )
-            session.add(user)
-            await session.commit()
-            await session.refresh(user)
-
-        return user
+                full_name=full_name,
+                created_at=datetime.utcnow(),
+                quiz_completed=False,
+                photo_uploaded=False,
+                is_winner=False,
+                is_reachable=True
+            ).on_conflict_do_nothing().returning(User)
+            user = (await session.execute(statement)).scalar_one_or_none()
+            if user is not None:
+                await StatsCRUD.bump(session, {STAT_REGISTRATIONS: 1})
+                _users_written(session, [user_id])
+                await _commit(session)
+                return user
 
     @staticmethod
     async def get(session: AsyncSession, user_id: int) -> Optional[User]:
@@ -49,37 +186,72 @@ class UserCRUD:
         result = await session.execute(select(User).where(User.id == user_id))
         return result.scalar_one_or_none()
 
+    @staticmethod
+    async def get_by_forum_topic(session: AsyncSession, topic_id: int) -> Optional[User]:
+        """Get user whose forum topic is topic_id."""
+        result = await session.execute(select(User).where(User.forum_topic_id == topic_id).limit(1))
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def _set_flag(session: AsyncSession, user_id: int, column, value: bool, counter: str):
+        """
+        Set boolean column of user and adjust its counter in the same transaction.
+
+        Only a real change is written and counted, so repeated calls are
+        no-ops for statistics.
+        """
+        changed = column.is_not(True) if value else column == True
+        result = await session.execute(
+            update(User).where(User.id == user_id, changed).values({column.key: value})
+        )
+        if result.rowcount:
+            await StatsCRUD.bump(session, {counter: 1 if value else -1})
+            _users_written(session, [user_id])
+        await _commit(session)
+
     @staticmethod
     async def update_quiz_status(session: AsyncSession, user_id: int, completed: bool = True):
         """Update quiz completion status."""
-        await session.execute(
-            update(User).where(User.id == user_id).values(quiz_completed=completed)
-        )
-        await session.commit()
+        await UserCRUD._set_flag(session, user_id, User.quiz_completed, completed, STAT_QUIZ_COMPLETED)
 
     @staticmethod
     async def update_photo_status(session: AsyncSession, user_id: int, uploaded: bool = True):
         """Update photo upload status."""
-        await session.execute(
-            update(User).where(User.id == user_id).values(photo_uploaded=uploaded)
-        )
-        await session.commit()
+        await UserCRUD._set_flag(session, user_id, User.photo_uploaded, uploaded, STAT_PHOTOS)
 
     @staticmethod
     async def set_gender(session: AsyncSession, user_id: int, gender: str):
-        """Set user gender."""
-        await session.execute(
-            update(User).where(User.id == user_id).values(gender=gender)
-        )
-        await session.commit()
+        """
+        Set user gender, moving the user between per-gender counters.
+
+        The update only applies if the gender read just before is still
+        there (compare-and-set), so concurrent changes keep counters exact.
+        """
+        while True:
+            row = (await session.execute(select(User.gender).where(User.id == user_id))).one_or_none()
+            if row is None or row.gender == gender:
+                return
+            result = await session.execute(
+                update(User)
+                .where(User.id == user_id, User.gender.is_not_distinct_from(row.gender))
+                .values(gender=gender)
+            )
+            if result.rowcount:
+                break
+
+        deltas = {}
+        if row.gender:
+            deltas[f"gender_{row.gender}"] = -1
+        if gender:
+            deltas[f"gender_{gender}"] = 1
+        await StatsCRUD.bump(session, deltas)
+        _users_written(session, [user_id])
+        await _commit(session)
 
     @staticmethod
     async def set_winner(session: AsyncSession, user_id: int, is_winner: bool = True):
         """Mark user as winner."""
-        await session.execute(
-            update(User).where(User.id == user_id).values(is_winner=is_winner)
-        )
-        await session.commit()
+        await UserCRUD._set_flag(session, user_id, User.is_winner, is_winner, STAT_WINNERS)
 
     @staticmethod
     async def get_all_users(session: AsyncSession) -> List[User]:
@@ -95,6 +267,36 @@ class UserCRUD:
         )
         return list(result.scalars().all())
 
+    @staticmethod
+    async def stream_participants_with_answers(
+        session: AsyncSession,
+        question_numbers: Iterable[int],
+        fetch_size: int = 1000
+    ) -> AsyncResult:
+        """
+        Stream quiz participants with their answers in one query.
+
+        Answers are pivoted into one column per question (q1, q2, ...,
+        NULL if unanswered). Rows come from a server-side cursor in
+        batches of fetch_size, ordered by user ID.
+        """
+        answer_columns = [
+            func.max(case((QuizAnswer.question_number == number, QuizAnswer.answer))).label(f"q{number}")
+            for number in question_numbers
+        ]
+        query = (
+            select(
+                User.id, User.username, User.full_name, User.gender, User.quiz_completed,
+                User.photo_uploaded, User.is_winner, User.created_at, *answer_columns
+            )
+            .outerjoin(QuizAnswer, QuizAnswer.user_id == User.id)
+            .where(User.quiz_completed == True)
+            .group_by(User.id)
+            .order_by(User.id)
+            .execution_options(yield_per=fetch_size)
+        )
+        return await session.stream(query)
+
     @staticmethod
     async def get_winners(session: AsyncSession) -> List[User]:
         """Get all winners."""
@@ -106,10 +308,7 @@ class UserCRUD:
     @staticmethod
     async def mark_quiz_completed(session: AsyncSession, user_id: int):
         """Mark user as completed quiz (received card)."""
-        await session.execute(
-            update(User).where(User.id == user_id).values(quiz_completed=True)
-        )
-        await session.commit()
+        await UserCRUD._set_flag(session, user_id, User.quiz_completed, True, STAT_QUIZ_COMPLETED)
 
     @staticmethod
     async def update_forum_topic(session: AsyncSession, user_id: int, topic_id: int):
@@ -117,49 +316,95 @@ class UserCRUD:
         await session.execute(
             update(User).where(User.id == user_id).values(forum_topic_id=topic_id)
         )
-        await session.commit()
+        _users_written(session, [user_id])
+        await _commit(session)
 
     @staticmethod
     async def get_users_by_filter(
         session: AsyncSession,
-        filter_type: str
+        filter_type: str,
+        include_unreachable: bool = False
     ) -> List[User]:
         """
-        Get users by filter type.
-
-        Filter types:
-        - 'all': All users
-        - 'male': Male users
-        - 'female': Female users
-        - 'completed': Users who received card
-        - 'incomplete': Users who didn't complete quiz
-        - 'admins': Admin users only (for testing)
-        """
-        query = select(User)
-
-        if filter_type == 'male':
-            query = query.where(User.gender == 'male')
-        elif filter_type == 'female':
-            query = query.where(User.gender == 'female')
-        elif filter_type == 'completed':
-            query = query.where(User.quiz_completed == True)
-        elif filter_type == 'incomplete':
-            query = query.where(User.quiz_completed == False)
-        elif filter_type == 'admins':
-            from config import settings
-            query = query.where(User.id.in_(settings.admin_ids_list))
-        # 'all' - no filter
+        Get users by filter type (see audience_conditions).
 
+        Users who blocked the bot or deleted their account are skipped
+        unless include_unreachable is set.
+        """
+        query = select(User).where(*audience_conditions(filter_type, include_unreachable))
         result = await session.execute(query)
         return list(result.scalars().all())
 
+    @staticmethod
+    async def get_users_page(
+        session: AsyncSession,
+        filter_type: str,
+        after_id: int = 0,
+        limit: int = 10,
+        include_unreachable: bool = False
+    ) -> List[User]:
+        """
+        Get next page of users by filter type, ordered by ID (keyset pagination).
+
+        Returns up to limit users with ID greater than after_id; pass the
+        last ID of a page to get the next one. Cost does not depend on how
+        deep the page is. Unreachable users are skipped as in
+        get_users_by_filter.
+        """
+        result = await session.execute(
+            select(User)
+            .where(*audience_conditions(filter_type, include_unreachable), User.id > after_id)
+            .order_by(User.id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def count_users_by_filter(session: AsyncSession, filter_type: str, include_unreachable: bool = False) -> int:
+        """Count users get_users_by_filter would return."""
+        result = await session.execute(
+            select(func.count()).select_from(User).where(*audience_conditions(filter_type, include_unreachable))
+        )
+        return result.scalar_one()
+
+    @staticmethod
+    async def mark_unreachable(session: AsyncSession, user_ids: Iterable[int]) -> int:
+        """
+        Mark users who blocked the bot or deleted their account.
+
+        Returns:
+            Number of users that were reachable before
+        """
+        user_ids = list(user_ids)
+        marked = []
+        for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+            result = await session.execute(
+                update(User)
+                .where(User.id.in_(user_ids[start:start + BULK_BATCH_SIZE]), User.is_reachable == True)
+                .values(is_reachable=False)
+                .returning(User.id)
+                .execution_options(synchronize_session=False)
+            )
+            marked.extend(result.scalars())
+        if marked:
+            _users_written(session, marked)
+        await _commit(session)
+        return len(marked)
+
     @staticmethod
     async def set_referrer(session: AsyncSession, user_id: int, referrer_id: int):
-        """Set referrer ID for user."""
-        await session.execute(
-            update(User).where(User.id == user_id).values(referrer_id=referrer_id)
+        """Set referrer ID for user (counted as a referral the first time)."""
+        result = await session.execute(
+            update(User).where(User.id == user_id, User.referrer_id.is_(None)).values(referrer_id=referrer_id)
         )
-        await session.commit()
+        if result.rowcount:
+            await StatsCRUD.bump(session, {STAT_REFERRALS: 1})
+        else:
+            await session.execute(
+                update(User).where(User.id == user_id).values(referrer_id=referrer_id)
+            )
+        _users_written(session, [user_id])
+        await _commit(session)
 
     @staticmethod
     def generate_referral_link(bot_username: str, user_id: int) -> str:
@@ -183,28 +428,22 @@ class QuizAnswerCRUD:
     @staticmethod
     async def add_answer(session: AsyncSession, user_id: int, question_number: int, answer: str):
         """Add quiz answer. If answer for this question already exists, update it."""
-        # Check if answer already exists
+        # Single-statement upsert on the (user_id, question_number) unique index
+        statement = upsert(session, QuizAnswer).values(
+            user_id=user_id,
+            question_number=question_number,
+            answer=answer,
+            created_at=datetime.utcnow()
+        )
         result = await session.execute(
-            select(QuizAnswer).where(
-                QuizAnswer.user_id == user_id,
-                QuizAnswer.question_number == question_number
-            )
+            statement.on_conflict_do_update(
+                index_elements=[QuizAnswer.user_id, QuizAnswer.question_number],
+                set_={"answer": statement.excluded.answer}
+            ).returning(QuizAnswer).execution_options(populate_existing=True)
         )
-        existing_answer = result.scalar_one_or_none()
-
-        if existing_answer:
-            # Update existing answer
-            existing_answer.answer = answer
-        else:
-            # Add new answer
-            quiz_answer = QuizAnswer(
-                user_id=user_id,
-                question_number=question_number,
-                answer=answer
-            )
-            session.add(quiz_answer)
-
-        await session.commit()
+        quiz_answer = result.scalar_one()
+        await _commit(session)
+        return quiz_answer
 
     @staticmethod
     async def get_user_answers(session: AsyncSession, user_id: int) -> List[QuizAnswer]:
@@ -220,37 +459,27 @@ class UserPhotoCRUD:
 
     @staticmethod
     async def add_photo(session: AsyncSession, user_id: int, file_id: str, file_path: str):
-        """Add or update user photo."""
-        # Check if photo already exists
+        """Add or update user photo (resets generated path of a replaced photo)."""
+        statement = upsert(session, UserPhoto).values(
+            user_id=user_id,
+            file_id=file_id,
+            file_path=file_path,
+            generated_path=None,
+            created_at=datetime.utcnow()
+        )
         result = await session.execute(
-            select(UserPhoto).where(UserPhoto.user_id == user_id)
+            statement.on_conflict_do_update(
+                index_elements=[UserPhoto.user_id],
+                set_={
+                    "file_id": statement.excluded.file_id,
+                    "file_path": statement.excluded.file_path,
+                    "generated_path": None
+                }
+            ).returning(UserPhoto).execution_options(populate_existing=True)
         )
-        existing_photo = result.scalar_one_or_none()
-
-        if existing_photo:
-            # Update existing photo
-            await session.execute(
-                update(UserPhoto).where(UserPhoto.user_id == user_id).values(
-                    file_id=file_id,
-                    file_path=file_path,
-                    generated_path=None  # Reset generated path
-                )
-            )
-            await session.commit()
-            # Refresh to get updated data
-            await session.refresh(existing_photo)
-            return existing_photo
-        else:
-            # Create new photo
-            photo = UserPhoto(
-                user_id=user_id,
-                file_id=file_id,
-                file_path=file_path
-            )
-            session.add(photo)
-            await session.commit()
-            await session.refresh(photo)
-            return photo
+        photo = result.scalar_one()
+        await _commit(session)
+        return photo
 
     @staticmethod
     async def get_photo(session: AsyncSession, user_id: int) -> Optional[UserPhoto]:
@@ -266,7 +495,7 @@ class UserPhotoCRUD:
         await session.execute(
             update(UserPhoto).where(UserPhoto.user_id == user_id).values(generated_path=generated_path)
         )
-        await session.commit()
+        await _commit(session)
 
 
 class QuizQuestionCRUD:
@@ -308,7 +537,19 @@ class UserMessageCRUD:
             direction=direction
         )
         session.add(message)
-        await session.commit()
+        await _commit(session)
+
+    @staticmethod
+    async def log_messages(session: AsyncSession, messages: List[dict]):
+        """
+        Log message exchanges in bulk (one multi-row INSERT per BULK_BATCH_SIZE, one commit).
+
+        Each dict has UserMessage columns: user_id, forum_message_id,
+        user_message_id, direction and created_at.
+        """
+        for start in range(0, len(messages), BULK_BATCH_SIZE):
+            await session.execute(insert(UserMessage).values(messages[start:start + BULK_BATCH_SIZE]))
+        await _commit(session)
 
     @staticmethod
     async def get_user_messages(session: AsyncSession, user_id: int) -> List[UserMessage]:
@@ -317,3 +558,753 @@ class UserMessageCRUD:
             select(UserMessage).where(UserMessage.user_id == user_id).order_by(UserMessage.created_at)
         )
         return list(result.scalars().all())
+
+
+class GenerationJobCRUD:
+    """CRUD operations for persistent generation jobs."""
+
+    @staticmethod
+    async def create(
+        session: AsyncSession,
+        user_id: int,
+        chat_id: int,
+        file_path: str,
+        gender: str,
+        answers: list,
+        has_premium: bool = False,
+        processing_message_id: int | None = None
+    ) -> GenerationJob:
+        """Create pending generation job."""
+        job = GenerationJob(
+            user_id=user_id,
+            chat_id=chat_id,
+            file_path=file_path,
+            gender=gender,
+            answers=answers,
+            has_premium=has_premium,
+            processing_message_id=processing_message_id,
+            status="pending"
+        )
+        session.add(job)
+        await _commit(session)
+        return job
+
+    @staticmethod
+    async def claim_next(session: AsyncSession) -> Optional[GenerationJob]:
+        """
+        Atomically claim the oldest pending job.
+
+        Uses a single UPDATE ... RETURNING, so concurrent workers never
+        get the same job.
+        """
+        now = datetime.utcnow()
+        next_id = (
+            select(GenerationJob.id)
+            .where(GenerationJob.status == "pending")
+            .order_by(GenerationJob.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        result = await session.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id == next_id, GenerationJob.status == "pending")
+            .values(
+                status="in_progress",
+                attempts=GenerationJob.attempts + 1,
+                started_at=now,
+                updated_at=now
+            )
+            .returning(GenerationJob)
+            .execution_options(synchronize_session=False)
+        )
+        job = result.scalar_one_or_none()
+        await _commit(session)
+        return job
+
+    @staticmethod
+    async def mark_done(session: AsyncSession, job_id: int):
+        """Mark job as successfully finished."""
+        now = datetime.utcnow()
+        await session.execute(
+            update(GenerationJob).where(GenerationJob.id == job_id).values(
+                status="done", error=None, finished_at=now, updated_at=now
+            )
+        )
+        await _commit(session)
+
+    @staticmethod
+    async def mark_failed(session: AsyncSession, job_id: int, error: str):
+        """Mark job as failed with error text."""
+        now = datetime.utcnow()
+        await session.execute(
+            update(GenerationJob).where(GenerationJob.id == job_id).values(
+                status="failed", error=error[:2000], finished_at=now, updated_at=now
+            )
+        )
+        await _commit(session)
+
+    @staticmethod
+    async def requeue_failed(session: AsyncSession, job_id: int, error: str):
+        """Return job that failed an attempt to the pending state for another one."""
+        await session.execute(
+            update(GenerationJob).where(GenerationJob.id == job_id).values(
+                status="pending", error=error[:2000], updated_at=datetime.utcnow()
+            )
+        )
+        await _commit(session)
+
+    @staticmethod
+    async def requeue_interrupted(session: AsyncSession, max_attempts: int) -> Tuple[int, List[GenerationJob]]:
+        """
+        Return jobs left in progress by a restart to the pending state.
+
+        Jobs that already used max_attempts are marked failed instead.
+
+        Returns:
+            Number of jobs returned to pending, jobs marked failed (their
+            users still wait for a result and must be told)
+        """
+        now = datetime.utcnow()
+        result = await session.execute(
+            update(GenerationJob)
+            .where(GenerationJob.status == "in_progress", GenerationJob.attempts >= max_attempts)
+            .values(status="failed", error="Interrupted by restart too many times", finished_at=now, updated_at=now)
+            .returning(GenerationJob)
+            .execution_options(synchronize_session=False)
+        )
+        failed = list(result.scalars().all())
+        result = await session.execute(
+            update(GenerationJob)
+            .where(GenerationJob.status == "in_progress")
+            .values(status="pending", updated_at=now)
+        )
+        await _commit(session)
+        return result.rowcount, failed
+
+    @staticmethod
+    async def get_active_user_ids(session: AsyncSession) -> List[int]:
+        """Get IDs of users with pending or in-progress jobs."""
+        result = await session.execute(
+            select(GenerationJob.user_id).where(
+                GenerationJob.status.in_(("pending", "in_progress"))
+            )
+        )
+        return list(result.scalars().all())
+
+
+class FaceDescriptionCRUD:
+    """CRUD operations for cached Gemini face descriptions."""
+
+    @staticmethod
+    async def get(
+        session: AsyncSession,
+        sha256: str,
+        phash: str,
+        user_id: int,
+        ttl: timedelta
+    ) -> Optional[FaceDescription]:
+        """
+        Find fresh cached description by exact or perceptual hash.
+
+        Exact byte match wins; otherwise the same picture re-encoded by
+        Telegram is found by its perceptual hash, but only among the user's
+        own photos: different dark or low-contrast photos can share a dHash,
+        and another user's appearance must never end up in the prompt.
+        Does not write; uses are recorded in batches with record_uses().
+        """
+        result = await session.execute(
+            select(FaceDescription)
+            .where(
+                or_(
+                    FaceDescription.sha256 == sha256,
+                    (FaceDescription.phash == phash) & (FaceDescription.user_id == user_id)
+                ),
+                FaceDescription.created_at >= datetime.utcnow() - ttl
+            )
+            .order_by((FaceDescription.sha256 == sha256).desc(), FaceDescription.last_used_at.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def record_uses(session: AsyncSession, uses: Dict[int, Tuple[int, datetime]]):
+        """Add hits and set last use of entries ({entry_id: (hits, last_used_at)}) in one transaction."""
+        for entry_id, (hits, last_used_at) in uses.items():
+            await session.execute(
+                update(FaceDescription).where(FaceDescription.id == entry_id).values(
+                    hits=FaceDescription.hits + hits,
+                    last_used_at=last_used_at
+                )
+            )
+        await _commit(session)
+
+    @staticmethod
+    async def put(
+        session: AsyncSession,
+        sha256: str,
+        phash: str,
+        user_id: int,
+        description: str,
+        max_entries: int
+    ):
+        """Store description of user's photo and evict least recently used entries above max_entries."""
+        now = datetime.utcnow()
+        await session.execute(delete(FaceDescription).where(FaceDescription.sha256 == sha256))
+        session.add(FaceDescription(
+            sha256=sha256,
+            phash=phash,
+            user_id=user_id,
+            description=description,
+            created_at=now,
+            last_used_at=now
+        ))
+        await session.flush()
+
+        stale_ids = (
+            select(FaceDescription.id)
+            .order_by(FaceDescription.last_used_at.desc())
+            .offset(max_entries)
+            .scalar_subquery()
+        )
+        await session.execute(
+            delete(FaceDescription).where(FaceDescription.id.in_(stale_ids))
+        )
+        await _commit(session)
+
+    @staticmethod
+    async def delete_expired(session: AsyncSession, ttl: timedelta) -> int:
+        """Delete entries older than ttl."""
+        result = await session.execute(
+            delete(FaceDescription).where(FaceDescription.created_at < datetime.utcnow() - ttl)
+        )
+        await _commit(session)
+        return result.rowcount
+
+
+class TelegramFileCRUD:
+    """CRUD operations for cached Telegram file_ids of local files."""
+
+    @staticmethod
+    async def get(session: AsyncSession, path: str, mtime_ns: int) -> Optional[str]:
+        """Get file_id uploaded for this version of the file."""
+        result = await session.execute(
+            select(TelegramFile.file_id).where(
+                TelegramFile.path == path,
+                TelegramFile.mtime_ns == mtime_ns
+            )
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def put(session: AsyncSession, path: str, mtime_ns: int, file_id: str):
+        """Store file_id for file version (replaces older versions)."""
+        await session.execute(delete(TelegramFile).where(TelegramFile.path == path))
+        session.add(TelegramFile(path=path, mtime_ns=mtime_ns, file_id=file_id))
+        await _commit(session)
+
+    @staticmethod
+    async def delete(session: AsyncSession, path: str):
+        """Forget file_id of file."""
+        await session.execute(delete(TelegramFile).where(TelegramFile.path == path))
+        await _commit(session)
+
+
+class BroadcastCRUD:
+    """CRUD operations for broadcast campaigns and their delivery ledger."""
+
+    @staticmethod
+    async def create_campaign(
+        session: AsyncSession,
+        admin_id: int,
+        from_chat_id: int,
+        message_id: int,
+        user_ids: Iterable[int]
+    ) -> BroadcastCampaign:
+        """Create running campaign with a pending delivery row per recipient."""
+        user_ids = list(dict.fromkeys(user_ids))
+        campaign = BroadcastCampaign(
+            admin_id=admin_id,
+            from_chat_id=from_chat_id,
+            message_id=message_id,
+            total=len(user_ids),
+            status="running"
+        )
+        session.add(campaign)
+        await session.flush()
+
+        now = datetime.utcnow()
+        for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+            await session.execute(
+                insert(BroadcastDelivery),
+                [
+                    {"campaign_id": campaign.id, "user_id": user_id, "status": "pending", "updated_at": now}
+                    for user_id in user_ids[start:start + BULK_BATCH_SIZE]
+                ]
+            )
+        await _commit(session)
+        return campaign
+
+    @staticmethod
+    async def get_campaign(session: AsyncSession, campaign_id: int) -> Optional[BroadcastCampaign]:
+        """Get campaign by ID."""
+        result = await session.execute(
+            select(BroadcastCampaign).where(BroadcastCampaign.id == campaign_id)
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def get_unfinished(session: AsyncSession) -> List[BroadcastCampaign]:
+        """Get campaigns that did not finish (interrupted by a restart or crash)."""
+        result = await session.execute(
+            select(BroadcastCampaign)
+            .where(BroadcastCampaign.status == "running")
+            .order_by(BroadcastCampaign.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def set_status_message(session: AsyncSession, campaign_id: int, chat_id: int, message_id: int):
+        """Remember message that shows campaign progress."""
+        await session.execute(
+            update(BroadcastCampaign).where(BroadcastCampaign.id == campaign_id).values(
+                status_chat_id=chat_id, status_message_id=message_id
+            )
+        )
+        await _commit(session)
+
+    @staticmethod
+    async def mark_done(session: AsyncSession, campaign_id: int):
+        """Mark campaign as finished."""
+        await session.execute(
+            update(BroadcastCampaign).where(BroadcastCampaign.id == campaign_id).values(
+                status="done", finished_at=datetime.utcnow()
+            )
+        )
+        await _commit(session)
+
+    @staticmethod
+    async def get_user_ids(session: AsyncSession, campaign_id: int, statuses: Iterable[str]) -> List[int]:
+        """Get recipients of campaign whose delivery has one of the statuses."""
+        result = await session.execute(
+            select(BroadcastDelivery.user_id)
+            .where(
+                BroadcastDelivery.campaign_id == campaign_id,
+                BroadcastDelivery.status.in_(tuple(statuses))
+            )
+            .order_by(BroadcastDelivery.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def record_deliveries(session: AsyncSession, campaign_id: int, outcomes: Iterable[Tuple[int, str]]):
+        """
+        Store delivery outcomes in bulk.
+
+        Issues one UPDATE per status (and batch) instead of one per recipient.
+        """
+        by_status: Dict[str, List[int]] = {}
+        for user_id, status in outcomes:
+            by_status.setdefault(status, []).append(user_id)
+
+        now = datetime.utcnow()
+        for status, user_ids in by_status.items():
+            for start in range(0, len(user_ids), BULK_BATCH_SIZE):
+                await session.execute(
+                    update(BroadcastDelivery)
+                    .where(
+                        BroadcastDelivery.campaign_id == campaign_id,
+                        BroadcastDelivery.user_id.in_(user_ids[start:start + BULK_BATCH_SIZE])
+                    )
+                    .values(status=status, updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+        await _commit(session)
+
+    @staticmethod
+    async def get_counts(session: AsyncSession, campaign_id: int) -> Dict[str, int]:
+        """Get number of recipients per delivery status."""
+        result = await session.execute(
+            select(BroadcastDelivery.status, func.count())
+            .where(BroadcastDelivery.campaign_id == campaign_id)
+            .group_by(BroadcastDelivery.status)
+        )
+        return {status: count for status, count in result.all()}
+
+
+class ScheduledBroadcastCRUD:
+    """CRUD operations for scheduled broadcasts."""
+
+    @staticmethod
+    async def create(
+        session: AsyncSession,
+        admin_id: int,
+        from_chat_id: int,
+        message_id: int,
+        audience: str,
+        run_at: datetime,
+        user_ids: list | None = None
+    ) -> ScheduledBroadcast:
+        """Schedule broadcast."""
+        job = ScheduledBroadcast(
+            admin_id=admin_id,
+            from_chat_id=from_chat_id,
+            message_id=message_id,
+            audience=audience,
+            user_ids=user_ids,
+            run_at=run_at,
+            status="scheduled"
+        )
+        session.add(job)
+        await _commit(session)
+        return job
+
+    @staticmethod
+    async def get_scheduled(session: AsyncSession) -> List[ScheduledBroadcast]:
+        """Get broadcasts waiting for their time, nearest first."""
+        result = await session.execute(
+            select(ScheduledBroadcast)
+            .where(ScheduledBroadcast.status == "scheduled")
+            .order_by(ScheduledBroadcast.run_at)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def get_next_run_at(session: AsyncSession) -> Optional[datetime]:
+        """Get time of the nearest scheduled broadcast."""
+        result = await session.execute(
+            select(func.min(ScheduledBroadcast.run_at)).where(ScheduledBroadcast.status == "scheduled")
+        )
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def claim_due(session: AsyncSession, now: datetime) -> List[ScheduledBroadcast]:
+        """Atomically mark broadcasts due by now as started and return them."""
+        result = await session.execute(
+            update(ScheduledBroadcast)
+            .where(ScheduledBroadcast.status == "scheduled", ScheduledBroadcast.run_at <= now)
+            .values(status="started")
+            .returning(ScheduledBroadcast)
+            .execution_options(synchronize_session=False)
+        )
+        jobs = sorted(result.scalars().all(), key=lambda job: job.run_at)
+        await _commit(session)
+        return jobs
+
+    @staticmethod
+    async def set_campaign(session: AsyncSession, job_id: int, campaign_id: int):
+        """Link started broadcast to the campaign that sends it."""
+        await session.execute(
+            update(ScheduledBroadcast).where(ScheduledBroadcast.id == job_id).values(campaign_id=campaign_id)
+        )
+        await _commit(session)
+
+    @staticmethod
+    async def mark_failed(session: AsyncSession, job_id: int):
+        """Mark claimed broadcast whose campaign could not be created, so it is not claimed again."""
+        await session.execute(
+            update(ScheduledBroadcast)
+            .where(
+                ScheduledBroadcast.id == job_id,
+                ScheduledBroadcast.status == "started",
+                ScheduledBroadcast.campaign_id.is_(None)
+            )
+            .values(status="failed")
+        )
+        await _commit(session)
+
+    @staticmethod
+    async def requeue_unstarted(session: AsyncSession) -> int:
+        """
+        Return broadcasts claimed before a restart but without a campaign to the schedule.
+
+        Broadcasts that got a campaign are resumed as campaigns instead.
+        """
+        result = await session.execute(
+            update(ScheduledBroadcast)
+            .where(ScheduledBroadcast.status == "started", ScheduledBroadcast.campaign_id.is_(None))
+            .values(status="scheduled")
+        )
+        await _commit(session)
+        return result.rowcount
+
+    @staticmethod
+    async def cancel(session: AsyncSession, job_id: int) -> bool:
+        """Cancel broadcast that has not started yet."""
+        result = await session.execute(
+            update(ScheduledBroadcast)
+            .where(ScheduledBroadcast.id == job_id, ScheduledBroadcast.status == "scheduled")
+            .values(status="cancelled")
+        )
+        await _commit(session)
+        return result.rowcount > 0
+
+
+class IdAllocatorCRUD:
+    """CRUD operations for persisted ID allocator counters."""
+
+    @staticmethod
+    async def next_value(session: AsyncSession, name: str, count: int = 1) -> Tuple[int, str]:
+        """
+        Atomically take the next count counter values (0-based) of allocator.
+
+        Creates the allocator with a random key on first use. One statement,
+        committed right away (outside a unit of work).
+
+        Returns:
+            (first counter value taken, hex key)
+        """
+        statement = upsert(session, IdAllocator).values(name=name, counter=count, key=secrets.token_hex(32))
+        result = await session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[IdAllocator.name],
+                set_={"counter": IdAllocator.counter + count}
+            ).returning(IdAllocator.counter, IdAllocator.key)
+        )
+        counter, key = result.one()
+        await _commit(session)
+        return counter - count, key
+
+
+class StatsCRUD:
+    """
+    Statistics counters in stat_counters.
+
+    UserCRUD writes bump them in the same transaction as the change they
+    count, so reading statistics never scans users. rebuild() recomputes
+    them from the users table.
+    """
+
+    @staticmethod
+    async def bump(session: AsyncSession, deltas: Dict[str, int], day: Optional[date] = None):
+        """
+        Add deltas to all-time totals and to the counters of day (today, UTC).
+
+        One statement; does not commit (runs inside the caller's transaction).
+        """
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        day = (day or datetime.utcnow().date()).isoformat()
+        statement = upsert(session, StatCounter).values([
+            {"name": name, "day": counter_day, "value": delta}
+            for name, delta in deltas.items()
+            for counter_day in ("", day)
+        ])
+        await session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[StatCounter.name, StatCounter.day],
+                set_={"value": StatCounter.value + statement.excluded.value}
+            )
+        )
+
+    @staticmethod
+    async def get_totals(session: AsyncSession) -> Dict[str, int]:
+        """Get all-time totals by counter name."""
+        result = await session.execute(
+            select(StatCounter.name, StatCounter.value).where(StatCounter.day == "")
+        )
+        return {name: value for name, value in result.all()}
+
+    @staticmethod
+    async def get_daily(session: AsyncSession, days: int) -> Dict[str, Dict[str, int]]:
+        """
+        Get per-day counters for the last days days (UTC), newest first.
+
+        Returns:
+            {"YYYY-MM-DD": {counter name: net change that day}}; days without changes are absent
+        """
+        since = (datetime.utcnow().date() - timedelta(days=days - 1)).isoformat()
+        result = await session.execute(
+            select(StatCounter.day, StatCounter.name, StatCounter.value)
+            .where(StatCounter.day >= since)
+            .order_by(StatCounter.day.desc())
+        )
+        daily: Dict[str, Dict[str, int]] = {}
+        for day, name, value in result.all():
+            daily.setdefault(day, {})[name] = value
+        return daily
+
+    @staticmethod
+    async def has_counters(session: AsyncSession) -> bool:
+        """Check if counters were built (rebuild() always writes the registrations total)."""
+        result = await session.execute(
+            select(StatCounter.value).where(StatCounter.name == STAT_REGISTRATIONS, StatCounter.day == "")
+        )
+        return result.scalar_one_or_none() is not None
+
+    @staticmethod
+    async def rebuild(session: AsyncSession) -> Dict[str, int]:
+        """
+        Recompute counters from the users table in one transaction.
+
+        Totals are rebuilt from scratch, daily registrations from created_at.
+        Other daily counters have no timestamp to rebuild from and are kept.
+
+        Returns:
+            New all-time totals
+        """
+        # Delete first: the write transaction starts before users are counted,
+        # so no concurrent bump lands between counting and writing
+        await session.execute(
+            delete(StatCounter).where(or_(StatCounter.day == "", StatCounter.name == STAT_REGISTRATIONS))
+        )
+        row = (await session.execute(
+            select(
+                func.count(),
+                func.count(case((User.quiz_completed == True, 1))),
+                func.count(case((User.photo_uploaded == True, 1))),
+                func.count(case((User.is_winner == True, 1))),
+                func.count(User.referrer_id),
+            ).select_from(User)
+        )).one()
+        totals = dict(zip(
+            (STAT_REGISTRATIONS, STAT_QUIZ_COMPLETED, STAT_PHOTOS, STAT_WINNERS, STAT_REFERRALS), row
+        ))
+        genders = await session.execute(
+            select(User.gender, func.count()).where(User.gender.is_not(None)).group_by(User.gender)
+        )
+        totals.update({f"gender_{gender}": count for gender, count in genders.all()})
+        registration_day = func.date(User.created_at)
+        registrations = await session.execute(
+            select(registration_day, func.count())
+            .where(User.created_at.is_not(None))
+            .group_by(registration_day)
+        )
+
+        rows = [{"name": name, "day": "", "value": value} for name, value in totals.items()]
+        rows += [
+            {"name": STAT_REGISTRATIONS, "day": str(day), "value": count}
+            for day, count in registrations.all()
+        ]
+        for start in range(0, len(rows), BULK_BATCH_SIZE):
+            await session.execute(insert(StatCounter), rows[start:start + BULK_BATCH_SIZE])
+        await _commit(session)
+        return totals
+
+
+class RaffleCRUD:
+    """CRUD operations for raffle draws."""
+
+    @staticmethod
+    async def has_winners(session: AsyncSession) -> bool:
+        """Check if any user is marked as winner."""
+        result = await session.execute(select(User.id).where(User.is_winner == True).limit(1))
+        return result.first() is not None
+
+    @staticmethod
+    async def get_participant_ids(session: AsyncSession) -> List[int]:
+        """Get IDs of all users who completed quiz, ascending (index-only scan)."""
+        # Core execution on the session's connection: ORM result handling
+        # costs several times more than the query for 100k plain IDs
+        connection = await session.connection()
+        result = await connection.execute(
+            select(User.id).where(User.quiz_completed == True).order_by(User.id)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    async def record_draw(
+        session: AsyncSession,
+        admin_id: int,
+        seed: str,
+        participants_hash: str,
+        participants_count: int,
+        winner_ids: List[int]
+    ) -> RaffleDraw:
+        """
+        Mark winners and store the draw in one transaction.
+
+        Winners are marked with one UPDATE per BULK_BATCH_SIZE IDs (one for
+        any realistic prize count); the winners counter moves with them.
+        """
+        marked = 0
+        for start in range(0, len(winner_ids), BULK_BATCH_SIZE):
+            result = await session.execute(
+                update(User)
+                .where(User.id.in_(winner_ids[start:start + BULK_BATCH_SIZE]), User.is_winner.is_not(True))
+                .values(is_winner=True)
+                .execution_options(synchronize_session=False)
+            )
+            marked += result.rowcount
+        await StatsCRUD.bump(session, {STAT_WINNERS: marked})
+
+        draw = RaffleDraw(
+            admin_id=admin_id,
+            seed=seed,
+            participants_hash=participants_hash,
+            participants_count=participants_count,
+            winner_ids=winner_ids
+        )
+        session.add(draw)
+        _users_written(session, winner_ids)
+        await _commit(session)
+        return draw
+
+    @staticmethod
+    async def get_last_draw(session: AsyncSession) -> Optional[RaffleDraw]:
+        """Get the latest raffle draw."""
+        result = await session.execute(select(RaffleDraw).order_by(RaffleDraw.id.desc()).limit(1))
+        return result.scalar_one_or_none()
+
+
+class FsmCRUD:
+    """CRUD operations for persisted FSM states (see services.fsm_storage)."""
+
+    @staticmethod
+    async def get(session: AsyncSession, key: str) -> Optional[FsmRecord]:
+        """Get record of storage key."""
+        result = await session.execute(select(FsmRecord).where(FsmRecord.key == key))
+        return result.scalar_one_or_none()
+
+    @staticmethod
+    async def put(session: AsyncSession, key: str, state: Optional[str], data: Optional[bytes], updated_at: datetime):
+        """
+        Store state and encoded data of key.
+
+        A key with neither state nor data is deleted instead, so finished
+        conversations leave no rows behind.
+        """
+        if state is None and data is None:
+            await session.execute(delete(FsmRecord).where(FsmRecord.key == key))
+        else:
+            statement = upsert(session, FsmRecord).values(key=key, state=state, data=data, updated_at=updated_at)
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[FsmRecord.key],
+                set_={"state": statement.excluded.state, "data": statement.excluded.data, "updated_at": updated_at}
+            ))
+        await _commit(session)
+
+    @staticmethod
+    async def put_many(session: AsyncSession, records: Dict[str, Tuple[Optional[str], Optional[bytes], datetime]]):
+        """
+        Store several keys at once (key -> (state, data, updated_at)), as put does.
+
+        Keys are upserted with multi-row statements of BULK_BATCH_SIZE rows
+        and committed together.
+        """
+        empty = [key for key, (state, data, _) in records.items() if state is None and data is None]
+        rows = [
+            {"key": key, "state": state, "data": data, "updated_at": updated_at}
+            for key, (state, data, updated_at) in records.items()
+            if state is not None or data is not None
+        ]
+        for offset in range(0, len(empty), BULK_BATCH_SIZE):
+            await session.execute(delete(FsmRecord).where(FsmRecord.key.in_(empty[offset:offset + BULK_BATCH_SIZE])))
+        for offset in range(0, len(rows), BULK_BATCH_SIZE):
+            statement = upsert(session, FsmRecord).values(rows[offset:offset + BULK_BATCH_SIZE])
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[FsmRecord.key],
+                set_={
+                    "state": statement.excluded.state,
+                    "data": statement.excluded.data,
+                    "updated_at": statement.excluded.updated_at
+                }
+            ))
+        await _commit(session)
+
+    @staticmethod
+    async def delete_idle(session: AsyncSession, cutoff: datetime) -> int:
+        """Delete records not written since cutoff."""
+        result = await session.execute(delete(FsmRecord).where(FsmRecord.updated_at < cutoff))
+        await _commit(session)
+        return result.rowcount
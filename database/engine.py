@@ -1,27 +1,344 @@
 """Database engine configuration."""
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Iterator, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from config import settings
 from database.models import Base
+from database.migrations import run_migrations
+
+
+def apply_sqlite_profile(dbapi_connection, connection_record):
+    """Apply performance pragmas from settings to a new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA cache_size={-int(settings.SQLITE_CACHE_SIZE_KB)}")  # Negative = KiB
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cursor.execute(f"PRAGMA temp_store={settings.SQLITE_TEMP_STORE}")
+    cursor.close()
+
+
+# session.info key: CRUD helpers flush instead of committing (see unit_of_work)
+UNIT_OF_WORK = "unit_of_work"
+
+# session.info keys: callbacks waiting for the transaction to commit / roll back (see after_commit)
+_AFTER_COMMIT = "after_commit"
+_AFTER_ROLLBACK = "after_rollback"
+
+
+class QueryCounter:
+    """Number of SQL statements executed while counting (see counting_queries)."""
+
+    def __init__(self, parent: "QueryCounter" = None):
+        """Initialize counter (statements are also added to parent)."""
+        self.count = 0
+        self.parent = parent
+
+
+_query_counter: ContextVar[Optional[QueryCounter]] = ContextVar("query_counter", default=None)
+
+
+@contextmanager
+def counting_queries() -> Iterator[QueryCounter]:
+    """
+    Count statements executed by the current task (and tasks it starts).
+
+    Every session counts, including those opened by services, so the
+    result is what a piece of work really cost the database. Counting can
+    be nested; outer counters include the inner ones.
+    """
+    counter = QueryCounter(_query_counter.get())
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    """Engine before_cursor_execute hook for counting_queries."""
+    counter = _query_counter.get()
+    while counter is not None:
+        counter.count += 1
+        counter = counter.parent
+
+
+def build_engine(url: str = None, tuned: bool = None) -> AsyncEngine:
+    """
+    Create async engine.
+
+    Args:
+        url: Database URL (defaults to settings.DATABASE_URL)
+        tuned: Apply SQLite performance profile (defaults to settings.SQLITE_TUNED)
+
+    The tuned profile also pools connections to a database file. SQLAlchemy
+    opens a new aiosqlite connection (and thread) per session otherwise,
+    and every one of them would run the profile's pragmas again. Overflow
+    is not capped: a task holding a connection may wait for the write lock
+    while the lock holder waits for a connection.
+    """
+    url = url or settings.DATABASE_URL
+    tuned = settings.SQLITE_TUNED if tuned is None else tuned
+
+    options = {}
+    if tuned and url.startswith("sqlite") and ":memory:" not in url:
+        options = {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": settings.SQLITE_POOL_SIZE,
+            "max_overflow": -1,
+        }
+    new_engine = create_async_engine(url, echo=False, **options)
+    event.listen(new_engine.sync_engine, "before_cursor_execute", count_query)
+    if tuned and new_engine.dialect.name == "sqlite":
+        event.listen(new_engine.sync_engine, "connect", apply_sqlite_profile)
+    return new_engine
+
+
+class WriteLockTimeout(TimeoutError):
+    """Write lock not acquired within SQLITE_WRITE_LOCK_TIMEOUT."""
+
+
+class WriteLock:
+    """
+    Process-wide write lock owned by a task and reentrant within it.
+
+    Sessions of the task that holds it (e.g. a service writing through its
+    own session while the update's unit of work is open) get it again at
+    once instead of waiting for themselves; it is released when the last
+    of them finishes. Other tasks wait at most timeout seconds, so a
+    writer that never finishes produces errors, not a hung process.
+    """
+
+    def __init__(self, timeout: float = None):
+        """Initialize lock."""
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+        self._owner: Optional[asyncio.Task] = None
+        self._depth = 0
+
+    async def acquire(self) -> None:
+        """Take the lock (again, if the current task holds it)."""
+        task = asyncio.current_task()
+        if task is not None and self._owner is task:
+            self._depth += 1
+            return
+        timeout = settings.SQLITE_WRITE_LOCK_TIMEOUT if self.timeout is None else self.timeout
+        try:
+            await asyncio.wait_for(self._lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise WriteLockTimeout(f"Database write lock not acquired in {timeout:g} s") from None
+        self._owner = task
+        self._depth = 1
+
+    def release(self) -> None:
+        """Release one hold of the lock."""
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            self._lock.release()
+
+
+# Process-wide lock held by the task that is writing
+_write_lock = WriteLock()
+
+
+class SerializedWriteSession(AsyncSession):
+    """
+    AsyncSession that lets only one write transaction run at a time.
+
+    SQLite has a single writer anyway; queuing writers here instead of in
+    SQLite avoids "database is locked" errors and WAL snapshot conflicts.
+    The lock is taken before the first INSERT/UPDATE/DELETE (or flush of
+    pending objects) and released on commit, rollback or close. Plain
+    SELECTs never wait for it, so reads stay concurrent.
+
+    The lock belongs to the task, not the session (see WriteLock), so a
+    second session writing in the same task cannot deadlock on it. SQLite
+    still lets only one connection write: such a session waits at most
+    SQLITE_BUSY_TIMEOUT_MS for the first one and fails instead of hanging,
+    which is why services join the task's unit of work (see session_scope).
+    """
+
+    _holds_write_lock = False
+
+    def _has_pending_changes(self) -> bool:
+        """Check if the next flush will write to the database."""
+        return bool(self.new or self.deleted or self.dirty)
+
+    async def _acquire_write_lock(self) -> None:
+        """Wait for the write lock (once per transaction)."""
+        if not self._holds_write_lock:
+            await _write_lock.acquire()
+            self._holds_write_lock = True
+
+    def _release_write_lock(self) -> None:
+        """Let the next writer in."""
+        if self._holds_write_lock:
+            self._holds_write_lock = False
+            _write_lock.release()
+
+    async def execute(self, statement, *args, **kwargs):
+        """Execute statement, taking the write lock for DML and autoflush."""
+        if getattr(statement, "is_dml", False) or self._has_pending_changes():
+            await self._acquire_write_lock()
+        return await super().execute(statement, *args, **kwargs)
+
+    async def flush(self, objects=None) -> None:
+        """Flush pending objects under the write lock."""
+        if self._has_pending_changes():
+            await self._acquire_write_lock()
+        await super().flush(objects)
+
+    async def commit(self) -> None:
+        """Commit and release the write lock."""
+        if self._has_pending_changes():
+            await self._acquire_write_lock()
+        try:
+            await super().commit()
+        finally:
+            self._release_write_lock()
+
+    async def rollback(self) -> None:
+        """Roll back and release the write lock."""
+        try:
+            await super().rollback()
+        finally:
+            self._release_write_lock()
+
+    async def close(self) -> None:
+        """Close session and release the write lock."""
+        try:
+            await super().close()
+        finally:
+            self._release_write_lock()
+
+
+def build_session_maker(bind: AsyncEngine, serialize_writes: bool = None) -> async_sessionmaker:
+    """
+    Create session factory for engine.
+
+    Args:
+        bind: Engine
+        serialize_writes: Use SerializedWriteSession for SQLite
+            (defaults to settings.SQLITE_SERIALIZE_WRITES)
+    """
+    serialize_writes = settings.SQLITE_SERIALIZE_WRITES if serialize_writes is None else serialize_writes
+    serialize_writes = serialize_writes and bind.dialect.name == "sqlite"
+    return async_sessionmaker(
+        bind,
+        class_=SerializedWriteSession if serialize_writes else AsyncSession,
+        expire_on_commit=False,
+    )
 
 
 # Create async engine
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=False,
-)
+engine = build_engine()
 
 # Create session maker
-async_session_maker = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
+async_session_maker = build_session_maker(engine)
 
 
 async def init_db():
-    """Initialize database tables."""
+    """Initialize database tables and apply pending migrations."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
+
+
+# (task, session) of the unit of work the current task runs in
+_current_unit_of_work: ContextVar[Optional[Tuple[asyncio.Task, AsyncSession]]] = ContextVar(
+    "current_unit_of_work", default=None
+)
+
+
+def current_unit_of_work() -> Optional[AsyncSession]:
+    """Session of the unit of work open in the current task, if any."""
+    current = _current_unit_of_work.get()
+    # Tasks started inside a unit of work inherit the context, not the session
+    if current is not None and current[0] is asyncio.current_task():
+        return current[1]
+    return None
+
+
+@asynccontextmanager
+async def unit_of_work(session_maker: async_sessionmaker = None) -> AsyncIterator[AsyncSession]:
+    """
+    Session whose CRUD writes are committed together on exit.
+
+    CRUD helpers only flush in this session; it is committed once when the
+    block ends and rolled back if it raises, so a failed update leaves
+    nothing behind. Services called in the same task write through it too
+    (see session_scope). Writes hold the SQLite write lock until the block
+    ends: handlers write after their slow Telegram requests where they can,
+    and work that must wait for the commit goes through after_commit().
+    """
+    async with (session_maker or async_session_maker)() as session:
+        session.info[UNIT_OF_WORK] = True
+        token = _current_unit_of_work.set((asyncio.current_task(), session))
+        try:
+            yield session
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            _current_unit_of_work.reset(token)
+        await session.commit()
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], None], on_rollback: Callable[[], None] = None) -> None:
+    """
+    Call callback once the writes made so far in session are committed.
+
+    Inside a unit of work that is when the unit of work commits, and
+    on_rollback is called instead if it rolls back. Elsewhere CRUD helpers
+    have committed already, so callback runs right away.
+    """
+    if not session.info.get(UNIT_OF_WORK):
+        callback()
+        return
+    session.info.setdefault(_AFTER_COMMIT, []).append(callback)
+    if on_rollback is not None:
+        session.info.setdefault(_AFTER_ROLLBACK, []).append(on_rollback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session: Session):
+    """Run callbacks waiting for the committed transaction."""
+    session.info.pop(_AFTER_ROLLBACK, None)
+    for callback in session.info.pop(_AFTER_COMMIT, []):
+        callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _run_after_rollback(session: Session):
+    """Run rollback callbacks of the rolled back transaction."""
+    session.info.pop(_AFTER_COMMIT, None)
+    for callback in session.info.pop(_AFTER_ROLLBACK, []):
+        callback()
+
+
+@asynccontextmanager
+async def session_scope(session_maker: async_sessionmaker = None) -> AsyncIterator[AsyncSession]:
+    """
+    Session for a service: the current task's unit of work, or a new one.
+
+    Joining the unit of work keeps a task to one writing connection (a
+    second one would wait for the first under SQLite) and makes the
+    service's writes commit or roll back with the update's.
+    """
+    session = current_unit_of_work()
+    if session is not None:
+        yield session
+        return
+    async with (session_maker or async_session_maker)() as session:
+        yield session
 
 
 async def get_session() -> AsyncSession:
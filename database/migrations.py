@@ -0,0 +1,208 @@
+"""
+Versioned schema migrations for the SQLite database.
+
+Replaces the old ad hoc migrate_add_*.py scripts. init_db() runs pending
+migrations on every start after create_all(); they can also be applied by
+hand with:
+
+    python -m database.migrations
+
+Every migration is idempotent: databases that already ran some of the old
+scripts (or were created by create_all with the current models) only get
+what they are missing. Applied versions are recorded in schema_migrations.
+"""
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, List, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+
+async def _columns(conn: AsyncConnection, table: str) -> Set[str]:
+    """Get column names of table."""
+    result = await conn.execute(text(f"PRAGMA table_info({table})"))
+    return {row[1] for row in result.fetchall()}
+
+
+async def _add_column(conn: AsyncConnection, table: str, column: str, ddl: str) -> None:
+    """Add column unless it exists."""
+    if column not in await _columns(conn, table):
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        logger.info(f"Added column {table}.{column}")
+
+
+async def _has_unique_index(conn: AsyncConnection, table: str, column: str) -> bool:
+    """Check if a single-column unique index (or UNIQUE constraint) covers column."""
+    result = await conn.execute(text(f"PRAGMA index_list({table})"))
+    for row in result.fetchall():
+        name, unique = row[1], row[2]
+        if not unique:
+            continue
+        info = await conn.execute(text(f"PRAGMA index_info('{name}')"))
+        if [col[2] for col in info.fetchall()] == [column]:
+            return True
+    return False
+
+
+async def add_pride_gift_id(conn: AsyncConnection) -> None:
+    """users.pride_gift_id: unique 5-digit ID, assigned to existing users."""
+    await _add_column(conn, "users", "pride_gift_id", "INTEGER")
+
+    result = await conn.execute(text("SELECT pride_gift_id FROM users WHERE pride_gift_id IS NOT NULL"))
+    used_ids = {row[0] for row in result.fetchall()}
+    result = await conn.execute(text("SELECT id FROM users WHERE pride_gift_id IS NULL"))
+    for (user_id,) in result.fetchall():
+        pride_id = random.randint(10000, 99999)
+        while pride_id in used_ids:
+            pride_id = random.randint(10000, 99999)
+        used_ids.add(pride_id)
+        await conn.execute(
+            text("UPDATE users SET pride_gift_id = :pride_id WHERE id = :user_id"),
+            {"pride_id": pride_id, "user_id": user_id}
+        )
+
+    if not await _has_unique_index(conn, "users", "pride_gift_id"):
+        await conn.execute(text("CREATE UNIQUE INDEX idx_pride_gift_id ON users(pride_gift_id)"))
+
+
+async def add_forum_topic_id(conn: AsyncConnection) -> None:
+    """users.forum_topic_id: forum topic of the user."""
+    await _add_column(conn, "users", "forum_topic_id", "INTEGER")
+
+
+async def add_referrer_id(conn: AsyncConnection) -> None:
+    """users.referrer_id: who invited the user."""
+    await _add_column(conn, "users", "referrer_id", "BIGINT NULL")
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_referrer_id ON users(referrer_id)"))
+
+
+async def add_user_messages(conn: AsyncConnection) -> None:
+    """user_messages table for forum communication."""
+    await conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id BIGINT NOT NULL,
+            forum_message_id INTEGER NOT NULL,
+            user_message_id INTEGER,
+            direction VARCHAR(20) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    # The old script named this index idx_user_messages_user_id
+    await conn.execute(text("DROP INDEX IF EXISTS idx_user_messages_user_id"))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_user_messages_user_id ON user_messages(user_id)"))
+
+
+async def add_is_reachable(conn: AsyncConnection) -> None:
+    """users.is_reachable with indexes for broadcast audience filters."""
+    await _add_column(conn, "users", "is_reachable", "BOOLEAN NOT NULL DEFAULT 1")
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_reachable_gender ON users(is_reachable, gender, id)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_reachable_quiz ON users(is_reachable, quiz_completed, id)"
+    ))
+
+
+async def add_hot_path_indexes(conn: AsyncConnection) -> None:
+    """
+    Indexes for per-message lookups, and one answer per quiz question.
+
+    Duplicate answers (possible before the constraint) are collapsed to the
+    newest one before the unique index is created.
+    """
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_forum_topic_id ON users(forum_topic_id)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_user_messages_forum_message_id ON user_messages(forum_message_id)"
+    ))
+    await conn.execute(text("""
+        DELETE FROM quiz_answers
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM quiz_answers GROUP BY user_id, question_number
+        )
+    """))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_quiz_answers_user_question "
+        "ON quiz_answers(user_id, question_number)"
+    ))
+
+
+async def add_reachable_id_index(conn: AsyncConnection) -> None:
+    """Index of reachable users in ID order, for keyset pagination of the 'all' list."""
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_reachable_id ON users(is_reachable, id)"))
+
+
+async def add_raffle_participants_index(conn: AsyncConnection) -> None:
+    """Covering index of participant IDs for raffle draws."""
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_quiz_completed_id ON users(quiz_completed, id)"
+    ))
+
+
+async def add_face_description_owner(conn: AsyncConnection) -> None:
+    """face_descriptions.user_id: perceptual hash matches only count for the same user."""
+    await _add_column(conn, "face_descriptions", "user_id", "BIGINT NULL")
+
+
+# (version, migration) in the order they must run; never renumber applied versions
+MIGRATIONS: List[Tuple[int, Callable[[AsyncConnection], Awaitable[None]]]] = [
+    (1, add_pride_gift_id),
+    (2, add_forum_topic_id),
+    (3, add_referrer_id),
+    (4, add_user_messages),
+    (5, add_is_reachable),
+    (6, add_hot_path_indexes),
+    (7, add_reachable_id_index),
+    (8, add_raffle_participants_index),
+    (9, add_face_description_owner),
+]
+
+
+async def run_migrations(engine: AsyncEngine) -> List[int]:
+    """
+    Apply migrations that are not recorded in schema_migrations yet.
+
+    Each migration runs in its own transaction together with its record.
+
+    Returns:
+        Versions applied now
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        result = await conn.execute(text("SELECT version FROM schema_migrations"))
+        done = {row[0] for row in result.fetchall()}
+
+    applied = []
+    for version, migration in MIGRATIONS:
+        if version in done:
+            continue
+        async with engine.begin() as conn:
+            await migration(conn)
+            await conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {"version": version, "name": migration.__name__}
+            )
+        applied.append(version)
+        logger.info(f"Applied migration {version}: {migration.__name__}")
+
+    return applied
+
+
+if __name__ == "__main__":
+    from database.engine import init_db
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(init_db())
+    logger.info("🎉 Database schema is up to date")
@@ -1,6 +1,8 @@
 """Database models for the bot."""
 from datetime import datetime
-from sqlalchemy import BigInteger, String, Integer, DateTime, Boolean, Text, JSON
+from sqlalchemy import (
+    BigInteger, String, Integer, DateTime, Boolean, Text, JSON, LargeBinary, Index, UniqueConstraint, true
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -12,10 +14,20 @@ class Base(DeclarativeBase):
 class User(Base):
     """User model."""
     __tablename__ = "users"
+    __table_args__ = (
+        # Broadcast audience filters: reachable users by gender / quiz status,
+        # id last, so an audience can be read in ID order straight from the index
+        Index("ix_users_reachable_gender", "is_reachable", "gender", "id"),
+        Index("ix_users_reachable_quiz", "is_reachable", "quiz_completed", "id"),
+        # All reachable users in ID order (admin user list 'all')
+        Index("ix_users_reachable_id", "is_reachable", "id"),
+        # Raffle: IDs of all participants (reachable or not) without touching the table
+        Index("ix_users_quiz_completed_id", "quiz_completed", "id"),
+    )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     pride_gift_id: Mapped[int | None] = mapped_column(Integer, nullable=True, unique=True)  # Unique 5-digit ID
-    forum_topic_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # Forum topic ID for links
+    forum_topic_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)  # Forum topic ID for links
     username: Mapped[str | None] = mapped_column(String(255), nullable=True)
     full_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -24,6 +36,7 @@ class User(Base):
     gender: Mapped[str | None] = mapped_column(String(10), nullable=True)  # male, female
     is_winner: Mapped[bool] = mapped_column(Boolean, default=False)
     referrer_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True, index=True)  # ID пользователя, который пригласил
+    is_reachable: Mapped[bool] = mapped_column(Boolean, default=True, server_default=true())  # False: blocked the bot / deleted account
 
     def __repr__(self) -> str:
         return f"<User(id={self.id}, username={self.username})>"
@@ -32,6 +45,10 @@ class User(Base):
 class QuizAnswer(Base):
     """Quiz answers model."""
     __tablename__ = "quiz_answers"
+    __table_args__ = (
+        # One answer per question; lets add_answer upsert in one statement
+        Index("uq_quiz_answers_user_question", "user_id", "question_number", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
@@ -78,10 +95,172 @@ class UserMessage(Base):
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
-    forum_message_id: Mapped[int] = mapped_column(Integer, nullable=False)  # Message ID in forum
+    forum_message_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)  # Message ID in forum
     user_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # Message ID in private chat
     direction: Mapped[str] = mapped_column(String(20), nullable=False)  # 'to_user' or 'from_user'
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     def __repr__(self) -> str:
         return f"<UserMessage(user_id={self.user_id}, direction={self.direction})>"
+
+
+class GenerationJob(Base):
+    """Photo -> figurine generation job (survives bot restarts)."""
+    __tablename__ = "generation_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    file_path: Mapped[str] = mapped_column(String(500), nullable=False)
+    gender: Mapped[str] = mapped_column(String(10), nullable=False)
+    answers: Mapped[list] = mapped_column(JSON, nullable=False, default=list)  # Answer indices for prediction
+    has_premium: Mapped[bool] = mapped_column(Boolean, default=False)
+    processing_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # "Колдуем..." message
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending", index=True)  # pending, in_progress, done, failed
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<GenerationJob(id={self.id}, user_id={self.user_id}, status={self.status})>"
+
+
+class FaceDescription(Base):
+    """Cached Gemini face description keyed by uploaded photo hashes."""
+    __tablename__ = "face_descriptions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    sha256: Mapped[str] = mapped_column(String(64), nullable=False, unique=True)  # Exact bytes hash
+    phash: Mapped[str] = mapped_column(String(16), nullable=False, index=True)  # 64-bit perceptual hash (hex)
+    user_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)  # Whose photo was described
+    description: Mapped[str] = mapped_column(Text, nullable=False)
+    hits: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_used_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)  # For LRU eviction
+
+    def __repr__(self) -> str:
+        return f"<FaceDescription(phash={self.phash}, hits={self.hits})>"
+
+
+class TelegramFile(Base):
+    """Telegram file_id of a local file that was already uploaded once."""
+    __tablename__ = "telegram_files"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    path: Mapped[str] = mapped_column(String(500), nullable=False, unique=True)
+    mtime_ns: Mapped[int] = mapped_column(BigInteger, nullable=False)  # File version the file_id belongs to
+    file_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f"<TelegramFile(path={self.path})>"
+
+
+class BroadcastCampaign(Base):
+    """Admin broadcast (one message copied to many users)."""
+    __tablename__ = "broadcast_campaigns"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    admin_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    from_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)  # Chat of the message to copy
+    message_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    status_chat_id: Mapped[int | None] = mapped_column(BigInteger, nullable=True)  # Progress message
+    status_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="running", index=True)  # running, done
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<BroadcastCampaign(id={self.id}, status={self.status})>"
+
+
+class BroadcastDelivery(Base):
+    """Delivery status of a broadcast campaign for one recipient."""
+    __tablename__ = "broadcast_deliveries"
+    __table_args__ = (UniqueConstraint("campaign_id", "user_id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    campaign_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending")  # pending, sent, blocked, deactivated, failed, retry_after
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f"<BroadcastDelivery(campaign_id={self.campaign_id}, user_id={self.user_id}, status={self.status})>"
+
+
+class ScheduledBroadcast(Base):
+    """Broadcast to be sent at a given time (run_at in UTC)."""
+    __tablename__ = "scheduled_broadcasts"
+    __table_args__ = (Index("ix_scheduled_broadcasts_status_run_at", "status", "run_at"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    admin_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    from_chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)  # Chat of the message to copy
+    message_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    audience: Mapped[str] = mapped_column(String(20), nullable=False)  # Filter type of get_users_by_filter or 'personal'
+    user_ids: Mapped[list | None] = mapped_column(JSON, nullable=True)  # Fixed recipients ('personal'); filters resolve at send time
+    run_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="scheduled")  # scheduled, started, cancelled, failed
+    campaign_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # Campaign created when the job started
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f"<ScheduledBroadcast(id={self.id}, run_at={self.run_at}, status={self.status})>"
+
+
+class IdAllocator(Base):
+    """Persisted counter and secret key of a keyed ID permutation."""
+    __tablename__ = "id_allocators"
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    counter: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)  # IDs handed out so far
+    key: Mapped[str] = mapped_column(String(64), nullable=False)  # Hex permutation key (never change)
+
+    def __repr__(self) -> str:
+        return f"<IdAllocator(name={self.name}, counter={self.counter})>"
+
+
+class StatCounter(Base):
+    """Statistics counter: all-time total (day '') or net change on one day (UTC)."""
+    __tablename__ = "stat_counters"
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)  # registrations, quiz_completed, ...
+    day: Mapped[str] = mapped_column(String(10), primary_key=True, default="")  # YYYY-MM-DD or '' for total
+    value: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<StatCounter(name={self.name}, day={self.day}, value={self.value})>"
+
+
+class RaffleDraw(Base):
+    """Audit record of a raffle draw: enough to recompute the winners."""
+    __tablename__ = "raffle_draws"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    admin_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    seed: Mapped[str] = mapped_column(String(64), nullable=False)  # Hex seed of the ranking
+    participants_hash: Mapped[str] = mapped_column(String(64), nullable=False)  # SHA-256 of sorted participant IDs
+    participants_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    winner_ids: Mapped[list] = mapped_column(JSON, nullable=False)  # In draw order
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f"<RaffleDraw(id={self.id}, winners={len(self.winner_ids)})>"
+
+
+class FsmRecord(Base):
+    """FSM state and data of one chat/user (see services.fsm_storage)."""
+    __tablename__ = "fsm_records"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)  # fsm:<bot>:<chat>:<user>[:...]:<destiny>
+    state: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    data: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)  # Encoded dict, NULL if empty
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)  # Idle expiry
+
+    def __repr__(self) -> str:
+        return f"<FsmRecord(key={self.key}, state={self.state})>"
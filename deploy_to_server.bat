@@ -12,17 +12,32 @@ echo Деплой Pride34 Gift Bot на сервер
 echo ========================================
 echo.
 
-echo 1. Копирование обновленных файлов...
+echo 0. Проверка индексов (EXPLAIN QUERY PLAN)...
 echo.
 
-REM Копируем обновленные файлы
-scp handlers\photo.py %SERVER_USER%@%SERVER_HOST%:%SERVER_PATH%/handlers/
-scp main.py %SERVER_USER%@%SERVER_HOST%:%SERVER_PATH%/
+REM Горячие запросы должны идти через индексы, иначе не деплоим
+python check_query_plans.py
+if errorlevel 1 (
+    echo.
+    echo ✗ Запросы не используют индексы, деплой отменен
+    pause
+    exit /b 1
+)
 
-REM Копируем новые скрипты
-scp view_logs.py %SERVER_USER%@%SERVER_HOST%:%SERVER_PATH%/
-scp test_photo_handler.py %SERVER_USER%@%SERVER_HOST%:%SERVER_PATH%/
-scp check_bot_handlers.py %SERVER_USER%@%SERVER_HOST%:%SERVER_PATH%/
+echo.
+echo ✓ Планы запросов в порядке
+echo.
+
+echo 1. Копирование файлов бота...
+echo.
+
+REM Копируем пакеты целиком: новые модули (database\migrations.py, services\*,
+REM utils\*) иначе не попадут на сервер, и бот не запустится
+scp -r bot database handlers services utils %SERVER_USER%@%SERVER_HOST%:%SERVER_PATH%/
+scp main.py config.py requirements.txt %SERVER_USER%@%SERVER_HOST%:%SERVER_PATH%/
+
+REM Служебные скрипты
+scp view_logs.py check_bot_handlers.py check_query_plans.py check_users.py %SERVER_USER%@%SERVER_HOST%:%SERVER_PATH%/
 
 echo.
 echo ✓ Файлы скопированы
@@ -17,16 +17,26 @@ YELLOW='\033[1;33m'
 NC='\033[0m' # No Color
 
 echo ""
-echo -e "${YELLOW}1. Копирование обновленных файлов...${NC}"
+echo -e "${YELLOW}0. Проверка индексов (EXPLAIN QUERY PLAN)...${NC}"
 
-# Копируем только измененные файлы
-scp handlers/photo.py ${SERVER_USER}@${SERVER_HOST}:${SERVER_PATH}/handlers/
-scp main.py ${SERVER_USER}@${SERVER_HOST}:${SERVER_PATH}/
+# Горячие запросы должны идти через индексы, иначе не деплоим
+if ! python check_query_plans.py; then
+    echo -e "${RED}✗ Запросы не используют индексы, деплой отменен${NC}"
+    exit 1
+fi
+
+echo -e "${GREEN}✓ Планы запросов в порядке${NC}"
+
+echo ""
+echo -e "${YELLOW}1. Копирование файлов бота...${NC}"
+
+# Копируем пакеты целиком: новые модули (database/migrations.py, services/*,
+# utils/*) иначе не попадут на сервер, и бот не запустится
+scp -r bot database handlers services utils ${SERVER_USER}@${SERVER_HOST}:${SERVER_PATH}/
+scp main.py config.py requirements.txt ${SERVER_USER}@${SERVER_HOST}:${SERVER_PATH}/
 
-# Копируем новые скрипты
-scp view_logs.py ${SERVER_USER}@${SERVER_HOST}:${SERVER_PATH}/
-scp test_photo_handler.py ${SERVER_USER}@${SERVER_HOST}:${SERVER_PATH}/
-scp check_bot_handlers.py ${SERVER_USER}@${SERVER_HOST}:${SERVER_PATH}/
+# Служебные скрипты
+scp view_logs.py check_bot_handlers.py check_query_plans.py check_users.py ${SERVER_USER}@${SERVER_HOST}:${SERVER_PATH}/
 
 echo -e "${GREEN}✓ Файлы скопированы${NC}"
 
@@ -1,15 +1,11 @@
 """Admin panel handlers."""
 import logging
-import random
-import math
-import asyncio
 from datetime import datetime
-from aiogram import Router, F
-from aiogram.filters import Command
+from aiogram import Bot, Router, F
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
-import csv
-from io import StringIO
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards import (
     get_admin_keyboard,
@@ -26,11 +22,28 @@ from bot.keyboards import (
     get_certificate_confirm_keyboard,
     get_certificate_after_send_keyboard
 )
+from bot.middlewares import QueryStats
 from bot.states import AdminStates, CertificateStates
-from database.engine import async_session_maker
-from database.crud import UserCRUD, QuizAnswerCRUD
+from database.engine import after_commit, async_session_maker
+from database.crud import (
+    UserCRUD, BroadcastCRUD, ScheduledBroadcastCRUD, StatsCRUD, RaffleCRUD,
+    STAT_REGISTRATIONS, STAT_QUIZ_COMPLETED, STAT_PHOTOS, STAT_REFERRALS, STAT_WINNERS
+)
+from database.models import BroadcastCampaign
 from config import settings
 from services.env_updater import EnvUpdater
+from services.image_processor import ImageProcessor
+from services.broadcast import (
+    PENDING, SENT, BLOCKED, DEACTIVATED, FAILED, RETRY_AFTER,
+    run_campaign, is_campaign_running
+)
+from services.broadcast_scheduler import BroadcastScheduler, from_run_at, to_run_at, utc_now
+from services.data_export import export_participants
+from services.raffle import (
+    conduct_draw, notify_winners, NoParticipantsError, RaffleAlreadyConductedError
+)
+from services.user_cache import get_user_cache
+from services.user_listing import get_user_listing
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -38,6 +51,8 @@ logger = logging.getLogger(__name__)
 # Constants
 USERS_PER_PAGE = 10
 CERTIFICATE_USERS_PER_PAGE = 10
+SCHEDULE_TIME_FORMATS = ("%d-%m-%Y %H:%M", "%Y-%m-%d %H:%M")
+STATS_DAILY_DAYS = 7
 
 # Group names for broadcast
 GROUP_NAMES = {
@@ -74,99 +89,179 @@ async def cmd_admin(message: Message):
     )
 
 
+def format_daily_stats(daily: dict) -> str:
+    """Build per-day lines: registrations, quiz completions, photos, referrals."""
+    if not daily:
+        return "нет событий"
+    lines = []
+    for day, counts in daily.items():
+        lines.append(
+            f"{day[8:10]}.{day[5:7]}: "
+            f"+{counts.get(STAT_REGISTRATIONS, 0)} новых, "
+            f"{counts.get(STAT_QUIZ_COMPLETED, 0)} квиз, "
+            f"{counts.get(STAT_PHOTOS, 0)} фото, "
+            f"{counts.get(STAT_REFERRALS, 0)} по приглашению"
+        )
+    return "\n".join(lines)
+
+
 @router.message(F.text == "Статистика")
-async def show_statistics(message: Message):
+async def show_statistics(message: Message, session: AsyncSession, image_processor: ImageProcessor):
     """Show bot statistics."""
     if not is_admin(message.from_user.id):
         return
 
-    async with async_session_maker() as session:
-        all_users = await UserCRUD.get_all_participants(session)
-        winners = await UserCRUD.get_winners(session)
+    # Counters maintained by writes: no scan of users
+    totals = await StatsCRUD.get_totals(session)
+    daily = await StatsCRUD.get_daily(session, STATS_DAILY_DAYS)
 
-    # Calculate stats
-    total_users = len(all_users)
-    users_with_photo = sum(1 for u in all_users if u.photo_uploaded)
-    total_winners = len(winners)
+    cache_stats = image_processor.ai_generator.description_cache.stats()
 
     text = (
         f"<b>Статистика бота:</b>\n\n"
-        f"Всего участников: {total_users}\n"
-        f"Прошли квиз: {total_users}\n"
-        f"Загрузили фото: {users_with_photo}\n"
-        f"Победителей: {total_winners}\n\n"
+        f"Всего пользователей: {totals.get(STAT_REGISTRATIONS, 0)}\n"
+        f"Прошли квиз: {totals.get(STAT_QUIZ_COMPLETED, 0)}\n"
+        f"Загрузили фото: {totals.get(STAT_PHOTOS, 0)}\n"
+        f"Мужчины / женщины: {totals.get('gender_male', 0)} / {totals.get('gender_female', 0)}\n"
+        f"Пришли по приглашению: {totals.get(STAT_REFERRALS, 0)}\n"
+        f"Победителей: {totals.get(STAT_WINNERS, 0)}\n\n"
+        f"<b>По дням (UTC), последние {STATS_DAILY_DAYS}:</b>\n"
+        f"{format_daily_stats(daily)}\n\n"
         f"Дата окончания розыгрыша: {settings.QUIZ_END_DATE}\n"
-        f"Количество призов: {settings.WINNERS_COUNT}"
+        f"Количество призов: {settings.WINNERS_COUNT}\n\n"
+        f"Кэш описаний Gemini (с запуска): "
+        f"{cache_stats['hits']} попаданий, {cache_stats['misses']} промахов "
+        f"({cache_stats['hit_rate'] * 100:.0f}%)"
     )
 
     await message.answer(text=text)
 
 
-@router.message(F.text == "Розыгрыш")
-async def conduct_raffle(message: Message):
-    """Conduct the raffle and select winners."""
+@router.message(Command("rebuild_stats"))
+async def rebuild_statistics(message: Message, session: AsyncSession):
+    """Recompute statistics counters from the users table."""
     if not is_admin(message.from_user.id):
         return
 
-    async with async_session_maker() as session:
-        # Get all participants who completed quiz
-        participants = await UserCRUD.get_all_participants(session)
-
-        if len(participants) == 0:
-            await message.answer("Нет участников для розыгрыша.")
-            return
-
-        # Check if raffle already conducted
-        existing_winners = await UserCRUD.get_winners(session)
-        if len(existing_winners) > 0:
-            await message.answer(
-                f"Розыгрыш уже проведён. Победителей: {len(existing_winners)}\n"
-                "Используйте кнопку 'Победители' для просмотра."
-            )
-            return
+    before = await StatsCRUD.get_totals(session)
+    after = await StatsCRUD.rebuild(session)
+
+    drift = {
+        name: after.get(name, 0) - before.get(name, 0)
+        for name in sorted(set(before) | set(after))
+        if after.get(name, 0) != before.get(name, 0)
+    }
+    if drift:
+        text = "🔁 Счётчики пересчитаны. Исправлено:\n" + "\n".join(
+            f"{name}: {before.get(name, 0)} → {after.get(name, 0)}" for name in drift
+        )
+    else:
+        text = "🔁 Счётчики пересчитаны, расхождений нет"
+    await message.answer(text)
+    logger.info(f"Admin {message.from_user.id} rebuilt statistics counters, drift: {drift}")
 
-        # Select random winners
-        winners_count = min(settings.WINNERS_COUNT, len(participants))
-        winners = random.sample(participants, winners_count)
 
-        # Mark winners in database
-        for winner in winners:
-            await UserCRUD.set_winner(session, winner.id, True)
+@router.message(F.text == "Розыгрыш")
+async def conduct_raffle(message: Message, session: AsyncSession):
+    """Conduct the raffle and select winners."""
+    if not is_admin(message.from_user.id):
+        return
 
-        logger.info(f"Raffle conducted: {winners_count} winners selected")
+    try:
+        draw = await conduct_draw(message.from_user.id, settings.WINNERS_COUNT)
+    except NoParticipantsError:
+        await message.answer("Нет участников для розыгрыша.")
+        return
+    except RaffleAlreadyConductedError:
+        existing_winners = await UserCRUD.get_winners(session)
+        await message.answer(
+            f"Розыгрыш уже проведён. Победителей: {len(existing_winners)}\n"
+            "Используйте кнопку 'Победители' для просмотра."
+        )
+        return
 
     # Prepare response
     text = (
         f"<b>Розыгрыш проведён!</b>\n\n"
-        f"Выбрано победителей: {winners_count}\n\n"
-        f"Список победителей доступен через кнопку 'Победители'."
+        f"Выбрано победителей: {len(draw.winner_ids)} из {draw.participants_count}\n\n"
+        f"Список победителей доступен через кнопку 'Победители'.\n"
+        f"Данные для проверки: /raffle_audit"
     )
 
     await message.answer(text=text)
 
     # Notify winners
-    for winner in winners:
-        try:
-            await message.bot.send_message(
-                chat_id=winner.id,
-                text=(
-                    "<b>Поздравляем!</b> 🎉\n\n"
-                    "Вы стали победителем в розыгрыше сертификатов от СК ПРАЙД!\n\n"
-                    "С вами свяжется администратор для получения приза."
-                )
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify winner {winner.id}: {e}")
+    result = await notify_winners(message.bot, draw.winner_ids)
+    await message.answer(
+        f"Уведомления победителям: отправлено {result.sent} из {result.total}"
+        + (f", не доставлено {result.total - result.sent}" if result.sent < result.total else "")
+    )
+
+
+@router.message(Command("raffle_audit"))
+async def show_raffle_audit(message: Message, session: AsyncSession):
+    """Show seed and participant hash of the last draw for verification."""
+    if not is_admin(message.from_user.id):
+        return
+
+    draw = await RaffleCRUD.get_last_draw(session)
+
+    if not draw:
+        await message.answer("Розыгрыш ещё не проведён.")
+        return
+
+    await message.answer(
+        f"<b>Розыгрыш #{draw.id}</b> ({draw.created_at:%d-%m-%Y %H:%M} UTC)\n\n"
+        f"Участников: {draw.participants_count}\n"
+        f"Хэш участников (SHA-256): <code>{draw.participants_hash}</code>\n"
+        f"Сид: <code>{draw.seed}</code>\n\n"
+        f"Победители по порядку: {', '.join(str(user_id) for user_id in draw.winner_ids)}\n\n"
+        f"Победители - участники с наименьшим SHA-256(\"сид:ID\")."
+    )
+
+
+@router.message(Command("cache_stats"))
+async def show_cache_stats(message: Message):
+    """Show hit rates of the in-memory user cache used by message relaying."""
+    if not is_admin(message.from_user.id):
+        return
+
+    stats = get_user_cache().stats()
+    await message.answer(
+        f"<b>Кэш пользователей</b>\n\n"
+        f"По пользователю: {stats['user_hit_rate']:.1%} попаданий "
+        f"({stats['user_hits']} / {stats['user_hits'] + stats['user_misses']})\n"
+        f"По топику форума: {stats['topic_hit_rate']:.1%} попаданий "
+        f"({stats['topic_hits']} / {stats['topic_hits'] + stats['topic_misses']})\n\n"
+        f"В кэше: {stats['size']} пользователей, {stats['topics']} топиков\n"
+        f"Сбросов после записи: {stats['invalidations']}, вытеснено: {stats['evictions']}"
+    )
+
+
+@router.message(Command("query_stats"))
+async def show_query_stats(message: Message, query_stats: QueryStats):
+    """Show SQL statements per update by handler (to spot query regressions)."""
+    if not is_admin(message.from_user.id):
+        return
+
+    if not query_stats.handlers:
+        await message.answer("Апдейтов ещё не было.")
+        return
+
+    lines = ["<b>SQL-запросы на апдейт</b> (обработчик: апдейтов, в среднем, максимум)\n"]
+    by_average = sorted(query_stats.handlers.items(), key=lambda item: item[1][1] / item[1][0], reverse=True)
+    for name, (updates, queries, most) in by_average:
+        lines.append(f"<code>{name}</code>: {updates}, {queries / updates:.1f}, {most}")
+    await message.answer("\n".join(lines))
 
 
 @router.message(F.text == "Победители")
-async def show_winners(message: Message):
+async def show_winners(message: Message, session: AsyncSession):
     """Show list of winners."""
     if not is_admin(message.from_user.id):
         return
 
-    async with async_session_maker() as session:
-        winners = await UserCRUD.get_winners(session)
+    winners = await UserCRUD.get_winners(session)
 
     if len(winners) == 0:
         await message.answer("Розыгрыш ещё не проведён.")
@@ -184,53 +279,25 @@ async def show_winners(message: Message):
 
 @router.message(F.text == "Экспорт данных")
 async def export_data(message: Message):
-    """Export user data to CSV."""
+    """Export participants with quiz answers to CSV (split into parts if too large)."""
     if not is_admin(message.from_user.id):
         return
 
-    async with async_session_maker() as session:
-        users = await UserCRUD.get_all_participants(session)
-
-        # Create CSV
-        output = StringIO()
-        writer = csv.writer(output)
-
-        # Write header
-        writer.writerow([
-            'ID', 'Username', 'Full Name', 'Gender', 'Quiz Completed',
-            'Photo Uploaded', 'Is Winner', 'Created At'
-        ])
-
-        # Write data
-        for user in users:
-            # Get user's answers
-            answers = await QuizAnswerCRUD.get_user_answers(session, user.id)
-            answers_text = "; ".join([f"Q{a.question_number}: {a.answer}" for a in answers])
-
-            writer.writerow([
-                user.id,
-                user.username or '',
-                user.full_name or '',
-                user.gender or '',
-                'Да' if user.quiz_completed else 'Нет',
-                'Да' if user.photo_uploaded else 'Нет',
-                'Да' if user.is_winner else 'Нет',
-                user.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            ])
-
-    # Send CSV file
-    csv_content = output.getvalue().encode('utf-8-sig')  # UTF-8 with BOM for Excel
-    filename = f"pride34_bot_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-
-    from aiogram.types import BufferedInputFile
-    file = BufferedInputFile(csv_content, filename=filename)
-
-    await message.answer_document(
-        document=file,
-        caption=f"Экспорт данных: {len(users)} участников"
-    )
+    export = await export_participants()
+    try:
+        total = len(export.parts)
+        for index, part in enumerate(export.parts, start=1):
+            caption = f"Экспорт данных: {export.rows} участников за {export.elapsed:.1f} с"
+            if total > 1:
+                caption += f"\nЧасть {index}/{total}: {part.rows} строк"
+            await message.answer_document(document=part.as_input_file(), caption=caption)
+    finally:
+        export.close()
 
-    logger.info(f"Admin {message.from_user.id} exported data: {len(users)} users")
+    logger.info(
+        f"Admin {message.from_user.id} exported data: {export.rows} users, "
+        f"{len(export.parts)} file(s), {export.elapsed:.2f}s"
+    )
 
 
 # === NEW HANDLERS ===
@@ -565,11 +632,10 @@ async def handle_group_selection(callback: CallbackQuery, state: FSMContext):
         await state.set_state(AdminStates.broadcast_personal_id_input)
         return
 
-    # Get users for selected group
-    async with async_session_maker() as session:
-        users = await UserCRUD.get_users_by_filter(session, group_type)
+    # Count users in selected group (pages are loaded on demand)
+    listing = await get_user_listing().open(group_type)
 
-    if not users:
+    if not listing["total"]:
         await callback.message.edit_text(
             f"❌ В группе <b>{GROUP_NAMES[group_type]}</b> нет пользователей.\n\n"
             "Выберите другую группу:",
@@ -578,11 +644,10 @@ async def handle_group_selection(callback: CallbackQuery, state: FSMContext):
         return
 
     # Store group info
-    total_pages = math.ceil(len(users) / USERS_PER_PAGE)
     await state.update_data(
         broadcast_group=group_type,
-        broadcast_users=[u.id for u in users],
-        broadcast_total_pages=total_pages,
+        broadcast_listing=listing,
+        broadcast_users=None,
         broadcast_current_page=0
     )
 
@@ -592,7 +657,7 @@ async def handle_group_selection(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(AdminStates.broadcast_personal_id_input, F.text)
-async def handle_personal_id_input(message: Message, state: FSMContext):
+async def handle_personal_id_input(message: Message, state: FSMContext, session: AsyncSession):
     """Handle personal broadcast user ID input."""
     if not is_admin(message.from_user.id):
         await state.clear()
@@ -605,8 +670,7 @@ async def handle_personal_id_input(message: Message, state: FSMContext):
         return
 
     # Check if user exists
-    async with async_session_maker() as session:
-        user = await UserCRUD.get(session, user_id)
+    user = await UserCRUD.get(session, user_id)
 
     if not user:
         await message.answer(
@@ -619,7 +683,8 @@ async def handle_personal_id_input(message: Message, state: FSMContext):
     display_name = user.full_name or f"User {user.id}"
     await state.update_data(
         broadcast_group='personal',
-        broadcast_users=[user_id]
+        broadcast_users=[user_id],
+        broadcast_listing=None
     )
 
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -639,28 +704,20 @@ async def handle_personal_id_input(message: Message, state: FSMContext):
 async def show_group_preview_page(message: Message, state: FSMContext, page: int):
     """Display a page of users in selected group."""
     data = await state.get_data()
-    user_ids = data.get("broadcast_users", [])
-    total_pages = data.get("broadcast_total_pages", 1)
+    listing = data["broadcast_listing"]
     group_type = data.get("broadcast_group", "all")
 
-    # Get users for this page
-    start_idx = page * USERS_PER_PAGE
-    end_idx = start_idx + USERS_PER_PAGE
-    page_user_ids = user_ids[start_idx:end_idx]
-
-    # Fetch details
-    async with async_session_maker() as session:
-        users = []
-        for uid in page_user_ids:
-            user = await UserCRUD.get(session, uid)
-            if user:
-                users.append(user)
+    # Fetch page with one query
+    user_listing = get_user_listing()
+    page, users = await user_listing.get_page(listing, page, USERS_PER_PAGE)
+    total_pages = user_listing.total_pages(listing, USERS_PER_PAGE)
+    await state.update_data(broadcast_listing=listing, broadcast_current_page=page)
 
     # Build text
     group_name = GROUP_NAMES[group_type]
     text = f"<b>{group_name}</b>\n"
     text += f"Страница {page + 1}/{total_pages}\n\n"
-    text += f"📊 Всего получателей: {len(user_ids)}\n\n"
+    text += f"📊 Всего получателей: {listing['total']}\n\n"
 
     for user in users:
         display_name = user.full_name or f"User {user.id}"
@@ -693,7 +750,6 @@ async def handle_preview_pagination(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
     page = int(callback.data.split("_")[-1])
-    await state.update_data(broadcast_current_page=page)
     await show_group_preview_page(callback.message, state, page)
 
 
@@ -736,21 +792,19 @@ async def start_broadcast_flow_old(message: Message, state: FSMContext):
     if not is_admin(message.from_user.id):
         return
 
-    # Get all quiz-completed users
-    async with async_session_maker() as session:
-        users = await UserCRUD.get_all_participants(session)
+    # Count quiz-completed users (pages are loaded on demand)
+    listing = await get_user_listing().open('completed')
 
-    if not users:
+    if not listing["total"]:
         await message.answer("Нет пользователей для рассылки.")
         return
 
-    total_pages = math.ceil(len(users) / USERS_PER_PAGE)
-
     # Store in state
     await state.update_data(
-        broadcast_users=[u.id for u in users],  # Store only IDs
-        broadcast_current_page=0,
-        broadcast_total_pages=total_pages
+        broadcast_group='completed',
+        broadcast_listing=listing,
+        broadcast_users=None,
+        broadcast_current_page=0
     )
 
     # Show first page
@@ -761,25 +815,17 @@ async def start_broadcast_flow_old(message: Message, state: FSMContext):
 async def show_broadcast_user_page(message: Message, state: FSMContext, page: int):
     """Display a page of users for broadcast preview."""
     data = await state.get_data()
-    user_ids = data.get("broadcast_users", [])
-    total_pages = data.get("broadcast_total_pages", 1)
-
-    # Get users for this page
-    start_idx = page * USERS_PER_PAGE
-    end_idx = start_idx + USERS_PER_PAGE
-    page_user_ids = user_ids[start_idx:end_idx]
+    listing = data["broadcast_listing"]
 
-    # Fetch user details
-    async with async_session_maker() as session:
-        users = []
-        for uid in page_user_ids:
-            user = await UserCRUD.get(session, uid)
-            if user:
-                users.append(user)
+    # Fetch page with one query
+    user_listing = get_user_listing()
+    page, users = await user_listing.get_page(listing, page, USERS_PER_PAGE)
+    total_pages = user_listing.total_pages(listing, USERS_PER_PAGE)
+    await state.update_data(broadcast_listing=listing, broadcast_current_page=page)
 
     # Build user list text
     text = f"<b>Получатели рассылки (страница {page + 1}/{total_pages}):</b>\n\n"
-    text += f"Всего пользователей: {len(user_ids)}\n\n"
+    text += f"Всего пользователей: {listing['total']}\n\n"
 
     for user in users:
         # Format display name
@@ -808,7 +854,6 @@ async def handle_broadcast_pagination(callback: CallbackQuery, state: FSMContext
     await callback.answer()
 
     page = int(callback.data.split("_")[-1])
-    await state.update_data(broadcast_current_page=page)
 
     await callback.message.delete()
     await show_broadcast_user_page(callback.message, state, page)
@@ -846,7 +891,8 @@ async def handle_broadcast_message_input(message: Message, state: FSMContext):
     )
 
     data = await state.get_data()
-    total_users = len(data.get("broadcast_users", []))
+    listing = data.get("broadcast_listing")
+    total_users = listing["total"] if listing else len(data.get("broadcast_users") or [])
 
     # Show confirmation
     confirm_text = (
@@ -864,76 +910,258 @@ async def handle_broadcast_message_input(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data == "admin_broadcast_send", AdminStates.broadcast_confirmation)
-async def execute_broadcast(callback: CallbackQuery, state: FSMContext):
-    """Execute the broadcast to all users."""
+async def execute_broadcast(
+    callback: CallbackQuery,
+    state: FSMContext,
+    session: AsyncSession,
+    broadcast_scheduler: BroadcastScheduler
+):
+    """Start the broadcast in the background; progress is reported from its task."""
     await callback.answer()
 
     data = await state.get_data()
-    user_ids = data.get("broadcast_users", [])
+    group_type = data.get("broadcast_group", "all")
     message_id = data.get("broadcast_message_id")
     chat_id = data.get("broadcast_chat_id")
 
+    # Group audiences are resolved now; only a personal broadcast keeps its recipient in state
+    if group_type == "personal":
+        user_ids = data.get("broadcast_users") or []
+    else:
+        user_ids = [user.id for user in await UserCRUD.get_users_by_filter(session, group_type)]
+
     if not user_ids or not message_id:
         await callback.message.answer("Ошибка: данные рассылки не найдены")
         await state.clear()
         return
 
+    # Store recipients in the delivery ledger so the send survives restarts
+    campaign = await BroadcastCRUD.create_campaign(
+        session, callback.from_user.id, chat_id, message_id, user_ids
+    )
+
+    # Clear FSM right away: the send runs for minutes, admin may use other commands
+    await state.clear()
+
     # Delete confirmation message
     await callback.message.delete()
 
-    # Start broadcasting
-    status_msg = await callback.message.answer(
-        f"🚀 Начинаю рассылку...\n\n"
-        f"Отправлено: 0/{len(user_ids)}"
+    # The send runs for minutes in its own task, once the campaign is committed
+    chat_id = callback.message.chat.id
+    after_commit(session, lambda: broadcast_scheduler.send(campaign, chat_id=chat_id))
+
+
+def format_broadcast_progress(campaign: BroadcastCampaign, counts: dict) -> str:
+    """Build progress text from per-status delivery counts."""
+    return (
+        f"🚀 Рассылка #{campaign.id} в процессе...\n\n"
+        f"Отправлено: {counts.get(SENT, 0)}/{campaign.total}\n"
+        f"Заблокировали бота: {counts.get(BLOCKED, 0) + counts.get(DEACTIVATED, 0)}\n"
+        f"Ошибок: {counts.get(FAILED, 0)}\n"
+        f"Осталось: {counts.get(PENDING, 0) + counts.get(RETRY_AFTER, 0)}"
     )
 
-    success_count = 0
-    failed_count = 0
 
-    for i, user_id in enumerate(user_ids, 1):
-        try:
-            # Copy message to user
-            await callback.bot.copy_message(
-                chat_id=user_id,
-                from_chat_id=chat_id,
-                message_id=message_id
-            )
-            success_count += 1
-
-            # Update status every 10 users
-            if i % 10 == 0:
-                await status_msg.edit_text(
-                    f"🚀 Рассылка в процессе...\n\n"
-                    f"Отправлено: {success_count}/{len(user_ids)}\n"
-                    f"Ошибок: {failed_count}"
-                )
+async def run_broadcast_campaign(bot: Bot, campaign: BroadcastCampaign, chat_id: int = None):
+    """
+    Send (or resume) campaign and report progress in a status message.
 
-            # Anti-flood delay
-            await asyncio.sleep(0.05)
+    The status message goes to chat_id, or to the admin who created the
+    campaign (scheduled broadcasts).
+    """
+    async with async_session_maker() as session:
+        counts = await BroadcastCRUD.get_counts(session, campaign.id)
+
+    status_msg = await bot.send_message(chat_id or campaign.admin_id, format_broadcast_progress(campaign, counts))
+    async with async_session_maker() as session:
+        await BroadcastCRUD.set_status_message(session, campaign.id, status_msg.chat.id, status_msg.message_id)
 
-        except Exception as e:
-            logger.error(f"Failed to send broadcast to {user_id}: {e}")
-            failed_count += 1
+    async def show_progress(counts: dict):
+        await status_msg.edit_text(format_broadcast_progress(campaign, counts))
+
+    started_at = datetime.now()
+    counts = await run_campaign(bot, campaign, on_progress=show_progress)
+    elapsed = (datetime.now() - started_at).total_seconds()
 
     # Final report
+    sent = counts.get(SENT, 0)
     final_text = (
-        f"✅ <b>Рассылка завершена!</b>\n\n"
+        f"✅ <b>Рассылка #{campaign.id} завершена!</b>\n\n"
         f"📊 Статистика:\n"
-        f"• Всего пользователей: {len(user_ids)}\n"
-        f"• Успешно отправлено: {success_count}\n"
-        f"• Ошибок: {failed_count}\n"
-        f"• Процент доставки: {(success_count/len(user_ids)*100):.1f}%"
+        f"• Всего пользователей: {campaign.total}\n"
+        f"• Успешно отправлено: {sent}\n"
+        f"• Заблокировали бота: {counts.get(BLOCKED, 0)}\n"
+        f"• Удалённые аккаунты: {counts.get(DEACTIVATED, 0)}\n"
+        f"• Ошибок: {counts.get(FAILED, 0)}\n"
+        f"• Не доставлено из-за лимитов: {counts.get(RETRY_AFTER, 0)}\n"
+        f"• Процент доставки: {(sent / campaign.total * 100 if campaign.total else 0):.1f}%\n"
+        f"• Время: {elapsed:.0f} сек"
     )
 
     await status_msg.edit_text(final_text)
-    await state.clear()
 
     logger.info(
-        f"Broadcast completed by admin {callback.from_user.id}: "
-        f"{success_count} sent, {failed_count} failed"
+        f"Broadcast campaign {campaign.id} completed: "
+        f"{sent} sent, {counts.get(BLOCKED, 0) + counts.get(DEACTIVATED, 0)} unreachable, "
+        f"{counts.get(FAILED, 0)} failed, {counts.get(RETRY_AFTER, 0)} deferred"
     )
 
 
+@router.message(Command("resume_broadcast"))
+async def resume_broadcasts(message: Message, session: AsyncSession, broadcast_scheduler: BroadcastScheduler):
+    """Resume broadcast campaigns interrupted by a restart or crash."""
+    if not is_admin(message.from_user.id):
+        return
+
+    campaigns = [
+        campaign for campaign in await BroadcastCRUD.get_unfinished(session)
+        if not is_campaign_running(campaign.id)
+    ]
+
+    if not campaigns:
+        await message.answer("Нет прерванных рассылок")
+        return
+
+    await message.answer(f"🔁 Продолжаю прерванные рассылки: {len(campaigns)}")
+    for campaign in campaigns:
+        logger.info(f"Broadcast campaign {campaign.id} resumed by admin {message.from_user.id}")
+        broadcast_scheduler.send(campaign, chat_id=message.chat.id)
+
+
+def parse_schedule_time(text: str) -> datetime | None:
+    """Parse broadcast time entered by admin (naive, in the schedule time zone)."""
+    for fmt in SCHEDULE_TIME_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+@router.callback_query(F.data == "admin_broadcast_schedule", AdminStates.broadcast_confirmation)
+async def ask_broadcast_schedule_time(callback: CallbackQuery, state: FSMContext):
+    """Ask admin when to send the broadcast."""
+    await callback.answer()
+
+    # QUIZ_END_DATE is YYYY-MM-DD by default and DD-MM-YYYY once changed from the admin panel
+    raffle_morning = parse_schedule_time(f"{settings.QUIZ_END_DATE} 09:00")
+    example = f"{raffle_morning:%d-%m-%Y %H:%M}" if raffle_morning else "31-12-2025 09:00"
+
+    await callback.message.edit_text(
+        "⏰ <b>Когда отправить рассылку?</b>\n\n"
+        "Введите дату и время в формате <code>ДД-ММ-ГГГГ ЧЧ:ММ</code>\n"
+        f"(часовой пояс UTC{settings.BROADCAST_SCHEDULE_UTC_OFFSET:+d})\n"
+        f"Например, утро розыгрыша: <code>{example}</code>\n\n"
+        "Для отмены используйте /cancel"
+    )
+
+    await state.set_state(AdminStates.broadcast_schedule_input)
+
+
+@router.message(AdminStates.broadcast_schedule_input, F.text)
+async def handle_broadcast_schedule_input(
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    broadcast_scheduler: BroadcastScheduler
+):
+    """Save scheduled broadcast."""
+    if not is_admin(message.from_user.id):
+        await state.clear()
+        return
+
+    local_time = parse_schedule_time(message.text)
+    if local_time is None:
+        await message.answer(
+            "❌ Некорректный формат.\n\n"
+            "Используйте формат: <code>ДД-ММ-ГГГГ ЧЧ:ММ</code>\n"
+            "Пример: <code>31-12-2025 09:00</code>"
+        )
+        return
+
+    run_at = to_run_at(local_time)
+    if run_at <= utc_now():
+        await message.answer("❌ Время должно быть в будущем. Попробуйте снова.")
+        return
+
+    data = await state.get_data()
+    group_type = data.get("broadcast_group", "all")
+    if not data.get("broadcast_message_id"):
+        await message.answer("Ошибка: данные рассылки не найдены")
+        await state.clear()
+        return
+
+    # Group audiences are resolved at send time; a personal broadcast keeps its recipient
+    job = await ScheduledBroadcastCRUD.create(
+        session,
+        admin_id=message.from_user.id,
+        from_chat_id=data["broadcast_chat_id"],
+        message_id=data["broadcast_message_id"],
+        audience=group_type,
+        run_at=run_at,
+        user_ids=data.get("broadcast_users") if group_type == "personal" else None
+    )
+    # The scheduler reads jobs in its own task: wake it once the update commits
+    after_commit(session, broadcast_scheduler.wake)
+    await state.clear()
+
+    await message.answer(
+        f"✅ Рассылка #{job.id} запланирована на <b>{local_time:%d-%m-%Y %H:%M}</b>\n"
+        f"Получатели: {GROUP_NAMES.get(group_type, group_type)}\n\n"
+        f"Список: /scheduled\n"
+        f"Отменить: <code>/cancel_scheduled {job.id}</code>"
+    )
+    logger.info(f"Admin {message.from_user.id} scheduled broadcast {job.id} for {run_at} UTC")
+
+
+@router.message(Command("scheduled"))
+async def show_scheduled_broadcasts(message: Message, session: AsyncSession):
+    """List broadcasts waiting for their time."""
+    if not is_admin(message.from_user.id):
+        return
+
+    jobs = await ScheduledBroadcastCRUD.get_scheduled(session)
+
+    if not jobs:
+        await message.answer("Нет запланированных рассылок")
+        return
+
+    text = "<b>⏰ Запланированные рассылки:</b>\n\n"
+    for job in jobs:
+        text += f"#{job.id} — {from_run_at(job.run_at):%d-%m-%Y %H:%M} — {GROUP_NAMES.get(job.audience, job.audience)}\n"
+    text += "\nОтменить: <code>/cancel_scheduled ID</code>"
+
+    await message.answer(text)
+
+
+@router.message(Command("cancel_scheduled"))
+async def cancel_scheduled_broadcast(
+    message: Message,
+    command: CommandObject,
+    session: AsyncSession,
+    broadcast_scheduler: BroadcastScheduler
+):
+    """Cancel scheduled broadcast by ID."""
+    if not is_admin(message.from_user.id):
+        return
+
+    try:
+        job_id = int(command.args.strip().lstrip("#"))
+    except (AttributeError, ValueError):
+        await message.answer("Использование: <code>/cancel_scheduled ID</code>")
+        return
+
+    cancelled = await ScheduledBroadcastCRUD.cancel(session, job_id)
+
+    if not cancelled:
+        await message.answer(f"❌ Запланированная рассылка #{job_id} не найдена или уже началась")
+        return
+
+    after_commit(session, broadcast_scheduler.wake)
+    await message.answer(f"✅ Рассылка #{job_id} отменена")
+    logger.info(f"Admin {message.from_user.id} cancelled scheduled broadcast {job_id}")
+
+
 @router.callback_query(F.data == "admin_broadcast_cancel")
 async def cancel_broadcast_flow(callback: CallbackQuery, state: FSMContext):
     """Cancel broadcast flow."""
@@ -956,26 +1184,21 @@ async def start_certificate_flow(message: Message, state: FSMContext):
         logger.warning(f"📜 CERTIFICATE: User {message.from_user.id} is not admin, ignoring")
         return
 
-    logger.info(f"📜 CERTIFICATE: Getting completed users from database")
-    async with async_session_maker() as session:
-        users = await UserCRUD.get_users_by_filter(session, 'completed')
+    logger.info(f"📜 CERTIFICATE: Counting completed users")
+    listing = await get_user_listing().open('completed', include_unreachable=True)
 
-    logger.info(f"📜 CERTIFICATE: Found {len(users)} completed users")
+    logger.info(f"📜 CERTIFICATE: Found {listing['total']} completed users")
 
-    if not users:
+    if not listing["total"]:
         await message.answer(
             "❌ Нет пользователей, получивших открытку.\n\n"
             "Сертификаты можно выдавать только тем, кто завершил квиз."
         )
         return
 
-    users.sort(key=lambda u: u.created_at, reverse=True)
-    total_pages = math.ceil(len(users) / CERTIFICATE_USERS_PER_PAGE)
-
     await state.update_data(
-        certificate_users=[u.id for u in users],
-        certificate_current_page=0,
-        certificate_total_pages=total_pages
+        certificate_listing=listing,
+        certificate_current_page=0
     )
 
     await show_certificate_user_page(message, state, 0)
@@ -985,24 +1208,17 @@ async def start_certificate_flow(message: Message, state: FSMContext):
 async def show_certificate_user_page(message: Message, state: FSMContext, page: int):
     """Display a page of users for certificate issuance."""
     data = await state.get_data()
-    user_ids = data.get("certificate_users", [])
-    total_pages = data.get("certificate_total_pages", 1)
-
-    start_idx = page * CERTIFICATE_USERS_PER_PAGE
-    end_idx = start_idx + CERTIFICATE_USERS_PER_PAGE
-    page_user_ids = user_ids[start_idx:end_idx]
+    listing = data["certificate_listing"]
 
-    async with async_session_maker() as session:
-        users = []
-        for uid in page_user_ids:
-            user = await UserCRUD.get(session, uid)
-            if user:
-                users.append(user)
+    user_listing = get_user_listing()
+    page, users = await user_listing.get_page(listing, page, CERTIFICATE_USERS_PER_PAGE)
+    total_pages = user_listing.total_pages(listing, CERTIFICATE_USERS_PER_PAGE)
+    await state.update_data(certificate_listing=listing, certificate_current_page=page)
 
     text = (
         f"📜 <b>Выдача сертификатов</b>\n\n"
         f"Страница {page + 1}/{total_pages}\n"
-        f"Всего получателей: {len(user_ids)}\n\n"
+        f"Всего получателей: {listing['total']}\n\n"
         f"Выберите пользователя для отправки сертификата:"
     )
 
@@ -1019,20 +1235,22 @@ async def handle_certificate_pagination(callback: CallbackQuery, state: FSMConte
     """Handle pagination."""
     await callback.answer()
     page = int(callback.data.split("_")[-1])
-    await state.update_data(certificate_current_page=page)
     await show_certificate_user_page(callback.message, state, page)
 
 
 @router.callback_query(F.data.startswith("cert_select_"), CertificateStates.viewing_users)
-async def handle_certificate_user_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_certificate_user_selection(
+    callback: CallbackQuery,
+    state: FSMContext,
+    session: AsyncSession
+):
     """Handle user selection."""
     logger.info(f"📜 CERTIFICATE: User selected by admin {callback.from_user.id}, callback_data={callback.data}")
     await callback.answer()
     user_id = int(callback.data.split("_")[-1])
     logger.info(f"📜 CERTIFICATE: Parsed user_id: {user_id}")
 
-    async with async_session_maker() as session:
-        user = await UserCRUD.get(session, user_id)
+    user = await UserCRUD.get(session, user_id)
 
     if not user:
         logger.error(f"📜 CERTIFICATE: User {user_id} not found")
@@ -1070,7 +1288,7 @@ async def handle_certificate_user_selection(callback: CallbackQuery, state: FSMC
 
 
 @router.callback_query(F.data == "cert_confirm_yes", CertificateStates.confirming_send)
-async def handle_certificate_confirm_yes(callback: CallbackQuery, state: FSMContext):
+async def handle_certificate_confirm_yes(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Handle confirmed sending."""
     logger.info(f"📜 CERTIFICATE: Confirm YES clicked by admin {callback.from_user.id}")
     await callback.answer()
@@ -1086,8 +1304,7 @@ async def handle_certificate_confirm_yes(callback: CallbackQuery, state: FSMCont
         return
 
     logger.info(f"📜 CERTIFICATE: Getting user {user_id} from database")
-    async with async_session_maker() as session:
-        user = await UserCRUD.get(session, user_id)
+    user = await UserCRUD.get(session, user_id)
 
     if not user:
         logger.error(f"📜 CERTIFICATE: User {user_id} not found in database")
@@ -1101,7 +1318,7 @@ async def handle_certificate_confirm_yes(callback: CallbackQuery, state: FSMCont
 
     try:
         from services.certificate_generator import CertificateGenerator
-        from aiogram.types import FSInputFile
+        from services.file_id_cache import get_file_id_cache
 
         generator = CertificateGenerator()
 
@@ -1118,11 +1335,12 @@ async def handle_certificate_confirm_yes(callback: CallbackQuery, state: FSMCont
             expiry_date=settings.QUIZ_END_DATE
         )
 
-        cert_file = FSInputFile(certificate_path)
+        file_id_cache = get_file_id_cache()
 
-        await callback.bot.send_photo(
-            chat_id=user_id,
-            photo=cert_file,
+        await file_id_cache.send_photo(
+            callback.bot,
+            user_id,
+            certificate_path,
             caption=(
                 f"🎉 <b>Поздравляем!</b>\n\n"
                 f"Вы получили сертификат от СК ПРАЙД!\n\n"
@@ -1131,10 +1349,11 @@ async def handle_certificate_confirm_yes(callback: CallbackQuery, state: FSMCont
         )
 
         if user.forum_topic_id:
-            await callback.bot.send_photo(
-                chat_id=settings.FORUM_GROUP_ID,
+            await file_id_cache.send_photo(
+                callback.bot,
+                settings.FORUM_GROUP_ID,
+                certificate_path,
                 message_thread_id=user.forum_topic_id,
-                photo=cert_file,
                 caption=(
                     f"📜 <b>Сертификат отправлен</b>\n\n"
                     f"Действителен до: {settings.QUIZ_END_DATE}"
@@ -1170,13 +1389,13 @@ async def handle_certificate_confirm_yes(callback: CallbackQuery, state: FSMCont
 
 
 @router.callback_query(F.data == "cert_confirm_yes")
-async def handle_certificate_confirm_yes_fallback(callback: CallbackQuery, state: FSMContext):
+async def handle_certificate_confirm_yes_fallback(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Handle YES button WITHOUT state filter (fallback)."""
     logger.warning(f"📜 CERTIFICATE: YES button fallback handler triggered! State filter didn't work.")
     current_state = await state.get_state()
     logger.warning(f"📜 CERTIFICATE: Current state: {current_state}")
     # Call the main handler
-    await handle_certificate_confirm_yes(callback, state)
+    await handle_certificate_confirm_yes(callback, state, session)
 
 
 @router.callback_query(F.data == "cert_confirm_no")
@@ -1197,23 +1416,18 @@ async def handle_certificate_send_another(callback: CallbackQuery, state: FSMCon
     await callback.message.delete()
 
     # Restart the flow
-    async with async_session_maker() as session:
-        users = await UserCRUD.get_users_by_filter(session, 'completed')
+    listing = await get_user_listing().open('completed', include_unreachable=True)
 
-    if not users:
+    if not listing["total"]:
         await callback.message.answer(
             "❌ Нет пользователей, получивших открытку.\n\n"
             "Сертификаты можно выдавать только тем, кто завершил квиз."
         )
         return
 
-    users.sort(key=lambda u: u.created_at, reverse=True)
-    total_pages = math.ceil(len(users) / CERTIFICATE_USERS_PER_PAGE)
-
     await state.update_data(
-        certificate_users=[u.id for u in users],
-        certificate_current_page=0,
-        certificate_total_pages=total_pages
+        certificate_listing=listing,
+        certificate_current_page=0
     )
 
     await show_certificate_user_page(callback.message, state, 0)
@@ -2,11 +2,9 @@
 import logging
 from aiogram import Router, F
 from aiogram.types import Message
-from sqlalchemy import select
 
-from database.engine import async_session_maker
-from database.crud import UserCRUD, UserMessageCRUD
-from database.models import User
+from services.message_log import MessageLogBuffer
+from services.user_cache import get_user_cache
 from config import settings
 
 router = Router()
@@ -14,7 +12,7 @@ logger = logging.getLogger(__name__)
 
 
 @router.message(F.chat.id == settings.FORUM_GROUP_ID, F.message_thread_id)
-async def handle_admin_message_in_topic(message: Message):
+async def handle_admin_message_in_topic(message: Message, message_log: MessageLogBuffer):
     """
     Handle admin message in user topic - forward to user.
     Only processes messages in topics (not in general chat).
@@ -24,13 +22,8 @@ async def handle_admin_message_in_topic(message: Message):
     if not topic_id:
         return  # Not in a topic
 
-    # Find user by forum_topic_id
-    async with async_session_maker() as session:
-        # Get user with this topic ID
-        result = await session.execute(
-            select(User).where(User.forum_topic_id == topic_id)
-        )
-        user = result.scalar_one_or_none()
+    # Find user by forum_topic_id (cached: this runs for every forum message)
+    user = await get_user_cache().get_by_topic(topic_id)
 
     if not user:
         logger.warning(f"No user found for topic {topic_id}")
@@ -48,15 +41,13 @@ async def handle_admin_message_in_topic(message: Message):
             message_id=message.message_id
         )
 
-        # Log the message
-        async with async_session_maker() as session:
-            await UserMessageCRUD.log_message(
-                session,
-                user_id=user.id,
-                forum_message_id=message.message_id,
-                user_message_id=sent_message.message_id,
-                direction='to_user'
-            )
+        # Log the message (written in batches in the background)
+        await message_log.log(
+            user_id=user.id,
+            forum_message_id=message.message_id,
+            user_message_id=sent_message.message_id,
+            direction='to_user'
+        )
 
         logger.info(f"Forwarded message from topic {topic_id} to user {user.id}")
 
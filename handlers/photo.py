@@ -1,23 +1,34 @@
 """Photo handling and gender selection."""
+import asyncio
 import logging
 from pathlib import Path
-from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram import Bot, Router, F
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards import get_gender_keyboard, get_share_keyboard
 from bot.states import QuizStates
 from bot.quiz_data import get_prediction
 from bot.texts import TextManager
-from database.engine import async_session_maker
+from database.engine import async_session_maker, unit_of_work
 from database.crud import UserCRUD, UserPhotoCRUD, QuizAnswerCRUD
+from database.models import GenerationJob
 from config import settings
 from services.image_processor import ImageProcessor
 from services.forum_service import ForumService
+from services.file_id_cache import get_file_id_cache
+from services.generation_queue import GenerationQueue, DuplicateJobError, QueueFullError
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+GENERATION_IN_PROGRESS_TEXT = (
+    "⏳ Твоя открытка уже в работе ✨\n\n"
+    "Дождись результата — мы пришлём его сюда"
+)
+
 
 async def ask_gender(message: Message, state: FSMContext):
     """Ask user to select gender."""
@@ -66,7 +77,7 @@ async def ask_gender_from_callback(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("gender_"))
-async def handle_gender_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_gender_selection(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Handle gender selection."""
     await callback.answer()
 
@@ -74,8 +85,7 @@ async def handle_gender_selection(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
 
     # Save gender to database
-    async with async_session_maker() as session:
-        await UserCRUD.set_gender(session, user_id, gender)
+    await UserCRUD.set_gender(session, user_id, gender)
 
     logger.info(f"User {user_id} selected gender: {gender}")
 
@@ -91,11 +101,55 @@ async def handle_gender_selection(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(QuizStates.waiting_for_photo, F.photo)
-async def handle_photo_upload(message: Message, state: FSMContext):
-    """Handle photo upload from user."""
+async def handle_photo_upload(
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    image_processor: ImageProcessor,
+    generation_queue: GenerationQueue
+):
+    """Handle photo upload from user.
+
+    image_processor and generation_queue are process-wide instances
+    injected by the dispatcher (see main.py); session is the update's
+    unit of work (see bot.middlewares).
+    """
     user_id = message.from_user.id
     logger.info(f"📸 PHOTO HANDLER: Started for user {user_id}")
 
+    # Hold the user's place in the queue before touching the photo file and
+    # row, so a second upload can't overwrite the photo of a queued job
+    try:
+        generation_queue.reserve(user_id)
+    except DuplicateJobError:
+        logger.info(f"⏳ PHOTO HANDLER: Generation already in progress for user {user_id}")
+        await message.answer(GENERATION_IN_PROGRESS_TEXT)
+        return
+    except QueueFullError:
+        logger.warning(f"⚠️ PHOTO HANDLER: Generation queue is full, rejecting user {user_id}")
+        await message.answer(
+            "😔 Сейчас слишком много желающих получить открытку.\n\n"
+            "Пожалуйста, отправь фото ещё раз через пару минут."
+        )
+        return
+
+    try:
+        await _save_photo_and_submit(message, state, session, image_processor, generation_queue)
+    finally:
+        # No-op once the job was submitted
+        generation_queue.release(user_id)
+
+
+async def _save_photo_and_submit(
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    image_processor: ImageProcessor,
+    generation_queue: GenerationQueue
+):
+    """Download, check and save user's photo, then submit the reserved job."""
+    user_id = message.from_user.id
+
     # Check current state
     current_state = await state.get_state()
     logger.info(f"📸 PHOTO HANDLER: Current state = {current_state}")
@@ -121,24 +175,17 @@ async def handle_photo_upload(message: Message, state: FSMContext):
     # Check if face is detected in photo
     logger.info(f"🔍 PHOTO HANDLER: Starting face detection")
     try:
-        import cv2
-        img = cv2.imread(str(file_path))
+        faces_count = image_processor.count_faces(file_path)
 
-        if img is None:
+        if faces_count is None:
             logger.error(f"❌ PHOTO HANDLER: Failed to read image file {file_path}")
             await message.answer("Произошла ошибка при обработке фото. Попробуйте отправить другое фото.")
             file_path.unlink()
             return
 
-        logger.info(f"🔍 PHOTO HANDLER: Image loaded, shape: {img.shape}")
-
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-
-        logger.info(f"🔍 PHOTO HANDLER: Detected {len(faces)} face(s)")
+        logger.info(f"🔍 PHOTO HANDLER: Detected {faces_count} face(s)")
 
-        if len(faces) == 0:
+        if faces_count == 0:
             logger.warning(f"⚠️ PHOTO HANDLER: No faces detected, asking user to resend")
             await message.answer(
                 "❌ К сожалению, на вашем фото не обнаружено лицо.\n\n"
@@ -157,46 +204,96 @@ async def handle_photo_upload(message: Message, state: FSMContext):
             file_path.unlink()
         return
 
-    # Save photo info to database
-    logger.info(f"💾 PHOTO HANDLER: Saving photo info to database")
-    try:
-        async with async_session_maker() as session:
-            await UserPhotoCRUD.add_photo(
-                session,
-                user_id=user_id,
-                file_id=file_id,
-                file_path=str(file_path)
-            )
-            await UserCRUD.update_photo_status(session, user_id, uploaded=True)
-        logger.info(f"✅ PHOTO HANDLER: Photo info saved to database")
-    except Exception as db_error:
-        logger.error(f"❌ PHOTO HANDLER: Database error: {db_error}", exc_info=True)
-        await message.answer("Произошла ошибка при сохранении данных. Попробуйте еще раз.")
-        return
+    # Get user data
+    logger.info(f"📋 PHOTO HANDLER: Getting user data from state")
+    data = await state.get_data()
+    gender = data.get("gender", "male")
+    answers = data.get("answers", [])
+    logger.info(f"📋 PHOTO HANDLER: Gender={gender}, Answers count={len(answers)}")
 
-    # Send processing message with hourglass animation
+    # Start Gemini analysis right away, the queued job will only await it
+    image_processor.prewarm_generation(file_path, gender, user_id)
+
+    # Send processing message with hourglass animation before writing: the
+    # update's writes hold the database write lock until the handler returns
     logger.info(f"⏳ PHOTO HANDLER: Sending processing message")
     processing_msg = await message.answer(
         "⏳ Колдуем над твоим новогодним образом ✨\n\n"
         "Ещё пару мгновений — и всё будет готово"
     )
 
-    # Get user data
-    logger.info(f"📋 PHOTO HANDLER: Getting user data from state")
-    data = await state.get_data()
-    gender = data.get("gender", "male")
-    answers = data.get("answers", [])
-    logger.info(f"📋 PHOTO HANDLER: Gender={gender}, Answers count={len(answers)}")
+    # Save photo info and persist the job in the generation queue; all of it
+    # commits with the update, and a worker starts once it has
+    logger.info(f"💾 PHOTO HANDLER: Saving photo info and queueing generation")
+    try:
+        # Forum post will reuse this file_id instead of uploading the photo back
+        await get_file_id_cache().remember(file_path, file_id)
+        await UserPhotoCRUD.add_photo(
+            session,
+            user_id=user_id,
+            file_id=file_id,
+            file_path=str(file_path)
+        )
+        await UserCRUD.update_photo_status(session, user_id, uploaded=True)
+        position = await generation_queue.submit(
+            user_id=user_id,
+            chat_id=message.chat.id,
+            file_path=str(file_path),
+            gender=gender,
+            answers=answers,
+            has_premium=message.from_user.is_premium or False,
+            processing_message_id=processing_msg.message_id
+        )
+    except Exception as db_error:
+        logger.error(f"❌ PHOTO HANDLER: Failed to save photo or queue generation: {db_error}", exc_info=True)
+        await session.rollback()
+        image_processor.cancel_prewarm(user_id)
+        await processing_msg.delete()
+        await message.answer("Произошла ошибка при сохранении данных. Попробуйте еще раз.")
+        return
+
+    if position > 0:
+        try:
+            await processing_msg.edit_text(
+                f"⏳ Ты #{position} в очереди на создание открытки ✨\n\n"
+                f"Как только подойдёт твоя очередь — пришлём результат сюда"
+            )
+        except Exception:
+            pass  # Worker already picked the job up and removed the message
+    logger.info(f"✅ PHOTO HANDLER: Job queued for user {user_id}, position {position}")
+
+
+async def process_generation_job(
+    job: GenerationJob,
+    bot: Bot,
+    storage: BaseStorage,
+    image_processor: ImageProcessor
+):
+    """
+    Run generation pipeline for a claimed job (called by GenerationQueue workers).
+
+    Works only from the persisted job row, so jobs resumed after a restart
+    are delivered the same way. Raises on failure; the queue retries the
+    job and tells the user (notify_generation_failed) once it gives up.
+    """
+    user_id = job.user_id
+    chat_id = job.chat_id
+    file_path = Path(job.file_path)
+    gender = job.gender
+    answers = job.answers or []
+    state = FSMContext(
+        storage=storage,
+        key=StorageKey(bot_id=bot.id, chat_id=chat_id, user_id=user_id)
+    )
 
     # Process image with periodic chat action updates
-    logger.info(f"🎨 PHOTO HANDLER: Starting image generation")
-    import asyncio
+    logger.info(f"🎨 GENERATION JOB: Starting image generation for user {user_id}")
 
     async def send_typing_periodically():
         """Send typing action every 4 seconds to keep animation alive"""
         while True:
             try:
-                await message.bot.send_chat_action(chat_id=message.chat.id, action="upload_photo")
+                await bot.send_chat_action(chat_id=chat_id, action="upload_photo")
                 await asyncio.sleep(4)
             except:
                 break
@@ -204,37 +301,35 @@ async def handle_photo_upload(message: Message, state: FSMContext):
     typing_task = asyncio.create_task(send_typing_periodically())
 
     try:
-        processor = ImageProcessor()
-        logger.info(f"🎨 PHOTO HANDLER: ImageProcessor created, calling create_christmas_figure")
-        generated_path = await processor.create_christmas_figure(
+        logger.info(f"🎨 GENERATION JOB: Calling create_christmas_figure")
+        generated_path = await image_processor.create_christmas_figure(
             user_photo_path=file_path,
             gender=gender,
             user_id=user_id
         )
         typing_task.cancel()  # Stop typing animation
-        logger.info(f"✅ PHOTO HANDLER: Image generated successfully: {generated_path}")
+        logger.info(f"✅ GENERATION JOB: Image generated successfully: {generated_path}")
 
         # Update database with generated path
-        logger.info(f"💾 PHOTO HANDLER: Updating database with generated path")
-        async with async_session_maker() as session:
+        logger.info(f"💾 GENERATION JOB: Updating database with generated path")
+        async with unit_of_work() as session:
             await UserPhotoCRUD.update_generated_path(session, user_id, str(generated_path))
             await UserCRUD.update_quiz_status(session, user_id, completed=True)
-        logger.info(f"✅ PHOTO HANDLER: Database updated")
+        logger.info(f"✅ GENERATION JOB: Database updated")
 
         # Delete processing message
-        logger.info(f"🗑️ PHOTO HANDLER: Deleting processing message")
-        await processing_msg.delete()
+        await _delete_processing_message(bot, job)
 
         # Send result to user
-        logger.info(f"📤 PHOTO HANDLER: Sending final result to user")
-        await send_final_result(message, state, generated_path, answers)
-        logger.info(f"✅ PHOTO HANDLER: Final result sent")
+        logger.info(f"📤 GENERATION JOB: Sending final result to user")
+        await send_final_result(bot, chat_id, user_id, state, generated_path, answers, job.has_premium)
+        logger.info(f"✅ GENERATION JOB: Final result sent")
 
         # Create forum topic with user data
-        logger.info(f"📝 PHOTO HANDLER: Creating forum topic")
+        logger.info(f"📝 GENERATION JOB: Creating forum topic")
         try:
             # Get user data with pride_gift_id and referrer info
-            logger.info(f"📝 PHOTO HANDLER: Getting user data for forum topic")
+            logger.info(f"📝 GENERATION JOB: Getting user data for forum topic")
             async with async_session_maker() as session:
                 user = await UserCRUD.get(session, user_id)
                 if not user:
@@ -259,11 +354,11 @@ async def handle_photo_upload(message: Message, state: FSMContext):
 
             # Create topic and STORE topic_id
             topic_id = await ForumService.create_user_topic(
-                bot=message.bot,
+                bot=bot,
                 user_id=user_id,
                 pride_gift_id=user.pride_gift_id,
-                username=message.from_user.username or "",
-                full_name=message.from_user.full_name or "",
+                username=user.username or "",
+                full_name=user.full_name or "",
                 gender=gender,
                 quiz_answers=quiz_answers_text,
                 user_photo_path=file_path,
@@ -274,32 +369,56 @@ async def handle_photo_upload(message: Message, state: FSMContext):
             )
 
             # ✨ НОВОЕ: Сохранить topic_id в базе данных
+            # (квиз отмечен завершённым вместе с generated_path выше)
             if topic_id > 0:
                 async with async_session_maker() as session:
                     await UserCRUD.update_forum_topic(session, user_id, topic_id)
-                    # Отметить пользователя как завершившего квиз
-                    await UserCRUD.mark_quiz_completed(session, user_id)
-                logger.info(f"Stored topic_id {topic_id} and marked quiz completed for user {user_id}")
+                logger.info(f"Stored topic_id {topic_id} for user {user_id}")
 
         except Exception as forum_error:
             logger.error(f"Error creating forum topic for user {user_id}: {forum_error}")
 
     except Exception as e:
         typing_task.cancel()  # Stop typing animation on error
-        logger.error(f"❌ PHOTO HANDLER: Error processing image for user {user_id}: {e}", exc_info=True)
-        try:
-            await processing_msg.delete()
-        except:
-            pass
-        await message.answer(
-            "Произошла ошибка при обработке фото. Попробуйте отправить другое фото."
-        )
-        logger.info(f"❌ PHOTO HANDLER: Error message sent to user")
+        logger.error(f"❌ GENERATION JOB: Error processing image for user {user_id}: {e}", exc_info=True)
+        raise
 
 
-async def send_final_result(message: Message, state: FSMContext, image_path: Path, answers: list):
+async def notify_generation_failed(job: GenerationJob, bot: Bot):
+    """
+    Replace "Колдуем..." message of a failed job with an error message.
+
+    Called by GenerationQueue for jobs given up after their last attempt.
+    """
+    await _delete_processing_message(bot, job)
+    await bot.send_message(
+        chat_id=job.chat_id,
+        text="Произошла ошибка при обработке фото. Попробуйте отправить другое фото."
+    )
+    logger.info(f"❌ GENERATION JOB: Error message sent to user {job.user_id}")
+
+
+async def _delete_processing_message(bot: Bot, job: GenerationJob):
+    """Delete "Колдуем..." message of a job if it still exists."""
+    if not job.processing_message_id:
+        return
+    try:
+        await bot.delete_message(chat_id=job.chat_id, message_id=job.processing_message_id)
+    except Exception:
+        pass
+
+
+async def send_final_result(
+    bot: Bot,
+    chat_id: int,
+    user_id: int,
+    state: FSMContext,
+    image_path: Path,
+    answers: list,
+    has_premium: bool = False
+):
     """Send final result with prediction and generated image."""
-    logger.info(f"📊 SEND_FINAL_RESULT: Starting for user {message.from_user.id}")
+    logger.info(f"📊 SEND_FINAL_RESULT: Starting for user {user_id}")
 
     # Get prediction
     prediction = get_prediction(answers)
@@ -323,19 +442,16 @@ async def send_final_result(message: Message, state: FSMContext, image_path: Pat
     )
 
     # Get bot info for username
-    bot_info = await message.bot.get_me()
+    bot_info = await bot.get_me()
     bot_username = bot_info.username
-    user_id = message.from_user.id
-
-    # Check if user has Telegram Premium
-    has_premium = message.from_user.is_premium or False
 
     # Send photo with text
     logger.info(f"📤 SEND_FINAL_RESULT: Sending photo to user")
     try:
-        photo = FSInputFile(image_path)
-        await message.answer_photo(
-            photo=photo,
+        await get_file_id_cache().send_photo(
+            bot,
+            chat_id,
+            image_path,
             caption=final_text,
             reply_markup=get_share_keyboard(bot_username, user_id, has_premium)
         )
@@ -343,7 +459,8 @@ async def send_final_result(message: Message, state: FSMContext, image_path: Pat
     except Exception as e:
         logger.error(f"❌ SEND_FINAL_RESULT: Error sending photo: {e}", exc_info=True)
         logger.info(f"📤 SEND_FINAL_RESULT: Sending as text message instead")
-        await message.answer(
+        await bot.send_message(
+            chat_id=chat_id,
             text=final_text,
             reply_markup=get_share_keyboard(bot_username, user_id, has_premium)
         )
@@ -438,7 +555,7 @@ async def handle_close_share_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("share_instagram_"))
-async def handle_instagram_story_share(callback: CallbackQuery):
+async def handle_instagram_story_share(callback: CallbackQuery, session: AsyncSession):
     """Handle Instagram Stories sharing."""
     user_id = callback.from_user.id
 
@@ -451,11 +568,10 @@ async def handle_instagram_story_share(callback: CallbackQuery):
     referral_link = UserCRUD.generate_referral_link(bot_username, user_id)
 
     # Get user's generated photo from database
-    async with async_session_maker() as session:
-        photo = await UserPhotoCRUD.get_photo(session, user_id)
-        if not photo or not photo.generated_path:
-            await callback.answer("Открытка не найдена. Пройдите квиз заново.", show_alert=True)
-            return
+    photo = await UserPhotoCRUD.get_photo(session, user_id)
+    if not photo or not photo.generated_path:
+        await callback.answer("Открытка не найдена. Пройдите квиз заново.", show_alert=True)
+        return
 
     # Instruction message
     instruction_text = (
@@ -475,7 +591,7 @@ async def handle_instagram_story_share(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("share_vk_"))
-async def handle_vk_story_share(callback: CallbackQuery):
+async def handle_vk_story_share(callback: CallbackQuery, session: AsyncSession):
     """Handle VK Stories sharing."""
     user_id = callback.from_user.id
 
@@ -488,11 +604,10 @@ async def handle_vk_story_share(callback: CallbackQuery):
     referral_link = UserCRUD.generate_referral_link(bot_username, user_id)
 
     # Get user's generated photo
-    async with async_session_maker() as session:
-        photo = await UserPhotoCRUD.get_photo(session, user_id)
-        if not photo or not photo.generated_path:
-            await callback.answer("Открытка не найдена. Пройдите квиз заново.", show_alert=True)
-            return
+    photo = await UserPhotoCRUD.get_photo(session, user_id)
+    if not photo or not photo.generated_path:
+        await callback.answer("Открытка не найдена. Пройдите квиз заново.", show_alert=True)
+        return
 
     # Instruction message
     instruction_text = (
@@ -512,7 +627,7 @@ async def handle_vk_story_share(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("share_tg_story_"))
-async def handle_telegram_story_share(callback: CallbackQuery):
+async def handle_telegram_story_share(callback: CallbackQuery, session: AsyncSession):
     """Handle Telegram Stories sharing (Premium only)."""
     user_id = callback.from_user.id
 
@@ -532,11 +647,10 @@ async def handle_telegram_story_share(callback: CallbackQuery):
     referral_link = UserCRUD.generate_referral_link(bot_username, user_id)
 
     # Get user's generated photo
-    async with async_session_maker() as session:
-        photo = await UserPhotoCRUD.get_photo(session, user_id)
-        if not photo or not photo.generated_path:
-            await callback.answer("Открытка не найдена. Пройдите квиз заново.", show_alert=True)
-            return
+    photo = await UserPhotoCRUD.get_photo(session, user_id)
+    if not photo or not photo.generated_path:
+        await callback.answer("Открытка не найдена. Пройдите квиз заново.", show_alert=True)
+        return
 
     # Instruction message
     instruction_text = (
@@ -3,11 +3,11 @@ import logging
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards import get_quiz_keyboard
 from bot.states import QuizStates
 from bot.quiz_data import get_quiz_questions, get_prediction
-from database.engine import async_session_maker
 from database.crud import QuizAnswerCRUD
 
 router = Router()
@@ -147,7 +147,7 @@ async def send_question_from_callback(callback: CallbackQuery, state: FSMContext
 
 
 @router.callback_query(F.data.startswith("quiz_"))
-async def handle_quiz_answer(callback: CallbackQuery, state: FSMContext):
+async def handle_quiz_answer(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Handle quiz answer."""
     try:
         logger.info(f"📋 HANDLE_QUIZ_ANSWER: Starting handler")
@@ -168,13 +168,12 @@ async def handle_quiz_answer(callback: CallbackQuery, state: FSMContext):
         # Save answer to database
         user_id = callback.from_user.id
         logger.info(f"📋 HANDLE_QUIZ_ANSWER: Saving to database for user {user_id}")
-        async with async_session_maker() as session:
-            await QuizAnswerCRUD.add_answer(
-                session,
-                user_id=user_id,
-                question_number=question_number,
-                answer=answer_text
-            )
+        await QuizAnswerCRUD.add_answer(
+            session,
+            user_id=user_id,
+            question_number=question_number,
+            answer=answer_text
+        )
         logger.info(f"📋 HANDLE_QUIZ_ANSWER: Database save completed")
 
         logger.info(f"User {user_id} answered question {question_number}: {answer_text}")
@@ -2,27 +2,40 @@
 import logging
 from aiogram import Router, F
 from aiogram.filters import CommandStart
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards import get_start_keyboard
 from bot.states import QuizStates
 from bot.texts import TextManager
-from database.engine import async_session_maker
 from database.crud import UserCRUD
 from config import settings
+from services.file_id_cache import get_file_id_cache
+from services.generation_queue import GenerationQueue
+from services.image_processor import ImageProcessor
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(
+    message: Message,
+    state: FSMContext,
+    session: AsyncSession,
+    image_processor: ImageProcessor,
+    generation_queue: GenerationQueue
+):
     """Handle /start command with optional referral parameter."""
     user_id = message.from_user.id
     username = message.from_user.username
     full_name = message.from_user.full_name
 
+    # Restarting abandons a photo that never made it into the queue
+    if not generation_queue.is_active(user_id):
+        image_processor.cancel_prewarm(user_id)
+
     # Parse referral parameter from /start command
     # Format: /start ref{referrer_user_id}
     referrer_id = None
@@ -36,23 +49,22 @@ async def cmd_start(message: Message, state: FSMContext):
                 logger.warning(f"Invalid referral parameter: {start_param}")
 
     # Register user in database
-    async with async_session_maker() as session:
-        user = await UserCRUD.get_or_create(
-            session,
-            user_id=user_id,
-            username=username,
-            full_name=full_name
-        )
-
-        # Set referrer if this is a new user and referral link was used
-        if referrer_id and not user.referrer_id:
-            # Verify referrer exists
-            referrer = await UserCRUD.get(session, referrer_id)
-            if referrer:
-                await UserCRUD.set_referrer(session, user_id, referrer_id)
-                logger.info(f"Set referrer {referrer_id} for user {user_id}")
-            else:
-                logger.warning(f"Referrer {referrer_id} not found")
+    user = await UserCRUD.get_or_create(
+        session,
+        user_id=user_id,
+        username=username,
+        full_name=full_name
+    )
+
+    # Set referrer if this is a new user and referral link was used
+    if referrer_id and not user.referrer_id:
+        # Verify referrer exists
+        referrer = await UserCRUD.get(session, referrer_id)
+        if referrer:
+            await UserCRUD.set_referrer(session, user_id, referrer_id)
+            logger.info(f"Set referrer {referrer_id} for user {user_id}")
+        else:
+            logger.warning(f"Referrer {referrer_id} not found")
 
     logger.info(f"User {user_id} started the bot")
 
@@ -65,9 +77,10 @@ async def cmd_start(message: Message, state: FSMContext):
     # Try to send image, fallback to text if image not found
     try:
         if welcome_image_path.exists():
-            photo = FSInputFile(welcome_image_path)
-            await message.answer_photo(
-                photo=photo,
+            await get_file_id_cache().send_photo(
+                message.bot,
+                message.chat.id,
+                welcome_image_path,
                 caption=welcome_text,
                 reply_markup=get_start_keyboard()
             )
@@ -3,8 +3,8 @@ import logging
 from aiogram import Router, F
 from aiogram.types import Message
 
-from database.engine import async_session_maker
-from database.crud import UserCRUD, UserMessageCRUD
+from services.message_log import MessageLogBuffer
+from services.user_cache import get_user_cache
 from config import settings
 
 router = Router()
@@ -12,7 +12,7 @@ logger = logging.getLogger(__name__)
 
 
 @router.message(F.chat.type == "private", F.from_user.id)
-async def handle_user_reply(message: Message):
+async def handle_user_reply(message: Message, message_log: MessageLogBuffer):
     """
     Handle user message in private chat - forward to their forum topic.
     Only for users who have completed quiz and have a topic.
@@ -23,9 +23,8 @@ async def handle_user_reply(message: Message):
     if user_id in settings.admin_ids_list:
         return
 
-    # Get user data
-    async with async_session_maker() as session:
-        user = await UserCRUD.get(session, user_id)
+    # Get user data (cached: this runs for every private message)
+    user = await get_user_cache().get(user_id)
 
     if not user or not user.forum_topic_id:
         # User doesn't have a forum topic yet
@@ -40,15 +39,13 @@ async def handle_user_reply(message: Message):
             message_id=message.message_id
         )
 
-        # Log the message
-        async with async_session_maker() as session:
-            await UserMessageCRUD.log_message(
-                session,
-                user_id=user_id,
-                forum_message_id=sent_message.message_id,
-                user_message_id=message.message_id,
-                direction='from_user'
-            )
+        # Log the message (written in batches in the background)
+        await message_log.log(
+            user_id=user_id,
+            forum_message_id=sent_message.message_id,
+            user_message_id=message.message_id,
+            direction='from_user'
+        )
 
         logger.info(f"Forwarded user {user_id} message to topic {user.forum_topic_id}")
 
@@ -1,13 +1,21 @@
 """Main entry point for the Pride34 Gift Bot."""
 import asyncio
 import logging
+from functools import partial
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from config import settings
-from database.engine import init_db
+from bot.middlewares import UnitOfWorkMiddleware
+from database.engine import init_db, async_session_maker
+from database.crud import BroadcastCRUD, StatsCRUD
 from handlers import start, quiz, photo, admin, forum_communication, user_replies, text_editor, inline
+from services.image_processor import get_image_processor
+from services.generation_queue import GenerationQueue
+from services.broadcast_scheduler import BroadcastScheduler
+from services.fsm_storage import build_fsm_storage
+from services.message_log import MessageLogBuffer
 
 
 # Configure logging
@@ -38,12 +46,68 @@ async def main():
     await init_db()
     logger.info("Database initialized")
 
+    # Statistics counters are kept up to date by writes; build them once for an existing database
+    async with async_session_maker() as session:
+        if not await StatsCRUD.has_counters(session):
+            totals = await StatsCRUD.rebuild(session)
+            logger.info(f"Statistics counters built: {totals}")
+
+    # Create shared image processor once and load cascades/templates/overlays
+    image_processor = get_image_processor()
+    await asyncio.to_thread(image_processor.warm_up)
+    logger.info("Image processor initialized")
+
     # Initialize bot and dispatcher
     bot = Bot(
         token=settings.BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    dp = Dispatcher()
+    # FSM states live in the database (see FSM_STORAGE), so quiz progress survives restarts
+    dp = Dispatcher(storage=build_fsm_storage())
+
+    # Start generation worker pool and re-drive jobs interrupted by a restart
+    generation_queue = GenerationQueue(
+        handler=partial(
+            photo.process_generation_job,
+            bot=bot,
+            storage=dp.storage,
+            image_processor=image_processor
+        ),
+        on_abandoned=partial(photo.notify_generation_failed, bot=bot)
+    )
+    await generation_queue.resume()
+    generation_queue.start()
+
+    # Interrupted broadcasts are not restarted automatically: an admin resumes them with /resume_broadcast
+    async with async_session_maker() as session:
+        unfinished_broadcasts = await BroadcastCRUD.get_unfinished(session)
+    if unfinished_broadcasts:
+        logger.warning(
+            f"{len(unfinished_broadcasts)} broadcast campaign(s) were interrupted, "
+            f"use /resume_broadcast to continue"
+        )
+
+    # Start timer for scheduled broadcasts (jobs due while the bot was down run right away)
+    broadcast_scheduler = BroadcastScheduler(handler=partial(admin.run_broadcast_campaign, bot))
+    await broadcast_scheduler.resume()
+    broadcast_scheduler.start()
+
+    # Relayed forum messages are logged in batches by a background task
+    message_log = MessageLogBuffer()
+    message_log.start()
+
+    # Shared services injected into handlers by argument name
+    dp["image_processor"] = image_processor
+    dp["generation_queue"] = generation_queue
+    dp["broadcast_scheduler"] = broadcast_scheduler
+    dp["message_log"] = message_log
+
+    # One database session per update (handlers take it as the session argument),
+    # committed once when the handler returns
+    unit_of_work = UnitOfWorkMiddleware()
+    dp.message.middleware(unit_of_work)
+    dp.callback_query.middleware(unit_of_work)
+    dp["query_stats"] = unit_of_work.stats
 
     # Register routers
     # ВАЖНО: Порядок имеет значение!
@@ -64,6 +128,11 @@ async def main():
         # Start polling
         await dp.start_polling(bot)
     finally:
+        await broadcast_scheduler.stop()
+        await message_log.stop()
+        await generation_queue.stop()
+        await image_processor.close()
+        await dp.storage.close()
         await bot.session.close()
 
 
@@ -1,20 +1,50 @@
 """AI service: Gemini 2.0 Flash for Vision + DALL-E 3 for Generation."""
+import asyncio
 import logging
+import hashlib
 import base64
+import tempfile
 import aiohttp
+from functools import partial
 from pathlib import Path
+from typing import IO, Optional
 from PIL import Image
-from io import BytesIO
 from config import settings
+from services.description_cache import DescriptionCache, photo_keys
+from services.generation_prewarm import PrewarmRegistry
+from services.image_assets import ImageAssets, get_image_assets
+from services.overlay_compositor import OverlayCompositor
 
 logger = logging.getLogger(__name__)
 
+# Streaming download of generated images
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_SPOOL_MAX_SIZE = 1024 * 1024  # Больше - сбрасываем во временный файл на диске
+
+# Returned when Gemini answers but the text can't be parsed (never cached)
+FALLBACK_DESCRIPTION = "A person with distinctive features"
+
+# Placeholder for Gemini's description in a prompt skeleton
+FACE_DESCRIPTION_MARKER = "<<FACE_DESCRIPTION>>"
+
+VISION_PROMPT = """
+Analyze this photo to help create a 3D toy figurine.
+Describe the person's key facial features in 2-3 short sentences:
+- Hair style and color
+- Glasses (if present)
+- Beard/mustache (if present)
+- Distinctive facial characteristics
+
+Keep it concise. Do not mention clothing or background.
+"""
+
 
 class AIImageGenerator:
     """Generate figurines using Gemini 2.0 (vision) + DALL-E 3 (generation)."""
 
-    def __init__(self):
+    def __init__(self, assets: Optional[ImageAssets] = None):
         """Initialize AI image generator."""
+        self.assets = assets or get_image_assets()
         self.google_key = getattr(settings, 'NANO_BANANA_API_KEY', '')
         self.openai_key = settings.OPENAI_API_KEY
 
@@ -25,6 +55,46 @@ class AIImageGenerator:
         # DALL-E 3 для рисования (стабильная генерация)
         self.dalle_url = "https://api.openai.com/v1/images/generations"
 
+        # overlay.png, масштабированный заранее под каждый размер результата
+        self.overlay_compositor = OverlayCompositor()
+
+        # Кэш описаний Gemini (повторная загрузка / ретрай без запроса к API)
+        self.description_cache = DescriptionCache()
+
+        # Спекулятивный анализ фото, запущенный до того, как дойдёт очередь
+        self.prewarm = PrewarmRegistry()
+
+        # Общая HTTP-сессия с пулом keep-alive соединений (создаётся при первом запросе)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Get long-lived pooled HTTP session, creating it on first use.
+
+        Connections to Gemini, OpenAI and the image CDN are kept alive and
+        reused, so DNS, TCP and TLS setup is paid once per host, not per call.
+
+        Returns:
+            Shared aiohttp session
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.AI_HTTP_POOL_SIZE,
+                limit_per_host=settings.AI_HTTP_LIMIT_PER_HOST,
+                keepalive_timeout=settings.AI_HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self) -> None:
+        """Cancel prewarm tasks, write cache hits and close pooled HTTP session (call on bot shutdown)."""
+        await self.prewarm.cancel_all()
+        await self.description_cache.flush_uses()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
     async def generate_figurine(
         self,
         user_photo_path: Path,
@@ -45,64 +115,40 @@ class AIImageGenerator:
             Path to generated image
         """
         try:
-            # --- ШАГ 1: Gemini 2.0 анализирует фото ---
-            logger.info(f"🤖 User {user_id}: Analyzing face with Gemini 2.0 Flash...")
-
             with open(user_photo_path, 'rb') as f:
-                b64_image = base64.b64encode(f.read()).decode('utf-8')
+                photo_bytes = f.read()
+            prewarmed = self.prewarm.take(user_id, hashlib.sha256(photo_bytes).hexdigest(), gender)
 
-            # Просим Gemini описать внешность для DALL-E
-            vision_prompt = """
-Analyze this photo to help create a 3D toy figurine.
-Describe the person's key facial features in 2-3 short sentences:
-- Hair style and color
-- Glasses (if present)
-- Beard/mustache (if present)
-- Distinctive facial characteristics
-
-Keep it concise. Do not mention clothing or background.
-"""
+            # --- ШАГ 1: Gemini 2.0 анализирует фото ---
+            description = None
+            if prewarmed is not None:
+                try:
+                    # Анализ запущен ещё при загрузке фото - просто дожидаемся его
+                    description = await prewarmed.description
+                    logger.info(f"✅ User {user_id}: Using prewarmed Gemini description")
+                except Exception as e:
+                    logger.warning(f"⚠️ User {user_id}: Prewarmed Gemini analysis failed, retrying: {e}")
 
-            # Запрос к Gemini 2.0
-            description = await self._ask_gemini(vision_prompt, b64_image)
-            logger.info(f"✅ Gemini description: {description}")
+            if description is None:
+                description = await self.describe_face(user_photo_path, user_id, photo_bytes)
 
             # --- ШАГ 2: Формируем промпт для DALL-E ---
-            full_prompt = self._create_dalle_prompt(gender, description)
+            if prewarmed is not None:
+                full_prompt = self._fill_prompt(prewarmed.prompt_skeleton, description)
+            else:
+                full_prompt = self._create_dalle_prompt(gender, description)
             logger.info(f"📝 DALL-E prompt created for user {user_id}")
 
             # --- ШАГ 3: DALL-E 3 генерирует изображение ---
             logger.info(f"🎨 User {user_id}: Generating image with DALL-E 3...")
-            generated_image = await self._generate_with_dalle(full_prompt)
-
-            # Накладываем overlay.png поверх результата
-            overlay_path = Path(__file__).parent.parent / "overlay.png"
-            if overlay_path.exists():
-                try:
-                    overlay = Image.open(overlay_path).convert("RGBA")
+            image_file = await self._generate_with_dalle(full_prompt)
 
-                    # Конвертируем generated_image в RGBA для прозрачности
-                    if generated_image.mode != 'RGBA':
-                        generated_image = generated_image.convert('RGBA')
-
-                    # Масштабируем overlay под размер generated_image если нужно
-                    if overlay.size != generated_image.size:
-                        overlay = overlay.resize(generated_image.size, Image.Resampling.LANCZOS)
-
-                    # Накладываем overlay поверх
-                    generated_image = Image.alpha_composite(generated_image, overlay)
-
-                    logger.info(f"✅ Overlay applied for user {user_id}")
-                except Exception as e:
-                    logger.warning(f"⚠️ Failed to apply overlay: {e}")
-            else:
-                logger.warning(f"⚠️ Overlay not found at {overlay_path}")
-
-            # Сохраняем результат (конвертируем в RGB для JPEG)
+            # Декодируем, накладываем overlay.png и кодируем в JPEG один раз (в отдельном потоке)
             output_path = settings.GENERATED_PHOTOS_DIR / f"{user_id}_christmas.jpg"
-            if generated_image.mode == 'RGBA':
-                generated_image = generated_image.convert('RGB')
-            generated_image.save(output_path, "JPEG", quality=95)
+            try:
+                await asyncio.to_thread(self._compose_and_save, image_file, output_path)
+            finally:
+                image_file.close()
 
             logger.info(f"✅ AI generation successful for user {user_id}")
             return output_path
@@ -111,6 +157,90 @@ Keep it concise. Do not mention clothing or background.
             logger.error(f"❌ Error in AI generation for user {user_id}: {e}", exc_info=True)
             raise
 
+    async def describe_face(self, user_photo_path: Path, user_id: int, photo_bytes: bytes = None) -> str:
+        """
+        Get face description for photo from cache or Gemini 2.0.
+
+        Args:
+            user_photo_path: Path to user's uploaded photo
+            user_id: User ID (owner of the photo)
+            photo_bytes: Photo contents if already read (read from user_photo_path otherwise)
+
+        Returns:
+            Face description for the DALL-E prompt
+        """
+        logger.info(f"🤖 User {user_id}: Analyzing face with Gemini 2.0 Flash...")
+
+        if photo_bytes is None:
+            with open(user_photo_path, 'rb') as f:
+                photo_bytes = f.read()
+
+        # Сначала ищем описание в кэше (по SHA-256 и перцептивному хэшу)
+        sha256, phash = await asyncio.to_thread(photo_keys, photo_bytes)
+        description = await self.description_cache.get(sha256, phash, user_id)
+
+        if description is None:
+            # Просим Gemini описать внешность для DALL-E
+            b64_image = base64.b64encode(photo_bytes).decode('utf-8')
+            description = await self._ask_gemini(VISION_PROMPT, b64_image)
+            if description != FALLBACK_DESCRIPTION:
+                await self.description_cache.put(sha256, phash, user_id, description)
+            logger.info(f"✅ Gemini description: {description}")
+        else:
+            logger.info(f"✅ Cached Gemini description: {description}")
+
+        return description
+
+    def start_prewarm(self, user_id: int, user_photo_path: Path, gender: str) -> None:
+        """
+        Speculatively start Gemini analysis and build prompt skeleton.
+
+        Called as soon as the photo is accepted; generate_figurine() later
+        awaits the running task instead of calling Gemini itself.
+
+        Args:
+            user_id: User ID
+            user_photo_path: Path to user's uploaded photo
+            gender: Gender stored at gender selection
+        """
+        # The analysis uses the bytes read now, so it matches the hash even if
+        # the file is replaced by a newer upload before the task runs
+        with open(user_photo_path, 'rb') as f:
+            photo_bytes = f.read()
+        self.prewarm.start(
+            user_id,
+            hashlib.sha256(photo_bytes).hexdigest(),
+            gender,
+            describe=partial(self.describe_face, user_photo_path, user_id, photo_bytes),
+            prompt_skeleton=self._create_prompt_skeleton(gender)
+        )
+
+    def _compose_and_save(self, image_file: IO[bytes], output_path: Path) -> None:
+        """
+        Decode generated image, apply overlay and save as JPEG.
+
+        The image is decoded once straight into RGB and the precomputed
+        overlay for its size is pasted in place, so no RGBA copies of the
+        full frame are made and the overlay is never resized per request.
+
+        Args:
+            image_file: Downloaded image file (positioned at start)
+            output_path: Where to save the JPEG
+        """
+        with Image.open(image_file) as source:
+            image = source.convert('RGB') if source.mode != 'RGB' else source.copy()
+
+        # Накладываем overlay.png поверх результата (подготовлен заранее под размер)
+        try:
+            if self.overlay_compositor.apply(image):
+                logger.info(f"✅ Overlay applied")
+            else:
+                logger.warning(f"⚠️ Overlay not found at {self.overlay_compositor.overlay_path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to apply overlay: {e}")
+
+        image.save(output_path, "JPEG", quality=95)
+
     async def _ask_gemini(self, text: str, b64_img: str) -> str:
         """
         Send photo to Gemini 2.0 Flash for analysis.
@@ -135,30 +265,30 @@ Keep it concise. Do not mention clothing or background.
             }
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                self.gemini_url,
-                params={"key": self.google_key},
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=30)
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"Gemini API error: {error_text}")
-                    # ОБЯЗАТЕЛЬНО используем Gemini - без fallback
-                    raise Exception(f"Gemini API failed: {error_text}")
-
-                result = await response.json()
-                logger.info(f"Gemini response: {str(result)[:200]}...")
-
-                # Извлекаем текст ответа
-                try:
-                    return result['candidates'][0]['content']['parts'][0]['text'].strip()
-                except (KeyError, IndexError) as e:
-                    logger.error(f"Failed to parse Gemini response: {e}")
-                    return "A person with distinctive features"
-
-    async def _generate_with_dalle(self, prompt: str) -> Image.Image:
+        session = self._get_session()
+        async with session.post(
+            self.gemini_url,
+            params={"key": self.google_key},
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=30)
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"Gemini API error: {error_text}")
+                # ОБЯЗАТЕЛЬНО используем Gemini - без fallback
+                raise Exception(f"Gemini API failed: {error_text}")
+
+            result = await response.json()
+            logger.info(f"Gemini response: {str(result)[:200]}...")
+
+            # Извлекаем текст ответа
+            try:
+                return result['candidates'][0]['content']['parts'][0]['text'].strip()
+            except (KeyError, IndexError) as e:
+                logger.error(f"Failed to parse Gemini response: {e}")
+                return FALLBACK_DESCRIPTION
+
+    async def _generate_with_dalle(self, prompt: str) -> IO[bytes]:
         """
         Generate image using DALL-E 3.
 
@@ -166,7 +296,7 @@ Keep it concise. Do not mention clothing or background.
             prompt: Image generation prompt
 
         Returns:
-            PIL Image object
+            Temporary file with the downloaded image (caller closes it)
         """
         headers = {
             "Authorization": f"Bearer {self.openai_key}",
@@ -182,32 +312,57 @@ Keep it concise. Do not mention clothing or background.
             "n": 1
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                self.dalle_url,
-                headers=headers,
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=60)
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"DALL-E API error: {error_text}")
-                    raise Exception(f"DALL-E returned status {response.status}: {error_text}")
+        session = self._get_session()
+        async with session.post(
+            self.dalle_url,
+            headers=headers,
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=60)
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"DALL-E API error: {error_text}")
+                raise Exception(f"DALL-E returned status {response.status}: {error_text}")
+
+            result = await response.json()
+
+        # Скачиваем изображение по URL (соединение из того же пула)
+        image_url = result['data'][0]['url']
+        logger.info(f"Downloading image from DALL-E: {image_url}")
+
+        return await self._download_to_file(session, image_url)
 
-                result = await response.json()
+    async def _download_to_file(self, session: aiohttp.ClientSession, url: str) -> IO[bytes]:
+        """
+        Stream image from URL into a spooled temporary file.
 
-                # Скачиваем изображение по URL
-                image_url = result['data'][0]['url']
-                logger.info(f"Downloading image from DALL-E: {image_url}")
+        Chunks are written as they arrive, so the encoded image is never
+        held as one bytes object; large files spill to disk.
 
-                async with session.get(image_url) as img_response:
-                    img_data = await img_response.read()
-                    return Image.open(BytesIO(img_data))
+        Args:
+            session: HTTP session
+            url: Image URL
+
+        Returns:
+            Temporary file positioned at start (caller closes it)
+        """
+        image_file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_MAX_SIZE)
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=60)) as response:
+                if response.status != 200:
+                    raise Exception(f"Image download returned status {response.status}")
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    image_file.write(chunk)
+        except Exception:
+            image_file.close()
+            raise
+
+        image_file.seek(0)
+        return image_file
 
     def _create_dalle_prompt(self, gender: str, face_description: str) -> str:
         """
         Create detailed prompt for DALL-E based on Gemini's analysis.
-        Randomly selects one of 4 scene variations for variety.
 
         Args:
             gender: User's gender
@@ -216,6 +371,24 @@ Keep it concise. Do not mention clothing or background.
         Returns:
             Detailed prompt for DALL-E
         """
+        return self._fill_prompt(self._create_prompt_skeleton(gender), face_description)
+
+    @staticmethod
+    def _fill_prompt(prompt_skeleton: str, face_description: str) -> str:
+        """Insert Gemini's face description into prompt skeleton."""
+        return prompt_skeleton.replace(FACE_DESCRIPTION_MARKER, face_description)
+
+    def _create_prompt_skeleton(self, gender: str) -> str:
+        """
+        Create DALL-E prompt without the face description.
+        Randomly selects one of 4 scene variations for variety.
+
+        Args:
+            gender: User's gender
+
+        Returns:
+            Prompt with FACE_DESCRIPTION_MARKER in place of the description
+        """
         import random
 
         gender_clothing = {
@@ -265,7 +438,7 @@ Keep it concise. Do not mention clothing or background.
 A 3D stylized figurine in a magical Christmas scene.
 
 CHARACTER DETAILS (based on photo analysis):
-{face_description}
+{FACE_DESCRIPTION_MARKER}
 
 FIGURINE STYLE:
 - Gender: {gender}
@@ -0,0 +1,406 @@
+"""Rate-limited broadcast engine for mass sends to users."""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from config import settings
+from database.crud import BroadcastCRUD, UserCRUD
+from database.engine import async_session_maker
+from database.models import BroadcastCampaign
+
+logger = logging.getLogger(__name__)
+
+# Delivery outcomes
+PENDING = "pending"          # Not attempted yet
+SENT = "sent"
+BLOCKED = "blocked"          # User blocked the bot
+DEACTIVATED = "deactivated"  # Account deleted / chat no longer exists
+FAILED = "failed"            # Anything else
+RETRY_AFTER = "retry_after"  # Gave up after repeated flood waits
+
+UNREACHABLE_STATUSES = (BLOCKED, DEACTIVATED)
+RESUMABLE_STATUSES = (PENDING, RETRY_AFTER)  # Sent again when a campaign is resumed
+
+
+class TokenBucket:
+    """
+    Async token bucket shared by everything that sends messages in bulk.
+
+    Tokens refill at `rate` per second up to `capacity`. A flood wait from
+    Telegram pauses the whole bucket, since the limit is per bot, not per
+    sender task.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """Initialize bucket (starts full)."""
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        """Add tokens for time passed since last refill."""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Wait until one message may be sent."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds` (Telegram flood wait)."""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0
+        self._updated = max(now, self._paused_until)
+
+
+_send_limiter: Optional[TokenBucket] = None
+
+
+def get_send_limiter() -> TokenBucket:
+    """Get process-wide bucket for bulk sends (created on first call)."""
+    global _send_limiter
+    if _send_limiter is None:
+        _send_limiter = TokenBucket(settings.BROADCAST_RATE, settings.BROADCAST_BURST)
+    return _send_limiter
+
+
+def classify_error(error: Exception) -> str:
+    """Map Telegram API error of a send to a delivery status."""
+    text = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        return DEACTIVATED if "deactivated" in text else BLOCKED
+    if isinstance(error, TelegramBadRequest) and "chat not found" in text:
+        return DEACTIVATED
+    return FAILED
+
+
+@dataclass
+class BroadcastResult:
+    """Counters of a broadcast run."""
+    total: int = 0
+    sent: int = 0
+    blocked: int = 0
+    deactivated: int = 0
+    failed: int = 0
+    retry_after: int = 0
+    retries: int = 0  # Flood waits that were waited out
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+    unreachable_ids: List[int] = field(default_factory=list)
+
+    @property
+    def processed(self) -> int:
+        """Recipients with a final outcome."""
+        return self.sent + self.blocked + self.deactivated + self.failed + self.retry_after
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since start (or total duration when finished)."""
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Average processed recipients per second."""
+        return self.processed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def record(self, user_id: int, status: str) -> None:
+        """Count one final outcome."""
+        setattr(self, status, getattr(self, status) + 1)
+        if status in UNREACHABLE_STATUSES:
+            self.unreachable_ids.append(user_id)
+
+
+def copy_message_sender(bot: Bot, from_chat_id: int, message_id: int) -> Callable[[int], Awaitable[Any]]:
+    """Build send function that copies one admin message to a user."""
+    async def send(user_id: int) -> Any:
+        return await bot.copy_message(chat_id=user_id, from_chat_id=from_chat_id, message_id=message_id)
+    return send
+
+
+class Broadcaster:
+    """
+    Send one message to many users as fast as Telegram allows.
+
+    A pool of sender tasks shares a token bucket tuned just below the bot's
+    global limit (~30 msg/s). TelegramRetryAfter pauses the bucket for the
+    server-provided delay and the send is retried; blocked and deactivated
+    users are classified separately from other failures.
+    """
+
+    def __init__(
+        self,
+        limiter: TokenBucket = None,
+        workers: int = None,
+        max_retries: int = None,
+        progress_interval: float = None
+    ):
+        """
+        Initialize broadcaster.
+
+        Args:
+            limiter: Token bucket (defaults to the process-wide one)
+            workers: Concurrent sender tasks
+            max_retries: Flood-wait retries per recipient
+            progress_interval: Seconds between progress callbacks
+        """
+        self.limiter = limiter or get_send_limiter()
+        self.workers = workers or settings.BROADCAST_WORKERS
+        self.max_retries = max_retries if max_retries is not None else settings.BROADCAST_MAX_RETRIES
+        self.progress_interval = progress_interval or settings.BROADCAST_PROGRESS_INTERVAL
+
+    async def run(
+        self,
+        user_ids: Iterable[int],
+        send: Callable[[int], Awaitable[Any]],
+        on_progress: Callable[[BroadcastResult], Awaitable[None]] = None,
+        on_delivery: Callable[[int, str], Awaitable[None]] = None
+    ) -> BroadcastResult:
+        """
+        Deliver to all users.
+
+        Args:
+            user_ids: Recipients
+            send: Coroutine function sending the message to one user
+            on_progress: Called every progress_interval seconds with counters
+            on_delivery: Called with (user_id, status) for every recipient
+
+        Returns:
+            Final counters
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+
+        result = BroadcastResult(total=queue.qsize())
+        senders = [
+            asyncio.create_task(self._sender(queue, send, result, on_delivery))
+            for _ in range(min(self.workers, result.total))
+        ]
+        reporter = asyncio.create_task(self._report(result, on_progress)) if on_progress else None
+
+        try:
+            await asyncio.gather(*senders)
+        finally:
+            for task in senders:
+                task.cancel()
+            if reporter:
+                reporter.cancel()
+            result.finished_at = time.monotonic()
+
+        logger.info(
+            f"Broadcast finished in {result.elapsed:.1f}s ({result.rate:.1f} msg/s): "
+            f"{result.sent} sent, {result.blocked} blocked, {result.deactivated} deactivated, "
+            f"{result.failed} failed, {result.retry_after} deferred, {result.retries} flood waits"
+        )
+        return result
+
+    async def _sender(
+        self,
+        queue: asyncio.Queue,
+        send: Callable[[int], Awaitable[Any]],
+        result: BroadcastResult,
+        on_delivery: Optional[Callable[[int, str], Awaitable[None]]]
+    ) -> None:
+        """Take recipients from queue until it is empty."""
+        while True:
+            try:
+                user_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            status = await self._deliver(user_id, send, result)
+            result.record(user_id, status)
+            if on_delivery:
+                await on_delivery(user_id, status)
+
+    async def _deliver(
+        self,
+        user_id: int,
+        send: Callable[[int], Awaitable[Any]],
+        result: BroadcastResult
+    ) -> str:
+        """Send to one user, waiting out flood limits."""
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await send(user_id)
+                return SENT
+            except TelegramRetryAfter as e:
+                attempt += 1
+                result.retries += 1
+                self.limiter.pause(e.retry_after)
+                if attempt > self.max_retries:
+                    logger.warning(f"Broadcast to {user_id} gave up after {attempt} flood waits")
+                    return RETRY_AFTER
+                logger.warning(f"Flood wait {e.retry_after}s while sending to {user_id}")
+            except Exception as e:
+                status = classify_error(e)
+                if status == FAILED:
+                    logger.error(f"Failed to send broadcast to {user_id}: {e}")
+                return status
+
+    async def _report(
+        self,
+        result: BroadcastResult,
+        on_progress: Callable[[BroadcastResult], Awaitable[None]]
+    ) -> None:
+        """Call progress callback periodically."""
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            try:
+                await on_progress(result)
+            except Exception as e:
+                logger.warning(f"Broadcast progress update failed: {e}")
+
+
+class DeliveryLedger:
+    """
+    Buffer of delivery outcomes of one campaign, written to the DB in batches.
+
+    Blocked and deactivated recipients are also marked unreachable, so later
+    broadcasts do not spend the rate limit on them.
+
+    Outcomes still in the buffer when the process dies stay "pending" in the
+    ledger, so at most one batch can be sent twice after a resume. A failed
+    write keeps its outcomes in the buffer and is retried once another
+    batch has been recorded; sending goes on meanwhile.
+    """
+
+    def __init__(self, campaign_id: int, batch_size: int = None):
+        """Initialize ledger for campaign."""
+        self.campaign_id = campaign_id
+        self.batch_size = batch_size or settings.BROADCAST_LEDGER_BATCH
+        self._buffer: List[Tuple[int, str]] = []
+        self._flush_at = self.batch_size
+        self._lock = asyncio.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Outcomes not written yet."""
+        return len(self._buffer)
+
+    async def record(self, user_id: int, status: str) -> None:
+        """Add outcome; write the batch once it is full."""
+        self._buffer.append((user_id, status))
+        if len(self._buffer) >= self._flush_at:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write buffered outcomes (kept for the next flush if that fails)."""
+        async with self._lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            unreachable_ids = [user_id for user_id, status in batch if status in UNREACHABLE_STATUSES]
+            try:
+                async with async_session_maker() as session:
+                    await BroadcastCRUD.record_deliveries(session, self.campaign_id, batch)
+                    if unreachable_ids:
+                        await UserCRUD.mark_unreachable(session, unreachable_ids)
+            except asyncio.CancelledError:
+                self._buffer = batch + self._buffer
+                raise
+            except Exception as e:
+                self._buffer = batch + self._buffer
+                self._flush_at = len(self._buffer) + self.batch_size
+                logger.error(
+                    f"Broadcast campaign {self.campaign_id}: failed to record {len(batch)} deliveries, "
+                    f"will retry: {e}",
+                    exc_info=True
+                )
+                return
+            self._flush_at = self.batch_size
+
+    async def counts(self) -> Dict[str, int]:
+        """Flush and get number of recipients per status for the whole campaign."""
+        await self.flush()
+        async with async_session_maker() as session:
+            return await BroadcastCRUD.get_counts(session, self.campaign_id)
+
+
+# Campaigns being sent by this process (a resume must not start them twice)
+_running_campaigns: Set[int] = set()
+
+
+def is_campaign_running(campaign_id: int) -> bool:
+    """Check if campaign is being sent right now."""
+    return campaign_id in _running_campaigns
+
+
+async def run_campaign(
+    bot: Bot,
+    campaign: BroadcastCampaign,
+    on_progress: Callable[[Dict[str, int]], Awaitable[None]] = None,
+    broadcaster: Broadcaster = None
+) -> Dict[str, int]:
+    """
+    Send campaign to recipients not reached yet and record every outcome.
+
+    Works both for a new campaign and for one interrupted by a restart:
+    only deliveries in RESUMABLE_STATUSES are sent.
+
+    Args:
+        bot: Bot instance
+        campaign: Campaign to send
+        on_progress: Called periodically with per-status counts of the whole campaign
+        broadcaster: Broadcaster to use (default settings when omitted)
+
+    Returns:
+        Final per-status counts
+    """
+    if is_campaign_running(campaign.id):
+        raise RuntimeError(f"Broadcast campaign {campaign.id} is already running")
+
+    _running_campaigns.add(campaign.id)
+    ledger = DeliveryLedger(campaign.id)
+    try:
+        async with async_session_maker() as session:
+            user_ids = await BroadcastCRUD.get_user_ids(session, campaign.id, RESUMABLE_STATUSES)
+
+        logger.info(f"Broadcast campaign {campaign.id}: {len(user_ids)}/{campaign.total} recipients left")
+
+        async def report(_: BroadcastResult):
+            await on_progress(await ledger.counts())
+
+        await (broadcaster or Broadcaster()).run(
+            user_ids,
+            copy_message_sender(bot, campaign.from_chat_id, campaign.message_id),
+            on_progress=report if on_progress else None,
+            on_delivery=ledger.record
+        )
+
+        counts = await ledger.counts()
+        if ledger.pending:
+            # Left running: /resume_broadcast finds it, like after a crash
+            logger.error(
+                f"Broadcast campaign {campaign.id}: {ledger.pending} deliveries not recorded, "
+                f"campaign not marked done"
+            )
+            return counts
+        async with async_session_maker() as session:
+            await BroadcastCRUD.mark_done(session, campaign.id)
+        return counts
+    finally:
+        await ledger.flush()
+        _running_campaigns.discard(campaign.id)
@@ -0,0 +1,177 @@
+"""Timer that starts scheduled broadcasts from the scheduled_broadcasts table."""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional, Set
+
+from config import settings
+from database.crud import BroadcastCRUD, ScheduledBroadcastCRUD, UserCRUD
+from database.engine import async_session_maker, unit_of_work
+from database.models import BroadcastCampaign, ScheduledBroadcast
+
+logger = logging.getLogger(__name__)
+
+# Re-check the table at least this often (guards against system clock jumps)
+MAX_SLEEP = 3600.0
+# Pause before retrying after a database error
+ERROR_RETRY_DELAY = 30.0
+
+# Admins enter and see schedule times in this zone; run_at is stored as naive UTC
+SCHEDULE_TIMEZONE = timezone(timedelta(hours=settings.BROADCAST_SCHEDULE_UTC_OFFSET))
+
+
+def utc_now() -> datetime:
+    """Current time the way run_at is stored (naive UTC)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def to_run_at(local_time: datetime) -> datetime:
+    """Convert naive time entered in SCHEDULE_TIMEZONE to a run_at value."""
+    return local_time.replace(tzinfo=SCHEDULE_TIMEZONE).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def from_run_at(run_at: datetime) -> datetime:
+    """Convert run_at to SCHEDULE_TIMEZONE for display."""
+    return run_at.replace(tzinfo=timezone.utc).astimezone(SCHEDULE_TIMEZONE)
+
+
+class BroadcastScheduler:
+    """
+    Single timer task handing due scheduled broadcasts to the sender.
+
+    Sleeps until the nearest run_at in the table instead of polling; wake()
+    makes it re-read the schedule after a broadcast is added or cancelled.
+    Due broadcasts become campaigns, each sent in its own task, so a long
+    campaign doesn't hold back later schedules; all sends share the global
+    token bucket, so overlapping schedules never exceed the bot's rate
+    limit. Broadcasts that came due while the bot was down run right after
+    start(). Times are compared in UTC (see SCHEDULE_TIMEZONE).
+    """
+
+    def __init__(self, handler: Callable[..., Awaitable[None]]):
+        """
+        Initialize scheduler.
+
+        Args:
+            handler: Coroutine that sends a campaign and reports to chat_id
+                (keyword argument; None - to the campaign's admin)
+        """
+        self.handler = handler
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._campaigns: Set[asyncio.Task] = set()
+
+    async def resume(self) -> None:
+        """Return broadcasts claimed right before a restart to the schedule."""
+        async with async_session_maker() as session:
+            requeued = await ScheduledBroadcastCRUD.requeue_unstarted(session)
+        if requeued:
+            logger.info(f"Returned {requeued} interrupted scheduled broadcasts to the schedule")
+
+    def start(self) -> None:
+        """Start timer task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="broadcast-scheduler")
+            logger.info("Broadcast scheduler started")
+
+    async def stop(self) -> None:
+        """Cancel timer task and campaigns being sent (they stay resumable)."""
+        if self._task is None:
+            return
+        tasks = [self._task, *self._campaigns]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        logger.info("Broadcast scheduler stopped")
+
+    def wake(self) -> None:
+        """Re-read the schedule (call after adding or cancelling a broadcast)."""
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        """Start due broadcasts, then sleep until the next one."""
+        while True:
+            try:
+                async with async_session_maker() as session:
+                    due = await ScheduledBroadcastCRUD.claim_due(session, utc_now())
+            except Exception as e:
+                logger.error(f"Failed to claim scheduled broadcasts: {e}", exc_info=True)
+                await asyncio.sleep(ERROR_RETRY_DELAY)
+                continue
+
+            for job in due:
+                await self._start(job)
+
+            await self._sleep_until_next()
+
+    async def _sleep_until_next(self) -> None:
+        """Sleep until the nearest scheduled broadcast is due or wake() is called."""
+        try:
+            async with async_session_maker() as session:
+                next_run_at = await ScheduledBroadcastCRUD.get_next_run_at(session)
+        except Exception as e:
+            logger.error(f"Failed to read broadcast schedule: {e}", exc_info=True)
+            next_run_at = None
+
+        timeout = MAX_SLEEP
+        if next_run_at is not None:
+            timeout = min(MAX_SLEEP, max(0.0, (next_run_at - utc_now()).total_seconds()))
+
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _start(self, job: ScheduledBroadcast) -> None:
+        """Turn scheduled broadcast into a campaign and start sending it in a task."""
+        try:
+            # Campaign and its link to the job commit together: a job left
+            # without campaign_id is scheduled again by resume(), so a
+            # campaign created without the link would be sent twice
+            async with unit_of_work() as session:
+                if job.user_ids:
+                    user_ids = job.user_ids
+                else:
+                    users = await UserCRUD.get_users_by_filter(session, job.audience)
+                    user_ids = [user.id for user in users]
+
+                campaign = await BroadcastCRUD.create_campaign(
+                    session, job.admin_id, job.from_chat_id, job.message_id, user_ids
+                )
+                await ScheduledBroadcastCRUD.set_campaign(session, job.id, campaign.id)
+        except Exception as e:
+            logger.error(f"Failed to start scheduled broadcast {job.id}: {e}", exc_info=True)
+            # Otherwise the job stays claimed without a campaign until a restart requeues it
+            try:
+                async with async_session_maker() as session:
+                    await ScheduledBroadcastCRUD.mark_failed(session, job.id)
+            except Exception as e:
+                logger.error(f"Failed to mark scheduled broadcast {job.id} as failed: {e}", exc_info=True)
+            return
+
+        logger.info(
+            f"Scheduled broadcast {job.id} (due {job.run_at:%Y-%m-%d %H:%M} UTC) started "
+            f"as campaign {campaign.id} with {campaign.total} recipients"
+        )
+        self.send(campaign)
+
+    def send(self, campaign: BroadcastCampaign, chat_id: int = None) -> None:
+        """
+        Send committed campaign in its own task (stop() cancels it, it stays resumable).
+
+        Progress goes to chat_id, or to the admin who created the campaign.
+        """
+        task = asyncio.create_task(self._send(campaign, chat_id), name=f"broadcast-campaign-{campaign.id}")
+        self._campaigns.add(task)
+        task.add_done_callback(self._campaigns.discard)
+
+    async def _send(self, campaign: BroadcastCampaign, chat_id: int = None) -> None:
+        """Send campaign through the handler."""
+        try:
+            await self.handler(campaign, chat_id=chat_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast campaign {campaign.id} failed: {e}", exc_info=True)
@@ -0,0 +1,206 @@
+"""Streaming CSV export of quiz participants."""
+import csv
+import gzip
+import logging
+import tempfile
+import time
+from dataclasses import dataclass, field
+from io import StringIO
+from typing import IO, AsyncGenerator, List, Optional
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from bot.quiz_data import QUIZ_QUESTIONS
+from config import settings
+from database.crud import UserCRUD
+from database.engine import async_session_maker
+
+logger = logging.getLogger(__name__)
+
+EXPORT_HEADER = [
+    'ID', 'Username', 'Full Name', 'Gender', 'Quiz Completed',
+    'Photo Uploaded', 'Is Winner', 'Created At'
+]
+
+# zlib keeps some input buffered until the stream is closed, so the size of a
+# gzip part is only known up to this much; parts are cut that early
+GZIP_PENDING_MARGIN = 1024 * 1024
+
+
+class SpooledInputFile(InputFile):
+    """Upload a (spooled) temporary file in chunks without reading it into memory."""
+
+    def __init__(self, file: IO[bytes], filename: str, **kwargs):
+        """Initialize with an open binary file positioned at start."""
+        super().__init__(filename=filename, **kwargs)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        """Yield file contents chunk by chunk."""
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+@dataclass
+class ExportPart:
+    """One file of an export."""
+
+    filename: str
+    file: IO[bytes]
+    size: int
+    rows: int
+
+    def as_input_file(self) -> SpooledInputFile:
+        """Wrap part for answer_document()."""
+        return SpooledInputFile(self.file, filename=self.filename)
+
+
+@dataclass
+class ExportResult:
+    """Finished export: parts ready to send, total rows and time spent."""
+
+    parts: List[ExportPart] = field(default_factory=list)
+    rows: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def size(self) -> int:
+        """Total bytes in all parts."""
+        return sum(part.size for part in self.parts)
+
+    def close(self) -> None:
+        """Release temporary files."""
+        for part in self.parts:
+            part.file.close()
+
+
+class _PartWriter:
+    """Bytes sink for one part: spooled temporary file, optionally gzipped."""
+
+    def __init__(self, compress: bool):
+        """Open a new part."""
+        self.file = tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_SIZE)
+        self.gzip = gzip.GzipFile(fileobj=self.file, mode="wb") if compress else None
+        self.rows = 0
+
+    @property
+    def size(self) -> int:
+        """Bytes the part will take when closed (upper bound for gzip)."""
+        if self.gzip:
+            return self.file.tell() + GZIP_PENDING_MARGIN
+        return self.file.tell()
+
+    def write(self, data: bytes) -> None:
+        """Append encoded CSV data."""
+        (self.gzip or self.file).write(data)
+
+    def close(self) -> IO[bytes]:
+        """Finish the part, return its file positioned at start."""
+        if self.gzip:
+            self.gzip.close()  # Leaves the underlying file open
+        self.file.seek(0)
+        return self.file
+
+
+def _format_row(row) -> list:
+    """Turn a participant row into CSV values."""
+    return [
+        row.id,
+        row.username or '',
+        row.full_name or '',
+        row.gender or '',
+        'Да' if row.quiz_completed else 'Нет',
+        'Да' if row.photo_uploaded else 'Нет',
+        'Да' if row.is_winner else 'Нет',
+        row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else '',
+        *(answer or '' for answer in row[len(EXPORT_HEADER):]),
+    ]
+
+
+async def export_participants(
+    compress: Optional[bool] = None,
+    part_max_bytes: Optional[int] = None,
+    fetch_size: Optional[int] = None
+) -> ExportResult:
+    """
+    Export quiz participants with their answers to CSV.
+
+    One joined query is streamed from the database; rows are written to
+    spooled temporary files as they arrive, so memory use does not grow
+    with the number of users. A part is closed before it would exceed
+    part_max_bytes and the next one starts with its own header. Every part
+    is UTF-8 with BOM (for Excel), gzipped as a whole if compress is set.
+
+    Args:
+        compress: Gzip parts (defaults to settings.EXPORT_GZIP)
+        part_max_bytes: Size limit of one part (defaults to settings.EXPORT_PART_MAX_BYTES)
+        fetch_size: Rows per fetch from the cursor (defaults to settings.EXPORT_FETCH_SIZE)
+
+    Returns:
+        ExportResult (caller sends the parts and closes it)
+    """
+    compress = settings.EXPORT_GZIP if compress is None else compress
+    part_max_bytes = part_max_bytes or settings.EXPORT_PART_MAX_BYTES
+    fetch_size = fetch_size or settings.EXPORT_FETCH_SIZE
+
+    question_numbers = sorted(QUIZ_QUESTIONS)
+    header = EXPORT_HEADER + [f"Q{number}" for number in question_numbers]
+
+    line = StringIO()
+    writer = csv.writer(line)
+
+    def encode(values: list, encoding: str = 'utf-8') -> bytes:
+        line.seek(0)
+        line.truncate()
+        writer.writerow(values)
+        return line.getvalue().encode(encoding)
+
+    header_bytes = encode(header, 'utf-8-sig')  # BOM for Excel, once per part
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    extension = "csv.gz" if compress else "csv"
+
+    start = time.perf_counter()
+    result = ExportResult()
+    finished: List[_PartWriter] = []
+    part = _PartWriter(compress)
+    part.write(header_bytes)
+
+    try:
+        async with async_session_maker() as session:
+            rows = await UserCRUD.stream_participants_with_answers(session, question_numbers, fetch_size)
+            async for batch in rows.partitions():
+                for row in batch:
+                    data = encode(_format_row(row))
+                    if part.rows and part.size + len(data) > part_max_bytes:
+                        finished.append(part)
+                        part = _PartWriter(compress)
+                        part.write(header_bytes)
+                    part.write(data)
+                    part.rows += 1
+                    result.rows += 1
+        finished.append(part)
+    except Exception:
+        for writer_part in finished + [part]:
+            writer_part.file.close()
+        raise
+
+    total = len(finished)
+    for index, writer_part in enumerate(finished, start=1):
+        file = writer_part.close()
+        suffix = f"_part{index}of{total}" if total > 1 else ""
+        result.parts.append(ExportPart(
+            filename=f"pride34_bot_export_{stamp}{suffix}.{extension}",
+            file=file,
+            size=file.seek(0, 2),
+            rows=writer_part.rows,
+        ))
+        file.seek(0)
+
+    result.elapsed = time.perf_counter() - start
+    logger.info(
+        f"Exported {result.rows} participants to {total} part(s), "
+        f"{result.size} bytes in {result.elapsed:.2f}s"
+    )
+    return result
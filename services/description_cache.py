@@ -0,0 +1,134 @@
+"""Content-addressed cache of Gemini face descriptions."""
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+from config import settings
+from database.crud import FaceDescriptionCRUD
+from database.engine import async_session_maker
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # 8x8 difference hash = 64 bits
+
+# Cache hits are counted in memory and written to the database when this
+# many entries were used or this many seconds passed, not on every read
+USES_FLUSH_ENTRIES = 100
+USES_FLUSH_INTERVAL = 300.0
+
+
+def perceptual_hash(image_bytes: bytes) -> str:
+    """
+    Compute 64-bit difference hash (dHash) of an image.
+
+    The hash survives re-encoding and resizing, so the same photo sent
+    again through Telegram maps to the same key.
+
+    Args:
+        image_bytes: Encoded image
+
+    Returns:
+        16-char hex string
+    """
+    with Image.open(BytesIO(image_bytes)) as img:
+        img.draft("L", (HASH_SIZE * 16, HASH_SIZE * 16))  # Fast JPEG downscale on decode
+        small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+
+    pixels = small.load()
+    value = 0
+    for y in range(HASH_SIZE):
+        for x in range(HASH_SIZE):
+            value = (value << 1) | (pixels[x, y] > pixels[x + 1, y])
+    return f"{value:016x}"
+
+
+def photo_keys(image_bytes: bytes) -> Tuple[str, str]:
+    """Get (sha256, perceptual hash) cache keys for uploaded photo bytes."""
+    return hashlib.sha256(image_bytes).hexdigest(), perceptual_hash(image_bytes)
+
+
+class DescriptionCache:
+    """
+    SQLite-backed cache of Gemini face descriptions with TTL and LRU eviction.
+
+    A retry after a DALL-E failure or a re-upload of the same photo skips
+    the Gemini vision round-trip. Lookups are read-only: hits and last use
+    of entries (for LRU eviction) are collected in memory and written in
+    batches. Hit/miss counters are kept per process.
+    """
+
+    def __init__(self, ttl_hours: int = None, max_entries: int = None):
+        """Initialize cache."""
+        self.ttl = timedelta(hours=ttl_hours or settings.DESCRIPTION_CACHE_TTL_HOURS)
+        self.max_entries = max_entries or settings.DESCRIPTION_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        # entry ID -> (hits, last used) not written yet
+        self._uses: Dict[int, Tuple[int, datetime]] = {}
+        self._uses_flushed_at = time.monotonic()
+
+    async def get(self, sha256: str, phash: str, user_id: int) -> Optional[str]:
+        """
+        Get cached description of user's photo.
+
+        Returns:
+            Description or None on miss (or cache error)
+        """
+        try:
+            async with async_session_maker() as session:
+                entry = await FaceDescriptionCRUD.get(session, sha256, phash, user_id, self.ttl)
+        except Exception as e:
+            logger.warning(f"Description cache lookup failed: {e}")
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        hits, _ = self._uses.get(entry.id, (0, None))
+        self._uses[entry.id] = (hits + 1, datetime.utcnow())
+        if (len(self._uses) >= USES_FLUSH_ENTRIES
+                or time.monotonic() - self._uses_flushed_at >= USES_FLUSH_INTERVAL):
+            await self.flush_uses()
+
+        logger.info(f"Description cache hit (phash={phash}, total hits={self.hits})")
+        return entry.description
+
+    async def put(self, sha256: str, phash: str, user_id: int, description: str) -> None:
+        """Store description of user's photo (and pending uses, before LRU eviction)."""
+        await self.flush_uses()
+        try:
+            async with async_session_maker() as session:
+                await FaceDescriptionCRUD.put(session, sha256, phash, user_id, description, self.max_entries)
+        except Exception as e:
+            logger.warning(f"Failed to store description in cache: {e}")
+
+    async def flush_uses(self) -> None:
+        """Write collected hits; on failure they are kept for the next flush."""
+        self._uses_flushed_at = time.monotonic()
+        if not self._uses:
+            return
+        uses, self._uses = self._uses, {}
+        try:
+            async with async_session_maker() as session:
+                await FaceDescriptionCRUD.record_uses(session, uses)
+        except Exception as e:
+            logger.warning(f"Failed to record description cache hits: {e}")
+            for entry_id, (hits, last_used_at) in uses.items():
+                newer_hits, newer_used_at = self._uses.get(entry_id, (0, last_used_at))
+                self._uses[entry_id] = (hits + newer_hits, newer_used_at)
+
+    def stats(self) -> Dict[str, float]:
+        """Get hit/miss counters and hit rate."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -1,25 +1,24 @@
 """Face swapping service using OpenCV with Seamless Cloning for realistic face replacement."""
 import logging
 from pathlib import Path
+from typing import Optional
 from PIL import Image
 import cv2
 import numpy as np
 
+from services.image_assets import ImageAssets, get_image_assets
+
 logger = logging.getLogger(__name__)
 
 
 class FaceSwapper:
     """Swap faces on generated figurines using advanced face detection and Poisson Blending."""
 
-    def __init__(self):
+    def __init__(self, assets: Optional[ImageAssets] = None):
         """Initialize face swapper with frontal and profile cascades."""
-        cv_data = cv2.data.haarcascades
-        self.frontal_cascade = cv2.CascadeClassifier(
-            cv_data + 'haarcascade_frontalface_default.xml'
-        )
-        self.profile_cascade = cv2.CascadeClassifier(
-            cv_data + 'haarcascade_profileface.xml'
-        )
+        assets = assets or get_image_assets()
+        self.frontal_cascade = assets.frontal_cascade
+        self.profile_cascade = assets.profile_cascade
 
         if self.frontal_cascade.empty():
             logger.error("Failed to load frontal face cascade")
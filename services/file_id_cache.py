@@ -0,0 +1,140 @@
+"""Cache of Telegram file_ids for local files, so each file is uploaded once."""
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from database.crud import TelegramFileCRUD
+from database.engine import async_session_maker, session_scope
+
+logger = logging.getLogger(__name__)
+
+# Hot entries (welcome image, just generated cards) kept in memory
+MEMORY_CACHE_SIZE = 1024
+
+# Bad Request descriptions meaning the cached file_id itself is no good
+# (other errors, e.g. a too long caption, would fail an upload the same way)
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference")
+
+
+def is_file_id_error(error: TelegramBadRequest) -> bool:
+    """Check if Telegram rejected the file_id (not the rest of the request)."""
+    message = error.message.lower().replace("_", " ")  # FILE_REFERENCE_EXPIRED
+    return any(text in message for text in FILE_ID_ERRORS)
+
+
+class FileIdCache:
+    """
+    Map local file (path + mtime) to the file_id Telegram returned for it.
+
+    The first send uploads the file with FSInputFile; later sends, to any
+    chat, reuse the file_id. Entries live in the telegram_files table with
+    a small in-memory LRU in front. Editing or regenerating a file changes
+    its mtime, so the next send uploads the new version.
+    """
+
+    def __init__(self, memory_size: int = MEMORY_CACHE_SIZE):
+        """Initialize cache."""
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+
+    @staticmethod
+    def _key(path: Path) -> Tuple[str, int]:
+        """Get (resolved path, mtime_ns) of file."""
+        path = Path(path).resolve()
+        return str(path), path.stat().st_mtime_ns
+
+    def _remember_in_memory(self, key: str, mtime_ns: int, file_id: str) -> None:
+        """Put entry into in-memory LRU."""
+        self._memory[key] = (mtime_ns, file_id)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def get(self, path: Path) -> Optional[str]:
+        """
+        Get file_id for current version of file.
+
+        Returns:
+            file_id or None if this version was never uploaded
+        """
+        key, mtime_ns = self._key(path)
+
+        cached = self._memory.get(key)
+        if cached is not None and cached[0] == mtime_ns:
+            self._memory.move_to_end(key)
+            return cached[1]
+
+        try:
+            async with async_session_maker() as session:
+                file_id = await TelegramFileCRUD.get(session, key, mtime_ns)
+        except Exception as e:
+            logger.warning(f"File id cache lookup failed for {key}: {e}")
+            return None
+
+        if file_id is not None:
+            self._remember_in_memory(key, mtime_ns, file_id)
+        return file_id
+
+    async def remember(self, path: Path, file_id: str) -> None:
+        """Store file_id for current version of file."""
+        key, mtime_ns = self._key(path)
+        self._remember_in_memory(key, mtime_ns, file_id)
+        try:
+            async with session_scope() as session:
+                await TelegramFileCRUD.put(session, key, mtime_ns, file_id)
+        except Exception as e:
+            logger.warning(f"Failed to store file id for {key}: {e}")
+
+    async def forget(self, path: Path) -> None:
+        """Drop file_id of file (e.g. Telegram rejected it)."""
+        key = str(Path(path).resolve())
+        self._memory.pop(key, None)
+        try:
+            async with session_scope() as session:
+                await TelegramFileCRUD.delete(session, key)
+        except Exception as e:
+            logger.warning(f"Failed to forget file id for {key}: {e}")
+
+    async def send_photo(self, bot: Bot, chat_id: int, path: Path, **kwargs) -> Message:
+        """
+        Send local photo by cached file_id, uploading it only the first time.
+
+        Args:
+            bot: Bot instance
+            chat_id: Target chat
+            path: Local image file
+            **kwargs: Other Bot.send_photo arguments (caption, reply_markup, ...)
+
+        Returns:
+            Sent message
+        """
+        file_id = await self.get(path)
+        if file_id is not None:
+            try:
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                logger.warning(f"Cached file id for {path} rejected, uploading again: {e}")
+                await self.forget(path)
+
+        message = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(path), **kwargs)
+        if message.photo:
+            await self.remember(path, message.photo[-1].file_id)
+        return message
+
+
+_file_id_cache: Optional[FileIdCache] = None
+
+
+def get_file_id_cache() -> FileIdCache:
+    """Get process-wide FileIdCache instance (created on first call)."""
+    global _file_id_cache
+    if _file_id_cache is None:
+        _file_id_cache = FileIdCache()
+    return _file_id_cache
@@ -2,9 +2,9 @@
 import logging
 from pathlib import Path
 from aiogram import Bot
-from aiogram.types import FSInputFile
 from config import settings
 from bot.quiz_data import QUIZ_QUESTIONS
+from services.file_id_cache import get_file_id_cache
 
 logger = logging.getLogger(__name__)
 
@@ -136,13 +136,15 @@ class ForumService:
                 text=quiz_answers_text
             )
 
-            # Send original user photo
+            # Send original user photo (file_id known from upload, generated card
+            # was just sent to the user - neither is uploaded again)
+            file_id_cache = get_file_id_cache()
             if user_photo_path.exists():
-                photo = FSInputFile(user_photo_path)
-                await bot.send_photo(
-                    chat_id=settings.FORUM_GROUP_ID,
+                await file_id_cache.send_photo(
+                    bot,
+                    settings.FORUM_GROUP_ID,
+                    user_photo_path,
                     message_thread_id=topic_id,
-                    photo=photo,
                     caption="📸 <b>Оригинальное фото пользователя</b>"
                 )
             else:
@@ -150,11 +152,11 @@ class ForumService:
 
             # Send generated Christmas card
             if generated_photo_path.exists():
-                generated_photo = FSInputFile(generated_photo_path)
-                await bot.send_photo(
-                    chat_id=settings.FORUM_GROUP_ID,
+                await file_id_cache.send_photo(
+                    bot,
+                    settings.FORUM_GROUP_ID,
+                    generated_photo_path,
                     message_thread_id=topic_id,
-                    photo=generated_photo,
                     caption="🎄 <b>Сгенерированная открытка</b>"
                 )
             else:
@@ -0,0 +1,270 @@
+"""
+Persistent FSM storage.
+
+The default aiogram MemoryStorage keeps every conversation ever started
+in RAM until restart, and a restart loses all quiz progress.
+DatabaseStorage keeps states in the fsm_records table instead: rows are
+loaded when a user writes to the bot, only a bounded number of recent
+keys stays in memory, and states idle for longer than the TTL are
+ignored and purged.
+
+Data dicts are stored as compact JSON, zlib-compressed when that makes
+them smaller, instead of a binary format such as msgpack: that would be
+a new dependency, pickle would run code from a database row, and for
+large states (recipient ID lists) deflated JSON is already smaller than
+uncompressed msgpack.
+Values must therefore be JSON types (as with aiogram's RedisStorage).
+"""
+import asyncio
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+
+from config import settings
+from database.crud import FsmCRUD
+from database.engine import async_session_maker, current_unit_of_work, session_scope
+
+logger = logging.getLogger(__name__)
+
+# Encoded data: one format byte, then the body
+FORMAT_JSON = b"j"
+FORMAT_ZLIB = b"z"
+# Shorter JSON is not worth compressing
+COMPRESS_MIN_BYTES = 128
+
+# (state, encoded data, updated_at); all None if the key has nothing stored
+_Record = Tuple[Optional[str], Optional[bytes], Optional[datetime]]
+_EMPTY: _Record = (None, None, None)
+
+# session.info key: (storage, key) written in the current transaction
+_FSM_WRITTEN = "fsm_written"
+
+
+def encode_data(data: Dict[str, Any]) -> Optional[bytes]:
+    """Encode FSM data (None if empty)."""
+    if not data:
+        return None
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(raw)
+        if len(packed) < len(raw):
+            return FORMAT_ZLIB + packed
+    return FORMAT_JSON + raw
+
+
+def decode_data(blob: Optional[bytes]) -> Dict[str, Any]:
+    """Decode FSM data stored by encode_data."""
+    if not blob:
+        return {}
+    body = blob[1:]
+    if blob[:1] == FORMAT_ZLIB:
+        body = zlib.decompress(body)
+    return json.loads(body)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_fsm_written(session: Session):
+    """Committed states stay cached."""
+    session.info.pop(_FSM_WRITTEN, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _evict_fsm_written(session: Session):
+    """Drop cached states whose write was rolled back (with a handler's unit of work)."""
+    for storage, key in session.info.pop(_FSM_WRITTEN, []):
+        storage._cache.pop(key, None)
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    FSM storage in the bot database with a bounded cache of recent keys.
+
+    In a handler every write goes to the database with the update's unit
+    of work, so states survive restarts. Outside one (services, scripts)
+    writes are buffered per key and committed together by a flush started
+    on the next event loop iteration: set_state followed by update_data is
+    one upsert and one commit, not two. close() writes what is left.
+
+    Reads are served from the buffer and the cache, which also remembers
+    keys without a state (most updates come from users who are not in a
+    conversation). A key whose last write is older than ttl reads as
+    empty, and such rows are deleted at most every purge_interval seconds.
+    """
+
+    def __init__(
+        self,
+        ttl: timedelta = None,
+        max_cached: int = None,
+        purge_interval: float = None,
+        session_maker: async_sessionmaker = None
+    ):
+        """Initialize storage."""
+        self.ttl = ttl or timedelta(hours=settings.FSM_STATE_TTL_HOURS)
+        self.max_cached = max_cached or settings.FSM_CACHE_MAX_ENTRIES
+        self.purge_interval = settings.FSM_PURGE_INTERVAL if purge_interval is None else purge_interval
+        self.session_maker = session_maker or async_session_maker
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._pending: Dict[str, _Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._last_purge = 0.0
+        self._purge_task: Optional[asyncio.Task] = None
+
+    def _remember(self, key: str, record: _Record) -> None:
+        """Put record into cache, dropping the least recently used over the limit."""
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    async def _load(self, storage_key: StorageKey) -> Tuple[str, _Record]:
+        """Get (key, record) from cache or database; idle records read as empty."""
+        key = self.key_builder.build(storage_key)
+        record = self._pending.get(key) or self._cache.get(key)
+        if record is None:
+            async with self.session_maker() as session:
+                row = await FsmCRUD.get(session, key)
+            # A write that finished meanwhile is newer than the row read
+            record = self._cache.get(key) or ((row.state, row.data, row.updated_at) if row else _EMPTY)
+        self._remember(key, record)
+
+        updated_at = record[2]
+        if updated_at is not None and updated_at < datetime.utcnow() - self.ttl:
+            return key, _EMPTY
+        return key, record
+
+    async def _write(self, key: str, state: Optional[str], data: Optional[bytes]) -> None:
+        """
+        Store state and data of key.
+
+        In a unit of work the cache is updated only after the database
+        accepted the write; if the transaction rolls back later, the key is
+        evicted and read again from the database. Outside one the write is
+        buffered for flush().
+        """
+        updated_at = datetime.utcnow()
+        if current_unit_of_work() is None:
+            self._pending[key] = (state, data, updated_at)
+            self._remember(key, (state, data, updated_at) if state is not None or data is not None else _EMPTY)
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.create_task(self.flush(), name="fsm-flush")
+            return
+
+        # The unit of work's write is newer than a buffered one of the key
+        self._pending.pop(key, None)
+        try:
+            # In a handler this is the update's unit of work (one writing connection per task)
+            async with session_scope(self.session_maker) as session:
+                session.info.setdefault(_FSM_WRITTEN, []).append((self, key))
+                await FsmCRUD.put(session, key, state, data, updated_at)
+        except BaseException:
+            self._cache.pop(key, None)
+            raise
+        self._remember(key, (state, data, updated_at) if state is not None or data is not None else _EMPTY)
+        self._schedule_purge()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        """Set state for key."""
+        key, (_, data, _) = await self._load(key)
+        await self._write(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        """Get state of key."""
+        _, (state, _, _) = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        """Replace data of key."""
+        key, (state, _, _) = await self._load(key)
+        await self._write(key, state, encode_data(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        """Get data of key (a new dict on every call)."""
+        _, (_, data, _) = await self._load(key)
+        return decode_data(data)
+
+    async def flush(self) -> None:
+        """
+        Commit buffered writes in one transaction.
+
+        If that fails the writes stay buffered (unless the key was written
+        again meanwhile) for the next flush.
+        """
+        # One batch at a time, so an older write never commits after a newer one
+        async with self._flush_lock:
+            # Writes buffered while a batch is being committed go in the next one
+            while self._pending:
+                batch, self._pending = self._pending, {}
+                try:
+                    async with self.session_maker() as session:
+                        await FsmCRUD.put_many(session, batch)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} FSM states: {e}", exc_info=True)
+                    self._pending = {**batch, **self._pending}
+                    return
+                self._schedule_purge()
+
+    def _schedule_purge(self) -> None:
+        """Start purge in the background if purge_interval has passed."""
+        now = time.monotonic()
+        if now - self._last_purge < self.purge_interval:
+            return
+        if self._purge_task is not None and not self._purge_task.done():
+            return
+        self._last_purge = now
+        self._purge_task = asyncio.create_task(self.purge(), name="fsm-purge")
+
+    async def purge(self) -> int:
+        """Delete states idle for longer than ttl."""
+        try:
+            async with self.session_maker() as session:
+                deleted = await FsmCRUD.delete_idle(session, datetime.utcnow() - self.ttl)
+        except Exception as e:
+            logger.error(f"Failed to purge idle FSM states: {e}", exc_info=True)
+            return 0
+        if deleted:
+            logger.info(f"Purged {deleted} FSM states idle for over {self.ttl}")
+        return deleted
+
+    async def close(self) -> None:
+        """Write buffered states and wait for a running purge (the engine is closed elsewhere)."""
+        await self.flush()
+        if self._pending:
+            logger.error(f"FSM storage: {len(self._pending)} states not written on shutdown")
+        if self._purge_task is not None:
+            await asyncio.gather(self._purge_task, return_exceptions=True)
+            self._purge_task = None
+
+
+def build_fsm_storage() -> BaseStorage:
+    """
+    Create FSM storage selected by settings.FSM_STORAGE.
+
+    - 'database': DatabaseStorage in the bot database (default)
+    - 'redis': aiogram RedisStorage at FSM_REDIS_URL (needs the redis package)
+    - 'memory': aiogram MemoryStorage (lost on restart)
+    """
+    if settings.FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if settings.FSM_STORAGE == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis requires the redis package (pip install redis)") from e
+        ttl = timedelta(hours=settings.FSM_STATE_TTL_HOURS)
+        return RedisStorage.from_url(settings.FSM_REDIS_URL, state_ttl=ttl, data_ttl=ttl)
+    if settings.FSM_STORAGE == "database":
+        return DatabaseStorage()
+    raise ValueError(f"Unknown FSM_STORAGE: {settings.FSM_STORAGE}")
@@ -0,0 +1,132 @@
+"""Per-user registry of speculative Gemini analysis started at photo upload."""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PrewarmedGeneration:
+    """Work started for one uploaded photo before its job reaches a worker."""
+    photo_sha256: str  # Uploads always overwrite the same path, so the photo is known by its bytes
+    gender: str
+    prompt_skeleton: str
+    description: asyncio.Task
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class PrewarmRegistry:
+    """
+    Running Gemini analysis tasks keyed by user.
+
+    One entry per user: a new upload or /start cancels the previous task,
+    so abandoned sessions don't keep spending API calls. Entries that were
+    never taken expire after ttl seconds. At most max_in_flight speculative
+    Gemini calls run at the same time.
+    """
+
+    def __init__(self, max_in_flight: int = None, ttl: float = None):
+        """Initialize registry."""
+        self.max_in_flight = max_in_flight or settings.GENERATION_PREWARM_MAX_IN_FLIGHT
+        self.ttl = ttl or settings.GENERATION_PREWARM_TTL
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._entries: Dict[int, PrewarmedGeneration] = {}
+
+    def start(
+        self,
+        user_id: int,
+        photo_sha256: str,
+        gender: str,
+        describe: Callable[[], Awaitable[str]],
+        prompt_skeleton: str
+    ) -> None:
+        """
+        Start speculative analysis for user, replacing any previous one.
+
+        Args:
+            user_id: User ID
+            photo_sha256: SHA-256 of the uploaded photo the analysis is for
+            gender: Gender the prompt skeleton was built for
+            describe: Coroutine factory that returns the face description
+            prompt_skeleton: DALL-E prompt without the description
+        """
+        self.cancel(user_id)
+        self._drop_expired()
+
+        task = asyncio.create_task(self._run(describe), name=f"prewarm-{user_id}")
+        task.add_done_callback(self._log_failure)
+        self._entries[user_id] = PrewarmedGeneration(
+            photo_sha256=photo_sha256,
+            gender=gender,
+            prompt_skeleton=prompt_skeleton,
+            description=task
+        )
+        logger.info(f"🔥 Prewarm started for user {user_id} ({len(self._entries)} active)")
+
+    def take(self, user_id: int, photo_sha256: str, gender: str) -> Optional[PrewarmedGeneration]:
+        """
+        Remove and return user's entry if it matches the job being processed.
+
+        The photo is compared by content: a prewarm of a photo that was
+        replaced since (same path) is stale.
+
+        Returns:
+            Entry to await, or None if there is none (or it is stale)
+        """
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return None
+
+        if entry.photo_sha256 != photo_sha256 or entry.gender != gender or self._is_expired(entry):
+            entry.description.cancel()
+            return None
+        return entry
+
+    def cancel(self, user_id: int) -> bool:
+        """
+        Cancel user's speculative analysis.
+
+        Returns:
+            True if there was something to cancel
+        """
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return False
+
+        if not entry.description.done():
+            entry.description.cancel()
+            logger.info(f"🧊 Prewarm cancelled for user {user_id}")
+        return True
+
+    async def cancel_all(self) -> None:
+        """Cancel all running tasks (on shutdown)."""
+        tasks = [entry.description for entry in self._entries.values()]
+        self._entries.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, describe: Callable[[], Awaitable[str]]) -> str:
+        """Run analysis within the in-flight limit."""
+        async with self._slots:
+            return await describe()
+
+    def _is_expired(self, entry: PrewarmedGeneration) -> bool:
+        """Check if entry outlived its TTL."""
+        return time.monotonic() - entry.created_at > self.ttl
+
+    def _drop_expired(self) -> None:
+        """Forget entries that were never taken."""
+        for user_id in [uid for uid, entry in self._entries.items() if self._is_expired(entry)]:
+            self._entries.pop(user_id).description.cancel()
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        """Retrieve task exception so failures of untaken tasks are logged once."""
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ Prewarm {task.get_name()} failed: {task.exception()}")
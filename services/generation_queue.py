@@ -0,0 +1,301 @@
+"""Bounded, restart-safe queue with worker pool for photo → figurine generation."""
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Set
+
+from config import settings
+from database.crud import GenerationJobCRUD
+from database.engine import after_commit, async_session_maker, session_scope
+from database.models import GenerationJob
+
+logger = logging.getLogger(__name__)
+
+# Safety net: idle workers re-check the table this often even without a wakeup
+IDLE_POLL_INTERVAL = 5.0
+
+
+class QueueFullError(Exception):
+    """Raised when the generation queue reached its depth limit."""
+
+
+class DuplicateJobError(Exception):
+    """Raised when user already has a queued or running generation job."""
+
+
+class GenerationQueue:
+    """
+    Fixed-size asyncio worker pool draining the generation_jobs table.
+
+    Handlers submit jobs (a row in generation_jobs) and return immediately.
+    Workers claim rows with one atomic UPDATE ... RETURNING, so several
+    workers never process the same job. At most max_in_flight jobs call the
+    AI APIs at the same time, at most max_depth jobs wait in line, and each
+    user can have only one job queued or running. A failed job goes back
+    in line after GENERATION_RETRY_DELAY seconds (times the attempt) until
+    it used GENERATION_MAX_ATTEMPTS; then it is marked failed and the user
+    is told. Jobs interrupted by a restart are picked up again by resume().
+
+    A handler that has to save files before it can submit reserves the
+    user's place first (reserve(), then submit() or release()), so a second
+    upload can't overwrite the photo of a job already in line.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[GenerationJob], Awaitable[None]],
+        on_abandoned: Optional[Callable[[GenerationJob], Awaitable[None]]] = None,
+        workers: int = None,
+        max_in_flight: int = None,
+        max_depth: int = None
+    ):
+        """
+        Initialize generation queue.
+
+        Args:
+            handler: Coroutine that runs the whole pipeline for one job
+                (should raise on failure so the job is retried)
+            on_abandoned: Coroutine that tells the user about a job given up
+                after GENERATION_MAX_ATTEMPTS failed or interrupted attempts
+            workers: Number of worker tasks
+            max_in_flight: Max jobs processed concurrently
+            max_depth: Max jobs waiting in the queue
+        """
+        self.handler = handler
+        self.on_abandoned = on_abandoned
+        self.workers_count = workers or settings.GENERATION_WORKERS
+        self.max_in_flight = max_in_flight or settings.GENERATION_MAX_IN_FLIGHT
+        self.max_depth = max_depth or settings.GENERATION_QUEUE_MAX_DEPTH
+
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._active_users: Set[int] = set()
+        self._reserved: Set[int] = set()
+        self._workers: List[asyncio.Task] = []
+        self._retries: Set[asyncio.Task] = set()
+        self._running = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting in the queue."""
+        return max(0, len(self._active_users) - self._running)
+
+    @property
+    def running(self) -> int:
+        """Number of jobs being processed right now."""
+        return self._running
+
+    def is_active(self, user_id: int) -> bool:
+        """Check if user has a queued or running job."""
+        return user_id in self._active_users
+
+    def reserve(self, user_id: int) -> None:
+        """
+        Hold a place in the queue for user until submit() or release().
+
+        Raises:
+            DuplicateJobError: User already has a job (or a reservation) in the queue
+            QueueFullError: Queue depth limit reached
+        """
+        if user_id in self._active_users:
+            raise DuplicateJobError(f"User {user_id} already has a generation job")
+        if self.depth >= self.max_depth:
+            raise QueueFullError(f"Generation queue is full ({self.max_depth} jobs)")
+        self._active_users.add(user_id)
+        self._reserved.add(user_id)
+
+    def release(self, user_id: int) -> None:
+        """Give up user's reservation if it was not submitted (no-op otherwise)."""
+        if user_id in self._reserved:
+            self._reserved.discard(user_id)
+            self._active_users.discard(user_id)
+
+    async def submit(
+        self,
+        user_id: int,
+        chat_id: int,
+        file_path: str,
+        gender: str,
+        answers: list,
+        has_premium: bool = False,
+        processing_message_id: int | None = None
+    ) -> int:
+        """
+        Persist a new job and wake up a worker once it is committed.
+
+        The job is written in the caller's unit of work, if any (see
+        session_scope), so it is only claimed once the update commits and
+        disappears with it if the update fails. Uses user's reservation if
+        reserve() was called, otherwise takes a place in the queue the same way.
+
+        Returns:
+            Position in line (0 means a worker is free and will start right away)
+
+        Raises:
+            DuplicateJobError: User already has a job in the queue
+            QueueFullError: Queue depth limit reached
+        """
+        if user_id in self._reserved:
+            self._reserved.discard(user_id)
+        else:
+            self.reserve(user_id)
+            self._reserved.discard(user_id)
+
+        try:
+            async with session_scope() as session:
+                job = await GenerationJobCRUD.create(
+                    session,
+                    user_id=user_id,
+                    chat_id=chat_id,
+                    file_path=file_path,
+                    gender=gender,
+                    answers=answers,
+                    has_premium=has_premium,
+                    processing_message_id=processing_message_id
+                )
+                after_commit(session, self._wakeup.set, on_rollback=lambda: self._active_users.discard(user_id))
+        except Exception:
+            self._active_users.discard(user_id)
+            raise
+
+        free_slots = max(0, self.max_in_flight - self._running)
+        position = max(0, self.depth - free_slots)
+
+        logger.info(
+            f"Queued generation job {job.id} for user {user_id}: position {position}, "
+            f"depth {self.depth}, running {self._running}"
+        )
+        return position
+
+    async def resume(self) -> int:
+        """
+        Re-drive jobs left pending or in progress before a restart.
+
+        Returns:
+            Number of unfinished jobs found
+        """
+        async with async_session_maker() as session:
+            requeued, abandoned = await GenerationJobCRUD.requeue_interrupted(
+                session, settings.GENERATION_MAX_ATTEMPTS
+            )
+            user_ids = await GenerationJobCRUD.get_active_user_ids(session)
+
+        for job in abandoned:
+            await self._notify_abandoned(job)
+
+        self._active_users.update(user_ids)
+        if user_ids:
+            self._wakeup.set()
+            logger.info(
+                f"Resuming {len(user_ids)} unfinished generation jobs "
+                f"({requeued} interrupted in progress)"
+            )
+        return len(user_ids)
+
+    def start(self) -> None:
+        """Start worker tasks."""
+        if self._workers:
+            return
+        for i in range(self.workers_count):
+            self._workers.append(asyncio.create_task(self._worker(i), name=f"generation-worker-{i}"))
+        logger.info(
+            f"Generation queue started: {self.workers_count} workers, "
+            f"max in flight {self.max_in_flight}, max depth {self.max_depth}"
+        )
+
+    async def stop(self) -> None:
+        """Cancel worker tasks and pending retries (unfinished jobs stay in the table for resume())."""
+        tasks = [*self._workers, *self._retries]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers.clear()
+        logger.info(f"Generation queue stopped, {self.depth} jobs left pending")
+
+    async def _wait_for_work(self) -> None:
+        """Sleep until a job is submitted (or the poll interval passes)."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _worker(self, index: int) -> None:
+        """Claim jobs from the table and run them through the handler."""
+        while True:
+            async with self._in_flight:
+                try:
+                    async with async_session_maker() as session:
+                        job = await GenerationJobCRUD.claim_next(session)
+                except Exception as e:
+                    logger.error(f"Generation worker {index} failed to claim job: {e}", exc_info=True)
+                    job = None
+
+                if job is not None:
+                    await self._run_job(index, job)
+                    continue
+
+            await self._wait_for_work()
+
+    async def _run_job(self, index: int, job: GenerationJob) -> None:
+        """Run claimed job and record its outcome."""
+        self._running += 1
+        retrying = False
+        logger.info(f"Generation worker {index} took job {job.id} (user {job.user_id}, attempt {job.attempts})")
+        try:
+            await self.handler(job)
+            async with async_session_maker() as session:
+                await GenerationJobCRUD.mark_done(session, job.id)
+        except asyncio.CancelledError:
+            # Shutdown: leave job in progress, resume() will re-drive it
+            raise
+        except Exception as e:
+            logger.error(
+                f"Generation job {job.id} for user {job.user_id} failed attempt "
+                f"{job.attempts}/{settings.GENERATION_MAX_ATTEMPTS}: {e}",
+                exc_info=True
+            )
+            retrying = job.attempts < settings.GENERATION_MAX_ATTEMPTS
+            if retrying:
+                # The user keeps their place; the job stays in progress until requeued
+                task = asyncio.create_task(self._retry(job, str(e)), name=f"generation-retry-{job.id}")
+                self._retries.add(task)
+                task.add_done_callback(self._retries.discard)
+            else:
+                await self._give_up(job, str(e))
+        finally:
+            self._running -= 1
+            if not retrying:
+                self._active_users.discard(job.user_id)
+
+    async def _retry(self, job: GenerationJob, error: str) -> None:
+        """Return failed job to the queue after a delay growing with its attempts."""
+        await asyncio.sleep(settings.GENERATION_RETRY_DELAY * job.attempts)
+        try:
+            async with async_session_maker() as session:
+                await GenerationJobCRUD.requeue_failed(session, job.id, error)
+        except Exception as e:
+            logger.error(f"Failed to requeue job {job.id}: {e}")
+            await self._give_up(job, error)
+            self._active_users.discard(job.user_id)
+            return
+        logger.info(f"Generation job {job.id} for user {job.user_id} back in the queue")
+        self._wakeup.set()
+
+    async def _give_up(self, job: GenerationJob, error: str) -> None:
+        """Mark job failed for good and tell the user."""
+        try:
+            async with async_session_maker() as session:
+                await GenerationJobCRUD.mark_failed(session, job.id, error)
+        except Exception as db_error:
+            logger.error(f"Failed to mark job {job.id} as failed: {db_error}")
+        await self._notify_abandoned(job)
+
+    async def _notify_abandoned(self, job: GenerationJob) -> None:
+        """Tell the user their job was given up."""
+        logger.warning(f"Generation job {job.id} for user {job.user_id} gave up after {job.attempts} attempts")
+        if self.on_abandoned is None:
+            return
+        try:
+            await self.on_abandoned(job)
+        except Exception as e:
+            logger.error(f"Failed to notify user {job.user_id} about job {job.id}: {e}")
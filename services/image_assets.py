@@ -0,0 +1,174 @@
+"""Process-wide cache of decoded image resources (cascades, templates, logo)."""
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).parent.parent
+OVERLAY_PATH = PROJECT_ROOT / "overlay.png"
+LOGO_PATH = Path("logo.png")
+
+
+class ImageAssets:
+    """
+    Keep Haar cascades and decoded images resident in memory.
+
+    Everything is loaded lazily on first access and then reused, so a photo
+    request does no repeated classifier parsing or image decoding. Call
+    warm_up() at startup to pay the loading cost before the first user.
+    Cached images are shared between requests and must not be modified
+    in place - callers copy before drawing on them.
+    """
+
+    def __init__(self):
+        """Initialize empty asset cache."""
+        self.templates_dir = settings.IMAGES_DIR / "templates"
+        self.new_templates_dir = settings.IMAGES_DIR / "new_templates"
+
+        self._lock = threading.Lock()
+        self._cascades: Dict[str, cv2.CascadeClassifier] = {}
+        self._bgr_images: Dict[Path, Optional[np.ndarray]] = {}
+        self._rgba_images: Dict[Path, Optional[Image.Image]] = {}
+        self._template_lists: Dict[str, List[Path]] = {}
+        self._resized_logos: Dict[Tuple[int, int], Optional[Image.Image]] = {}
+
+    def warm_up(self) -> None:
+        """Load cascades, templates and logo into memory."""
+        self.frontal_cascade
+        self.profile_cascade
+
+        for gender in ("male", "female"):
+            for template_path in self.list_new_templates(gender):
+                self.get_bgr(template_path)
+
+            legacy_template = self.templates_dir / f"figure_{gender}.png"
+            if legacy_template.exists():
+                self.get_rgba(legacy_template)
+
+        self.logo
+
+        logger.info(
+            f"Image assets warmed up: {len(self._cascades)} cascades, "
+            f"{len(self._bgr_images) + len(self._rgba_images)} images"
+        )
+
+    def _get_cascade(self, name: str) -> cv2.CascadeClassifier:
+        """Load Haar cascade by file name once."""
+        cascade = self._cascades.get(name)
+        if cascade is None:
+            with self._lock:
+                cascade = self._cascades.get(name)
+                if cascade is None:
+                    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+                    if cascade.empty():
+                        logger.error(f"Failed to load Haar cascade {name}")
+                    self._cascades[name] = cascade
+        return cascade
+
+    @property
+    def frontal_cascade(self) -> cv2.CascadeClassifier:
+        """Frontal face cascade classifier."""
+        return self._get_cascade('haarcascade_frontalface_default.xml')
+
+    @property
+    def profile_cascade(self) -> cv2.CascadeClassifier:
+        """Profile face cascade classifier."""
+        return self._get_cascade('haarcascade_profileface.xml')
+
+    def list_new_templates(self, gender: str) -> List[Path]:
+        """
+        List templates from new_templates directory (scanned once).
+
+        Args:
+            gender: 'male' or 'female'
+
+        Returns:
+            Sorted list of template paths
+        """
+        templates = self._template_lists.get(gender)
+        if templates is None:
+            pattern = f"figure_{gender}*.png"
+            if self.new_templates_dir.exists():
+                templates = sorted(self.new_templates_dir.glob(pattern))
+            else:
+                templates = []
+            self._template_lists[gender] = templates
+        return templates
+
+    def get_bgr(self, path: Path) -> Optional[np.ndarray]:
+        """
+        Get image decoded by OpenCV (BGR), loading it once.
+
+        Args:
+            path: Image path
+
+        Returns:
+            Shared BGR array or None if file can't be read
+        """
+        path = Path(path)
+        if path not in self._bgr_images:
+            image = cv2.imread(str(path))
+            with self._lock:
+                self._bgr_images[path] = image
+        return self._bgr_images[path]
+
+    def get_rgba(self, path: Path) -> Optional[Image.Image]:
+        """
+        Get image decoded by Pillow as RGBA, loading it once.
+
+        Args:
+            path: Image path
+
+        Returns:
+            Shared RGBA image or None if file doesn't exist
+        """
+        path = Path(path)
+        if path not in self._rgba_images:
+            image = None
+            if path.exists():
+                with Image.open(path) as source:
+                    image = source.convert("RGBA")
+            with self._lock:
+                self._rgba_images[path] = image
+        return self._rgba_images[path]
+
+    @property
+    def logo(self) -> Optional[Image.Image]:
+        """Decoded logo.png (RGBA) or None if missing."""
+        return self.get_rgba(LOGO_PATH)
+
+    def get_logo_resized(self, size: Tuple[int, int]) -> Optional[Image.Image]:
+        """
+        Get logo resized to given size, cached per size.
+
+        Args:
+            size: Target (width, height)
+
+        Returns:
+            Resized RGBA logo or None if logo is missing
+        """
+        if size not in self._resized_logos:
+            logo = self.logo
+            resized = logo.resize(size, Image.Resampling.LANCZOS) if logo is not None else None
+            with self._lock:
+                self._resized_logos[size] = resized
+        return self._resized_logos[size]
+
+
+_assets: Optional[ImageAssets] = None
+
+
+def get_image_assets() -> ImageAssets:
+    """Get process-wide ImageAssets instance (created on first call)."""
+    global _assets
+    if _assets is None:
+        _assets = ImageAssets()
+    return _assets
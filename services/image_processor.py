@@ -11,6 +11,8 @@ from PIL import Image, ImageDraw, ImageFont
 from config import settings
 from services.ai_generator import AIImageGenerator
 from services.face_swapper import FaceSwapper
+from services.image_assets import ImageAssets, get_image_assets
+from services.overlay_compositor import DALLE_IMAGE_SIZE
 from services.template_generator import TemplateGenerator
 
 logger = logging.getLogger(__name__)
@@ -27,22 +29,61 @@ CANVAS_SIZE: Tuple[int, int] = (800, 1200)
 class ImageProcessor:
     """Process images and create personalized Christmas figures."""
 
-    def __init__(self):
+    def __init__(self, assets: Optional[ImageAssets] = None):
         """Initialize image processor."""
+        self.assets = assets or get_image_assets()
         self.templates_dir = settings.IMAGES_DIR / "templates"
         self.templates_dir.mkdir(parents=True, exist_ok=True)
         self.logo_path = Path("logo.png")
         self.font_path = Path("arial.ttf")
 
-        # Initialize Services
-        self.template_generator = TemplateGenerator()
-        self.ai_generator = AIImageGenerator()
-        self.face_swapper = FaceSwapper()
+        # Initialize Services (all share one asset cache)
+        self.template_generator = TemplateGenerator(self.assets)
+        self.ai_generator = AIImageGenerator(self.assets)
+        self.face_swapper = FaceSwapper(self.assets)
+
+        # Shared cascade, loaded once per process
+        self.face_cascade = self.assets.frontal_cascade
+
+    def warm_up(self) -> None:
+        """Load cascades, templates, logo and the overlay for DALL-E size before the first request."""
+        self.assets.warm_up()
+        self.ai_generator.overlay_compositor.prepare(DALLE_IMAGE_SIZE)
+
+    async def close(self) -> None:
+        """Release network resources held by services (call on shutdown)."""
+        await self.ai_generator.close()
+
+    def prewarm_generation(self, user_photo_path: Path, gender: str, user_id: int) -> None:
+        """Start Gemini analysis for an accepted photo ahead of its queue turn."""
+        if (
+            settings.GENERATION_PREWARM_ENABLED
+            and settings.AI_GENERATION_ENABLED
+            and settings.OPENAI_API_KEY
+        ):
+            self.ai_generator.start_prewarm(user_id, user_photo_path, gender)
+
+    def cancel_prewarm(self, user_id: int) -> None:
+        """Cancel speculative analysis of an abandoned session."""
+        self.ai_generator.prewarm.cancel(user_id)
+
+    def count_faces(self, image_path: Path) -> Optional[int]:
+        """
+        Count faces on uploaded photo using the shared cascade.
 
-        # Pre-load resources to save time during request
-        self.face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        )
+        Args:
+            image_path: Path to photo
+
+        Returns:
+            Number of detected faces or None if image can't be read
+        """
+        img = cv2.imread(str(image_path))
+        if img is None:
+            return None
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+        return len(faces)
 
     async def create_christmas_figure(
         self,
@@ -222,8 +263,9 @@ class ImageProcessor:
             Template image
         """
         template_path = self.templates_dir / f"figure_{gender}.png"
-        if template_path.exists():
-            return Image.open(template_path).convert("RGBA")
+        template = self.assets.get_rgba(template_path)
+        if template is not None:
+            return template
         return self._create_default_template()
 
     def _composite_face_on_template(self, template: Image.Image, face: Image.Image) -> Image.Image:
@@ -264,7 +306,8 @@ class ImageProcessor:
         Returns:
             Image with logo overlay
         """
-        if not self.logo_path.exists():
+        logo = self.assets.logo
+        if logo is None:
             return image
 
         try:
@@ -274,14 +317,12 @@ class ImageProcessor:
             else:
                 base = image.copy()
 
-            logo = Image.open(self.logo_path).convert("RGBA")
-
             # Calc dimensions (max 30% width)
             max_width = int(base.width * 0.3)
             ratio = max_width / logo.width
             new_size = (max_width, int(logo.height * ratio))
 
-            logo = logo.resize(new_size, Image.Resampling.LANCZOS)
+            logo = self.assets.get_logo_resized(new_size)
 
             # Position bottom center
             x = (base.width - new_size[0]) // 2
@@ -357,3 +398,14 @@ class ImageProcessor:
         output_path = settings.GENERATED_PHOTOS_DIR / f"{user_id}_christmas.jpg"
         img.convert("RGB").save(output_path, "JPEG", quality=95)
         return output_path
+
+
+_processor: Optional[ImageProcessor] = None
+
+
+def get_image_processor() -> ImageProcessor:
+    """Get process-wide ImageProcessor instance (created on first call)."""
+    global _processor
+    if _processor is None:
+        _processor = ImageProcessor()
+    return _processor
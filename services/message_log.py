@@ -0,0 +1,118 @@
+"""Write-behind log of relayed forum messages (user_messages table)."""
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from config import settings
+from database.crud import UserMessageCRUD
+from database.engine import async_session_maker
+
+logger = logging.getLogger(__name__)
+
+
+class MessageLogBuffer:
+    """
+    Buffer of UserMessage rows written in batches by one background task.
+
+    Relaying a message only appends a row; the flusher inserts everything
+    buffered with one multi-row INSERT and one commit as soon as batch_size
+    rows are waiting, and at least every flush_interval seconds otherwise.
+    stop() flushes what is left, so a clean shutdown loses nothing.
+
+    Memory is bounded by max_pending rows: when the buffer is that full
+    (the database is slow or failing), log() waits for a flush. If a flush
+    fails the rows go back into the buffer for the next attempt; rows over
+    max_pending are then dropped, oldest first, with an error in the log.
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None, max_pending: int = None):
+        """Initialize buffer."""
+        self.batch_size = batch_size or settings.MESSAGE_LOG_BATCH
+        self.flush_interval = flush_interval if flush_interval is not None else settings.MESSAGE_LOG_FLUSH_INTERVAL
+        self.max_pending = max(max_pending or settings.MESSAGE_LOG_MAX_PENDING, self.batch_size)
+        self._buffer: List[dict] = []
+        self._lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        """Rows waiting to be written."""
+        return len(self._buffer)
+
+    def start(self) -> None:
+        """Start flusher task."""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="message-log-flusher")
+            logger.info("Message log flusher started")
+
+    async def stop(self) -> None:
+        """Stop flusher task and write remaining rows."""
+        if self._task is not None:
+            # Let a flush in progress finish instead of cancelling it with its batch
+            self._stopping = True
+            self._batch_ready.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._buffer:
+            logger.error(f"Message log: {len(self._buffer)} rows not written on shutdown")
+        logger.info(f"Message log flusher stopped ({self.written} rows written)")
+
+    async def log(
+        self,
+        user_id: int,
+        forum_message_id: int,
+        user_message_id: int | None,
+        direction: str
+    ) -> None:
+        """Buffer a message exchange (see UserMessageCRUD.log_message)."""
+        if len(self._buffer) >= self.max_pending:
+            await self.flush()
+        self._buffer.append({
+            "user_id": user_id,
+            "forum_message_id": forum_message_id,
+            "user_message_id": user_message_id,
+            "direction": direction,
+            "created_at": datetime.utcnow()
+        })
+        if len(self._buffer) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self) -> None:
+        """Write buffered rows."""
+        async with self._lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            try:
+                async with async_session_maker() as session:
+                    await UserMessageCRUD.log_messages(session, batch)
+            except asyncio.CancelledError:
+                self._buffer = batch + self._buffer
+                raise
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} message log rows: {e}", exc_info=True)
+                self._buffer = batch + self._buffer
+                overflow = len(self._buffer) - self.max_pending
+                if overflow > 0:
+                    del self._buffer[:overflow]
+                    self.dropped += overflow
+                    logger.error(f"Message log buffer full, dropped {overflow} oldest rows")
+                return
+            self.written += len(batch)
+
+    async def _run(self) -> None:
+        """Flush when a batch is full or the interval has passed."""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
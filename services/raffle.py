@@ -0,0 +1,125 @@
+"""
+Verifiable raffle draw.
+
+Winners are the participants with the smallest SHA-256("<seed>:<user id>").
+With the published seed and the participant IDs (checked against the
+stored participants_hash), anyone can repeat the draw:
+
+    from services.raffle import draw_winners, participants_hash
+    assert participants_hash(ids) == draw.participants_hash
+    assert draw_winners(ids, draw.seed, len(draw.winner_ids)) == draw.winner_ids
+
+The ranking does not depend on the order of IDs or on any PRNG
+implementation, so the result is the same on every Python version.
+"""
+import asyncio
+import hashlib
+import heapq
+import logging
+import secrets
+from typing import Iterable, List
+
+from aiogram import Bot
+
+from database.crud import RaffleCRUD
+from database.engine import async_session_maker
+from database.models import RaffleDraw
+from services.broadcast import BroadcastResult, Broadcaster
+
+logger = logging.getLogger(__name__)
+
+WINNER_TEXT = (
+    "<b>Поздравляем!</b> 🎉\n\n"
+    "Вы стали победителем в розыгрыше сертификатов от СК ПРАЙД!\n\n"
+    "С вами свяжется администратор для получения приза."
+)
+
+# One draw at a time: the winners check and the UPDATE must not interleave
+_draw_lock = asyncio.Lock()
+
+
+class RaffleAlreadyConductedError(Exception):
+    """Raised when winners are already marked."""
+
+
+class NoParticipantsError(Exception):
+    """Raised when nobody completed the quiz."""
+
+
+def participants_hash(participant_ids: Iterable[int]) -> str:
+    """SHA-256 of participant IDs, sorted ascending, one per line."""
+    digest = hashlib.sha256()
+    for user_id in sorted(participant_ids):
+        digest.update(f"{user_id}\n".encode())
+    return digest.hexdigest()
+
+
+def _rank(seed: str, user_id: int) -> bytes:
+    """Position of user in the draw for seed (smaller wins)."""
+    return hashlib.sha256(f"{seed}:{user_id}".encode()).digest()
+
+
+def draw_winners(participant_ids: Iterable[int], seed: str, count: int) -> List[int]:
+    """
+    Pick count winners reproducibly for seed.
+
+    Returns:
+        Winner IDs in draw order (best rank first)
+    """
+    return heapq.nsmallest(count, participant_ids, key=lambda user_id: _rank(seed, user_id))
+
+
+async def conduct_draw(admin_id: int, winners_count: int, seed: str = None) -> RaffleDraw:
+    """
+    Draw winners among quiz participants and mark them.
+
+    Participant IDs come from a covering index; all winners are marked
+    and the audit record stored in one transaction. The ranking is not
+    pushed into SQL (ORDER BY the seeded hash LIMIT count): the audit
+    hash needs every participant ID loaded anyway, and SQLite has no
+    SHA-256, so the ORDER BY would call a Python function for each row
+    from inside SQLite, which is slower than ranking the loaded IDs.
+
+    Args:
+        admin_id: Admin conducting the raffle
+        winners_count: Prizes (fewer winners if fewer participants)
+        seed: Hex seed (random 256-bit by default)
+
+    Raises:
+        RaffleAlreadyConductedError: Winners already exist
+        NoParticipantsError: Nobody completed the quiz
+    """
+    seed = seed or secrets.token_hex(32)
+    async with _draw_lock:
+        async with async_session_maker() as session:
+            if await RaffleCRUD.has_winners(session):
+                raise RaffleAlreadyConductedError()
+            participant_ids = await RaffleCRUD.get_participant_ids(session)
+            if not participant_ids:
+                raise NoParticipantsError()
+
+            winner_ids = draw_winners(participant_ids, seed, winners_count)
+            draw = await RaffleCRUD.record_draw(
+                session,
+                admin_id=admin_id,
+                seed=seed,
+                participants_hash=participants_hash(participant_ids),
+                participants_count=len(participant_ids),
+                winner_ids=winner_ids
+            )
+
+    logger.info(
+        f"Raffle draw {draw.id}: {len(winner_ids)} winners of {draw.participants_count} participants, "
+        f"seed {seed}, participants hash {draw.participants_hash}"
+    )
+    return draw
+
+
+async def notify_winners(bot: Bot, winner_ids: List[int], broadcaster: Broadcaster = None) -> BroadcastResult:
+    """Send congratulations to winners through the rate-limited broadcaster."""
+    broadcaster = broadcaster or Broadcaster()
+
+    async def send(user_id: int):
+        await bot.send_message(chat_id=user_id, text=WINNER_TEXT)
+
+    return await broadcaster.run(winner_ids, send)
@@ -8,6 +8,7 @@ import cv2
 import numpy as np
 
 from config import settings
+from services.image_assets import ImageAssets, get_image_assets
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +16,10 @@ logger = logging.getLogger(__name__)
 class TemplateGenerator:
     """Generate personalized images using pre-made 3D templates."""
 
-    def __init__(self):
+    def __init__(self, assets: Optional[ImageAssets] = None):
         """Initialize template generator."""
+        self.assets = assets or get_image_assets()
+
         self.templates_dir = settings.IMAGES_DIR / "templates"
         self.templates_dir.mkdir(exist_ok=True)
 
@@ -29,9 +32,8 @@ class TemplateGenerator:
         self.male_template = self._find_template("male")
         self.female_template = self._find_template("female")
 
-        # Pre-load face cascade classifier (performance optimization)
-        cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        self.face_cascade = cv2.CascadeClassifier(cascade_path)
+        # Shared face cascade classifier (loaded once per process)
+        self.face_cascade = self.assets.frontal_cascade
 
         if self.face_cascade.empty():
             logger.error("Failed to load Haar Cascade classifier")
@@ -65,9 +67,8 @@ class TemplateGenerator:
         Returns:
             Path to randomly selected template
         """
-        # Look for templates with pattern: figure_{gender}*.png
-        pattern = f"figure_{gender}*.png"
-        templates = list(self.new_templates_dir.glob(pattern))
+        # Look for templates with pattern: figure_{gender}*.png (scanned once)
+        templates = self.assets.list_new_templates(gender)
 
         if not templates:
             # Fallback to old templates
@@ -129,12 +130,13 @@ class TemplateGenerator:
 
             logger.info(f"Using template: {template_path}")
 
-            # Load images
-            template = cv2.imread(str(template_path))
+            # Load images (template is decoded once and kept in memory)
+            template = self.assets.get_bgr(template_path)
             user_photo = cv2.imread(str(user_photo_path))
 
             if template is None:
                 raise Exception(f"Failed to load template: {template_path}")
+            template = template.copy()
             if user_photo is None:
                 raise Exception(f"Failed to load user photo: {user_photo_path}")
 
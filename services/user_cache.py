@@ -0,0 +1,196 @@
+"""
+In-memory cache of hot user attributes for per-message lookups.
+
+Message relaying needs a user's forum topic (user -> forum) or the user
+of a topic (forum -> user) for every message. UserCache keeps a bounded
+LRU of user snapshots with a reverse topic -> user index, so repeated
+lookups do not touch the database. Every committed write to users in
+database.crud drops the affected users (see crud.on_user_write); the TTL
+only bounds staleness after writes made outside crud.
+"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from database.crud import UserCRUD, on_user_write
+from database.engine import async_session_maker
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Snapshot of the user attributes read on hot paths."""
+
+    id: int
+    forum_topic_id: Optional[int]
+    pride_gift_id: Optional[int]
+    gender: Optional[str]
+    quiz_completed: bool
+    photo_uploaded: bool
+    is_winner: bool
+    is_reachable: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "CachedUser":
+        """Snapshot of a loaded User."""
+        return cls(
+            id=user.id,
+            forum_topic_id=user.forum_topic_id,
+            pride_gift_id=user.pride_gift_id,
+            gender=user.gender,
+            quiz_completed=bool(user.quiz_completed),
+            photo_uploaded=bool(user.photo_uploaded),
+            is_winner=bool(user.is_winner),
+            is_reachable=bool(user.is_reachable)
+        )
+
+
+class UserCache:
+    """
+    Bounded LRU/TTL cache of CachedUser by user ID and by forum topic.
+
+    Unknown users and topics without a user are cached too (as None),
+    since most private messages come from users without a topic. A load
+    that overlaps an invalidation is returned but not stored, so a value
+    read before a write commits cannot outlive it in the cache.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        """Initialize cache."""
+        self.max_entries = max_entries or settings.USER_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.USER_CACHE_TTL
+        self._users: "OrderedDict[int, Tuple[float, Optional[CachedUser]]]" = OrderedDict()
+        self._topics: Dict[int, int] = {}
+        self._missing_topics: "OrderedDict[int, float]" = OrderedDict()
+        self._generation = 0
+        self.hits = {"user": 0, "topic": 0}
+        self.misses = {"user": 0, "topic": 0}
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _lookup(self, user_id: int) -> Tuple[bool, Optional[CachedUser]]:
+        """Get (found, user) from cache, dropping an expired entry."""
+        entry = self._users.get(user_id)
+        if entry is None:
+            return False, None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._drop(user_id)
+            return False, None
+        self._users.move_to_end(user_id)
+        return True, user
+
+    def _drop(self, user_id: int) -> None:
+        """Remove user and their topic from the indexes."""
+        entry = self._users.pop(user_id, None)
+        if entry is None or entry[1] is None:
+            return
+        topic_id = entry[1].forum_topic_id
+        if topic_id is not None and self._topics.get(topic_id) == user_id:
+            del self._topics[topic_id]
+
+    def _store(self, user_id: int, user: Optional[CachedUser], generation: int) -> None:
+        """Put user into cache unless an invalidation happened since generation."""
+        if generation != self._generation:
+            return
+        self._drop(user_id)
+        self._users[user_id] = (time.monotonic() + self.ttl, user)
+        if user is not None and user.forum_topic_id is not None:
+            self._topics[user.forum_topic_id] = user_id
+            self._missing_topics.pop(user.forum_topic_id, None)
+        while len(self._users) > self.max_entries:
+            self._drop(next(iter(self._users)))
+            self.evictions += 1
+
+    async def get(self, user_id: int) -> Optional[CachedUser]:
+        """Get user by ID (None if not registered)."""
+        found, user = self._lookup(user_id)
+        if found:
+            self.hits["user"] += 1
+            return user
+
+        self.misses["user"] += 1
+        generation = self._generation
+        async with async_session_maker() as session:
+            row = await UserCRUD.get(session, user_id)
+        user = CachedUser.from_user(row) if row else None
+        self._store(user_id, user, generation)
+        return user
+
+    async def get_by_topic(self, topic_id: int) -> Optional[CachedUser]:
+        """Get user whose forum topic is topic_id (None if no user has it)."""
+        user_id = self._topics.get(topic_id)
+        if user_id is not None:
+            found, user = self._lookup(user_id)
+            if found and user is not None and user.forum_topic_id == topic_id:
+                self.hits["topic"] += 1
+                return user
+        expires_at = self._missing_topics.get(topic_id)
+        if expires_at is not None and expires_at >= time.monotonic():
+            self.hits["topic"] += 1
+            return None
+
+        self.misses["topic"] += 1
+        generation = self._generation
+        async with async_session_maker() as session:
+            row = await UserCRUD.get_by_forum_topic(session, topic_id)
+        if row:
+            user = CachedUser.from_user(row)
+            self._store(user.id, user, generation)
+            return user
+        if generation == self._generation:
+            self._missing_topics[topic_id] = time.monotonic() + self.ttl
+            self._missing_topics.move_to_end(topic_id)
+            while len(self._missing_topics) > self.max_entries:
+                self._missing_topics.popitem(last=False)
+        return None
+
+    def invalidate(self, user_ids: Optional[List[int]] = None) -> None:
+        """
+        Drop users after a write (all users if user_ids is None).
+
+        Topics cached as having no user are dropped as well: the write may
+        have given one of them to a user.
+        """
+        self._generation += 1
+        self.invalidations += 1
+        self._missing_topics.clear()
+        if user_ids is None:
+            self._users.clear()
+            self._topics.clear()
+            return
+        for user_id in user_ids:
+            self._drop(user_id)
+
+    def stats(self) -> Dict[str, float]:
+        """Get hit/miss counters, hit rates and size."""
+        stats = {}
+        for kind in ("user", "topic"):
+            total = self.hits[kind] + self.misses[kind]
+            stats[f"{kind}_hits"] = self.hits[kind]
+            stats[f"{kind}_misses"] = self.misses[kind]
+            stats[f"{kind}_hit_rate"] = self.hits[kind] / total if total else 0.0
+        stats.update(
+            size=len(self._users),
+            topics=len(self._topics),
+            invalidations=self.invalidations,
+            evictions=self.evictions
+        )
+        return stats
+
+
+_user_cache: Optional[UserCache] = None
+
+
+def get_user_cache() -> UserCache:
+    """Get process-wide UserCache instance (created and subscribed to user writes on first call)."""
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = UserCache()
+        on_user_write(_user_cache.invalidate)
+    return _user_cache
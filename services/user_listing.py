@@ -0,0 +1,117 @@
+"""Paginated admin user lists: one keyset query per page, short-lived page cache."""
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from database.crud import UserCRUD
+from database.engine import async_session_maker
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+# Page flips back and forth within this time reuse the loaded page
+PAGE_CACHE_TTL = 30.0
+PAGE_CACHE_MAX_ENTRIES = 256
+
+
+class UserListing:
+    """
+    Page through an audience (see database.crud.audience_conditions) in ID order.
+
+    A listing is a small dict kept in FSM state instead of the whole list
+    of user IDs: the audience, its total (counted once when the listing is
+    opened) and the last ID before each page visited so far. Each page is
+    one WHERE id > cursor ORDER BY id LIMIT n query, so a page flip costs
+    the same however large the audience is.
+
+    Broadcast recipient lists skip users who blocked the bot, like the
+    broadcast itself; other admin lists (certificates) open with
+    include_unreachable and show every user of the audience.
+    """
+
+    def __init__(self, ttl: float = PAGE_CACHE_TTL, max_entries: int = PAGE_CACHE_MAX_ENTRIES):
+        """Initialize listing service."""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._pages: "OrderedDict[Tuple[str, bool, int, int], Tuple[float, List[User]]]" = OrderedDict()
+
+    async def open(self, audience: str, include_unreachable: bool = False) -> dict:
+        """
+        Start listing audience.
+
+        Args:
+            audience: Filter type (see database.crud.audience_conditions)
+            include_unreachable: Also list users who blocked the bot
+
+        Returns:
+            Listing state to store in FSM (pass to get_page)
+        """
+        async with async_session_maker() as session:
+            total = await UserCRUD.count_users_by_filter(session, audience, include_unreachable)
+        return {"audience": audience, "include_unreachable": include_unreachable, "total": total, "cursors": [0]}
+
+    @staticmethod
+    def total_pages(listing: dict, page_size: int) -> int:
+        """Number of pages in listing (at least 1)."""
+        return max(1, math.ceil(listing["total"] / page_size))
+
+    def _cached(self, key: Tuple[str, bool, int, int]) -> Optional[List[User]]:
+        """Get page from cache unless expired."""
+        cached = self._pages.get(key)
+        if cached is None:
+            return None
+        expires_at, users = cached
+        if expires_at < time.monotonic():
+            del self._pages[key]
+            return None
+        return users
+
+    def _remember(self, key: Tuple[str, bool, int, int], users: List[User]) -> None:
+        """Put page into cache, dropping the oldest entries over the limit."""
+        self._pages[key] = (time.monotonic() + self.ttl, users)
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_entries:
+            self._pages.popitem(last=False)
+
+    async def get_page(self, listing: dict, page: int, page_size: int) -> Tuple[int, List[User]]:
+        """
+        Load a page of listing.
+
+        Pages are reached one step at a time from the first, so the cursor
+        of a requested page is normally known; otherwise the furthest known
+        page is shown. Records the cursor of the next page in listing (save
+        it back to FSM state).
+
+        Returns:
+            (page shown, users on it)
+        """
+        cursors = listing["cursors"]
+        page = max(0, min(page, len(cursors) - 1))
+        # Listings saved in FSM state before include_unreachable existed were broadcast lists
+        include_unreachable = listing.get("include_unreachable", False)
+        key = (listing["audience"], include_unreachable, cursors[page], page_size)
+
+        users = self._cached(key)
+        if users is None:
+            async with async_session_maker() as session:
+                users = await UserCRUD.get_users_page(
+                    session, listing["audience"], cursors[page], page_size, include_unreachable
+                )
+            self._remember(key, users)
+
+        if len(users) == page_size and page == len(cursors) - 1:
+            cursors.append(users[-1].id)
+        return page, users
+
+
+_user_listing: Optional[UserListing] = None
+
+
+def get_user_listing() -> UserListing:
+    """Get process-wide UserListing instance (created on first call)."""
+    global _user_listing
+    if _user_listing is None:
+        _user_listing = UserListing()
+    return _user_listing